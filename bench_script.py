@@ -0,0 +1,238 @@
+"""Benchmarks Script.parse, Script.raw_serialize and Script.evaluate over a
+fixed corpus of scripts and prints the results as JSON.
+
+    python bench_script.py [--filter NAME] [--repeat N] [--trace] [--output FILE]
+
+Keys, signatures and the signature hash are fixed, so every run measures
+exactly the same work.
+"""
+import argparse
+import hashlib
+import json
+import platform
+import sys
+import timeit
+import tracemalloc
+from io import BytesIO
+
+from ecc import PrivateKey
+from helper import hash160, hash256
+from op import encode_num
+from script import Script, ScriptLimitError, ScriptTracer
+
+Z = int.from_bytes(hash256(b'ecc-py script benchmark'), 'big')
+KEYS = [PrivateKey(secret) for secret in range(1001, 1021)]
+SECS = [key.point.sec() for key in KEYS]
+# DER signature with SIGHASH_ALL on the end
+SIGS = [key.sign(Z).der() + b'\x01' for key in KEYS]
+SECRET = b'benchmark preimage'
+
+
+def number(n):
+    """OP_1 to OP_16 for small numbers, a push for anything else"""
+    if 1 <= n <= 16:
+        return 0x50 + n
+    return encode_num(n)
+
+
+def p2pkh():
+    script_sig = [SIGS[0], SECS[0]]
+    script_pubkey = [0x76, 0xa9, hash160(SECS[0]), 0x88, 0xac]
+    return script_sig + script_pubkey
+
+
+def multisig(m, n, first=0, p2sh=True):
+    """m-of-n multisig signed by keys first to first + m, either as a P2SH
+    input or as a bare multisig ScriptPubKey
+    """
+    script_sig = [b''] + SIGS[first:first + m]
+    redeem_script = [number(m)] + SECS[:n] + [number(n), 0xae]
+    if not p2sh:
+        return script_sig + redeem_script
+    raw_redeem = Script(redeem_script).raw_serialize()
+    return script_sig + [raw_redeem, 0xa9, hash160(raw_redeem), 0x87]
+
+
+def htlc(branch):
+    """Hash time locked contract with nested branches: claim with the
+    preimage, refund by the second key or a 1-of-2 escape hatch
+    """
+    if branch == 'claim':
+        script_sig = [SIGS[0], SECS[0], SECRET, b'\x01']
+    elif branch == 'refund':
+        script_sig = [SIGS[1], SECS[1], b'\x01', b'']
+    else:
+        script_sig = [b'', SIGS[2], b'', b'']
+    script = [
+        0x63,  # OP_IF
+        0xa8, hashlib.sha256(SECRET).digest(), 0x88,  # OP_SHA256 <hash> OP_EQUALVERIFY
+        0x76, 0xa9, hash160(SECS[0]), 0x88, 0xac,
+        0x67,  # OP_ELSE
+        0x63,  # OP_IF
+        0x76, 0xa9, hash160(SECS[1]), 0x88, 0xac,
+        0x67,  # OP_ELSE
+        0x51, SECS[3], SECS[2], 0x52, 0xae,
+        0x68,  # OP_ENDIF
+        0x68,  # OP_ENDIF
+    ]
+    return script_sig + script
+
+
+def hash_chain(count):
+    """OP_SHA256/OP_HASH160/OP_HASH256 over a 520 byte element"""
+    return [bytes(520)] + [0xa8, 0xa9, 0xaa] * count
+
+
+def stack_shuffle(rounds):
+    """Pushes and then rotates, swaps, picks and rolls the stack around"""
+    cmds = [bytes([i]) * 32 for i in range(1, 9)]
+    for _ in range(rounds):
+        # OP_ROT OP_SWAP OP_2SWAP OP_3 OP_PICK OP_4 OP_ROLL OP_TUCK OP_DROP OP_OVER OP_NIP
+        cmds += [0x7b, 0x7c, 0x72, 0x53, 0x79, 0x54, 0x7a, 0x7d, 0x75, 0x78, 0x77]
+    return cmds
+
+
+def counter(count):
+    """Counts up to count with OP_1ADD and checks the result"""
+    # OP_DUP OP_0 <count + 1> OP_WITHIN OP_VERIFY <count> OP_NUMEQUAL
+    return [0x00] + [0x8b] * count + [0x76, 0x00, encode_num(count + 1), 0xa5, 0x69, encode_num(count), 0x9c]
+
+
+def dup_hash_bomb():
+    """Grows the stack with 520 byte elements and hashes all of them"""
+    cmds = [bytes(520)] * 3
+    while len(cmds) < 400:
+        cmds += [0x6f, 0xaa, 0xaa, 0xaa]
+    return cmds
+
+
+def nested_ifs(depth):
+    """Every OP_IF rescans the rest of the script"""
+    return [b'\x01'] * depth + [0x63] * depth + [0x51] + [0x68] * depth
+
+
+# name -> (cmds, expected result), a string result is the reason of the
+# ScriptLimitError the script has to raise
+CORPUS = {
+    'p2pkh': (p2pkh(), True),
+    'p2sh_multisig_2of3': (multisig(2, 3), True),
+    'p2sh_multisig_3of3': (multisig(3, 3), True),
+    'p2sh_multisig_11of15': (multisig(11, 15), True),
+    'htlc_claim': (htlc('claim'), True),
+    'htlc_refund': (htlc('refund'), True),
+    'htlc_escape': (htlc('escape'), True),
+    'hash_chain': (hash_chain(20), True),
+    'stack_shuffle': (stack_shuffle(15), True),
+    'counter': (counter(150), True),
+    # adversarial
+    # the only signature belongs to the pubkey that is checked last, too
+    # many pubkeys for a RedeemScript so this is bare multisig
+    'multisig_1of20_worst_order': (multisig(1, 20, p2sh=False), True),
+    'dup_hash_bomb': (dup_hash_bomb(), 'ops'),
+    'nested_ifs': (nested_ifs(150), True),
+    'stack_flood': ([b'\x01'] * 1001, 'stack'),
+}
+
+
+def evaluate(script, tracer=None):
+    try:
+        return script.evaluate(Z, tracer=tracer)
+    except ScriptLimitError as e:
+        return e.reason
+
+
+def measure(func, repeat):
+    """Returns the best calls per second over repeat runs"""
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    best = min(timer.repeat(repeat=repeat, number=number))
+    return number / best
+
+
+def memory(func):
+    """Returns (peak bytes, allocations) of running func. The peak is the
+    most memory allocated at once, allocations counts the memory blocks
+    func allocated that are still in use when it returns, such as the
+    ones of what it returns.
+    """
+    tracemalloc.start()
+    try:
+        result = func()
+        peak = tracemalloc.get_traced_memory()[1]
+        snapshot = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+    del result
+    snapshot = snapshot.filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+    return peak, sum(stat.count for stat in snapshot.statistics('filename'))
+
+
+def bench(name, cmds, expected, repeat=5, trace=False):
+    raw = Script(cmds).serialize()
+    script = Script.parse(BytesIO(raw))
+    result = evaluate(script)
+    if result != expected:
+        raise AssertionError('{} evaluated to {}, expected {}'.format(name, result, expected))
+
+    def parse():
+        # Script.parse only reads the bytes, the cmds are split out the
+        # first time they are asked for
+        parsed = Script.parse(BytesIO(raw))
+        parsed.cmds
+        return parsed
+
+    def fresh_serialize():
+        Script(cmds).raw_serialize()
+
+    tracer = ScriptTracer()
+    evaluate(script, tracer)
+    evaluate_per_sec = measure(lambda: evaluate(script), repeat)
+    ops = sum(stats[0] for stats in tracer.ops.values())
+    parse_peak, parse_allocations = memory(parse)
+    evaluate_peak, evaluate_allocations = memory(lambda: evaluate(script))
+    stats = {
+        'name': name,
+        'bytes': len(raw),
+        'cmds': len(cmds),
+        'ops': ops,
+        'result': result,
+        'parse_per_sec': measure(parse, repeat),
+        'raw_serialize_per_sec': measure(fresh_serialize, repeat),
+        'evaluate_per_sec': evaluate_per_sec,
+        'ops_per_sec': ops * evaluate_per_sec,
+        'parse_peak_bytes': parse_peak,
+        'parse_allocations': parse_allocations,
+        'evaluate_peak_bytes': evaluate_peak,
+        'evaluate_allocations': evaluate_allocations,
+    }
+    if trace:
+        stats['trace'] = tracer.report()
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--filter', default='', help='only run scripts whose name contains this')
+    parser.add_argument('--repeat', type=int, default=5, help='timing runs per measurement')
+    parser.add_argument('--trace', action='store_true', help='include a per-opcode trace')
+    parser.add_argument('--output', help='write the JSON here instead of stdout')
+    args = parser.parse_args(argv)
+    results = {
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'scripts': [
+            bench(name, cmds, expected, repeat=args.repeat, trace=args.trace)
+            for name, (cmds, expected) in CORPUS.items()
+            if args.filter in name
+        ],
+    }
+    s = json.dumps(results, indent=4)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(s)
+    else:
+        sys.stdout.write(s + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,226 @@
+import mmap
+from io import BytesIO
+
+from helper import (
+    bits_to_target,
+    hash256,
+    int_to_little_endian,
+    little_endian_to_int,
+    read_varint,
+    read_varint_at,
+    encode_varint,
+)
+from merkle import merkle_root
+from tx import Tx, TxView
+
+MAINNET_MAGIC = bytes.fromhex('f9beb4d9')
+TESTNET_MAGIC = bytes.fromhex('0b110907')
+HEADER_SIZE = 80
+
+
+class BlockHeader:
+
+    def __init__(self, version, prev_block, merkle_root, timestamp, bits, nonce):
+        self.version = version
+        self.prev_block = prev_block
+        self.merkle_root = merkle_root
+        self.timestamp = timestamp
+        self.bits = bits
+        self.nonce = nonce
+
+    def __repr__(self):
+        return 'BlockHeader({})'.format(self.id())
+
+    @classmethod
+    def parse(cls, s):
+        """Takes a byte stream and parses the 80 byte header at the start
+        return a BlockHeader object
+        """
+        version = little_endian_to_int(s.read(4))
+        prev_block = s.read(32)[::-1]
+        merkle_root = s.read(32)[::-1]
+        timestamp = little_endian_to_int(s.read(4))
+        bits = s.read(4)
+        nonce = s.read(4)
+        return cls(version, prev_block, merkle_root, timestamp, bits, nonce)
+
+    def serialize(self):
+        """Returns the 80 byte block header"""
+        return b''.join((
+            int_to_little_endian(self.version, 4),
+            self.prev_block[::-1],
+            self.merkle_root[::-1],
+            int_to_little_endian(self.timestamp, 4),
+            self.bits,
+            self.nonce,
+        ))
+
+    def hash(self):
+        """Binary hash of the header, in the same byte order as prev_block"""
+        return hash256(self.serialize())[::-1]
+
+    def id(self):
+        return self.hash().hex()
+
+    def target(self):
+        return bits_to_target(self.bits)
+
+    def difficulty(self):
+        return 0xffff * 256 ** (0x1d - 3) / self.target()
+
+    def check_pow(self):
+        """Returns whether the header hash is below the target"""
+        proof = little_endian_to_int(hash256(self.serialize()))
+        return proof < self.target()
+
+
+class Block:
+
+    def __init__(self, header, txs, testnet=False):
+        self.header = header
+        self.txs = txs
+        self.testnet = testnet
+
+    def __repr__(self):
+        return 'Block({}, {} txs)'.format(self.header.id(), len(self.txs))
+
+    @classmethod
+    def parse(cls, s, testnet=False):
+        """Takes a byte stream and parses a whole block, header and
+        transactions, return a Block object
+        """
+        header = BlockHeader.parse(s)
+        num_txs = read_varint(s)
+        txs = [Tx.parse(s, testnet=testnet) for _ in range(num_txs)]
+        return cls(header, txs, testnet=testnet)
+
+    def serialize(self):
+        result = [self.header.serialize(), encode_varint(len(self.txs))]
+        for tx in self.txs:
+            result.append(tx.serialize())
+        return b''.join(result)
+
+    def hash(self):
+        return self.header.hash()
+
+    def id(self):
+        return self.header.id()
+
+    def merkle_root(self):
+        """Merkle root of the transactions, byte order as in the header"""
+        return merkle_root([tx.hash()[::-1] for tx in self.txs])[::-1]
+
+    def check_merkle_root(self):
+        return self.merkle_root() == self.header.merkle_root
+
+    @staticmethod
+    def tx_views(raw, testnet=False):
+        """Yields a TxView for every transaction of a serialized block
+        without parsing any of them
+        """
+        raw = memoryview(raw)
+        num_txs, offset = read_varint_at(raw, HEADER_SIZE)
+        for _ in range(num_txs):
+            view = TxView(raw, offset, testnet=testnet)
+            yield view
+            offset = view.end
+
+
+class BlockFile:
+    """A blk*.dat style file: blocks stored back to back, each one after
+    the network magic and its length (4 bytes little endian).
+    The file is mmapped, so walking it only reads the pages the blocks are
+    on and nothing is kept once a block has been handed out.
+    """
+
+    def __init__(self, filename, magic=MAINNET_MAGIC, testnet=False):
+        self.filename = filename
+        self.magic = magic
+        self.testnet = testnet
+        self._file = None
+        self._map = None
+        # views handed out by raw_blocks that are still in use, by id
+        self._views = {}
+
+    def __repr__(self):
+        return 'BlockFile({})'.format(self.filename)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _buffer(self):
+        if self._map is None:
+            self._file = open(self.filename, 'rb')
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._map
+
+    def raw_blocks(self):
+        """Yields (offset, memoryview) for every block, the offset is where
+        the block starts in the file. A view is released when the next
+        block is asked for.
+        """
+        buf = self._buffer()
+        size = len(buf)
+        offset = 0
+        while offset + 8 <= size:
+            magic = buf[offset:offset + 4]
+            # files are preallocated, zeros mean there are no more blocks
+            if magic == b'\x00\x00\x00\x00':
+                break
+            if magic != self.magic:
+                raise SyntaxError('unexpected magic {} at {}'.format(magic.hex(), offset))
+            length = little_endian_to_int(buf[offset + 4:offset + 8])
+            start = offset + 8
+            if start + length > size:
+                raise SyntaxError('block at {} runs past the end of the file'.format(start))
+            with memoryview(buf) as view:
+                raw = view[start:start + length]
+            self._views[id(raw)] = raw
+            try:
+                yield start, raw
+            finally:
+                self._views.pop(id(raw), None)
+                raw.release()
+            if self._map is not buf:
+                # closed while the block was out
+                return
+            offset = start + length
+
+    def headers(self):
+        """Yields the header of every block"""
+        for _, raw in self.raw_blocks():
+            yield BlockHeader.parse(BytesIO(raw[:HEADER_SIZE]))
+
+    def __iter__(self):
+        """Yields every block, parsed"""
+        for _, raw in self.raw_blocks():
+            yield Block.parse(BytesIO(raw), testnet=self.testnet)
+
+    def close(self):
+        """Closes the file, the views raw_blocks handed out are released.
+        Slices taken of those views keep the mapping open until they are
+        gone.
+        """
+        for raw in list(self._views.values()):
+            raw.release()
+        self._views.clear()
+        if self._map is not None:
+            try:
+                self._map.close()
+            except BufferError:
+                # still exported through slices of a view, the mapping is
+                # unmapped once the last of them is garbage collected
+                pass
+            self._file.close()
+            self._map = self._file = None
+
+
+def write_blocks(filename, blocks, magic=MAINNET_MAGIC):
+    """Writes blocks in the blk*.dat format"""
+    with open(filename, 'wb') as f:
+        for block in blocks:
+            raw = block.serialize()
+            f.write(magic + int_to_little_endian(len(raw), 4) + raw)
@@ -0,0 +1,242 @@
+"""Compact block filters, the basic filter type of BIP158.
+
+A filter holds every ScriptPubKey a block creates or spends. Each script
+is hashed with SipHash-2-4, keyed by the block hash, to a number below
+N * M, and the sorted numbers are stored as Golomb-Rice coded differences
+of P bits each plus a unary quotient. A light client matches the scripts
+of its wallet against the filter and only downloads and parses the blocks
+that match, with a false positive rate of about 1 / M per script.
+
+Filters commit to the previous filter through a header chain:
+
+    header = hash256(filter hash + previous header)
+
+Filter hashes and headers are in the same byte order as BlockHeader.hash().
+"""
+from block import Block, HEADER_SIZE
+from helper import encode_varint, hash256, little_endian_to_int, read_varint_at
+from utxo import COINBASE_PREV_INDEX, COINBASE_PREV_TX, outpoint
+
+# parameters of the basic filter
+P = 19
+M = 784931
+MASK64 = 0xffffffffffffffff
+
+
+def _rotl(x, b):
+    return ((x << b) | (x >> (64 - b))) & MASK64
+
+
+def _sipround(v0, v1, v2, v3):
+    v0 = (v0 + v1) & MASK64
+    v1 = _rotl(v1, 13) ^ v0
+    v0 = _rotl(v0, 32)
+    v2 = (v2 + v3) & MASK64
+    v3 = _rotl(v3, 16) ^ v2
+    v0 = (v0 + v3) & MASK64
+    v3 = _rotl(v3, 21) ^ v0
+    v2 = (v2 + v1) & MASK64
+    v1 = _rotl(v1, 17) ^ v2
+    v2 = _rotl(v2, 32)
+    return v0, v1, v2, v3
+
+
+def siphash(key, data):
+    """SipHash-2-4 of data with a 16 byte key, as a 64 bit integer"""
+    k0 = little_endian_to_int(key[:8])
+    k1 = little_endian_to_int(key[8:16])
+    v0 = k0 ^ 0x736f6d6570736575
+    v1 = k1 ^ 0x646f72616e646f6d
+    v2 = k0 ^ 0x6c7967656e657261
+    v3 = k1 ^ 0x7465646279746573
+    n = len(data)
+    end = n - n % 8
+    for i in range(0, end, 8):
+        m = little_endian_to_int(data[i:i + 8])
+        v3 ^= m
+        v0, v1, v2, v3 = _sipround(v0, v1, v2, v3)
+        v0, v1, v2, v3 = _sipround(v0, v1, v2, v3)
+        v0 ^= m
+    # the last block holds the leftover bytes and the length
+    m = ((n & 0xff) << 56) | little_endian_to_int(data[end:])
+    v3 ^= m
+    v0, v1, v2, v3 = _sipround(v0, v1, v2, v3)
+    v0, v1, v2, v3 = _sipround(v0, v1, v2, v3)
+    v0 ^= m
+    v2 ^= 0xff
+    for _ in range(4):
+        v0, v1, v2, v3 = _sipround(v0, v1, v2, v3)
+    return v0 ^ v1 ^ v2 ^ v3
+
+
+def hash_to_range(key, item, f):
+    """Maps item uniformly onto [0, f)"""
+    return (siphash(key, item) * f) >> 64
+
+
+class GCSFilter:
+    """A Golomb-coded set of n items, key is the 16 byte SipHash key"""
+
+    def __init__(self, n, data, key, p=P, m=M):
+        self.n = n
+        self.data = data
+        self.key = key
+        self.p = p
+        self.m = m
+
+    def __repr__(self):
+        return 'GCSFilter({} items, {} bytes)'.format(self.n, len(self.data))
+
+    def __len__(self):
+        return self.n
+
+    @classmethod
+    def build(cls, key, items, p=P, m=M):
+        """Builds the filter of a collection of distinct items (bytes)"""
+        items = set(bytes(item) for item in items)
+        n = len(items)
+        f = n * m
+        width = '0{}b'.format(p)
+        bits = []
+        last = 0
+        for value in sorted(hash_to_range(key, item, f) for item in items):
+            delta = value - last
+            last = value
+            # quotient in unary, a 0, then the remainder in p bits
+            bits.append('1' * (delta >> p) + '0' + format(delta & ((1 << p) - 1), width))
+        bits = ''.join(bits)
+        # pad with zeros to a whole byte
+        bits += '0' * (-len(bits) % 8)
+        data = int(bits, 2).to_bytes(len(bits) // 8, 'big') if bits else b''
+        return cls(n, data, key, p, m)
+
+    @classmethod
+    def parse(cls, raw, key, p=P, m=M):
+        """Takes a serialized filter, the number of items as a varint
+        followed by the coded set
+        """
+        n, offset = read_varint_at(raw, 0)
+        return cls(n, bytes(raw[offset:]), key, p, m)
+
+    def serialize(self):
+        return encode_varint(self.n) + self.data
+
+    def hash(self):
+        return hash256(self.serialize())[::-1]
+
+    def values(self):
+        """Yields the hashed items in ascending order"""
+        data = self.data
+        bits = format(int.from_bytes(data, 'big'), '0{}b'.format(8 * len(data))) if data else ''
+        p = self.p
+        value = 0
+        i = 0
+        for _ in range(self.n):
+            end = bits.find('0', i)
+            if end < 0 or end + 1 + p > len(bits):
+                raise SyntaxError('filter ends before its last item')
+            value += ((end - i) << p) + int(bits[end + 1:end + 1 + p], 2)
+            i = end + 1 + p
+            yield value
+
+    def match(self, item):
+        return self.match_any([item])
+
+    def match_any(self, items):
+        """Whether any of items is in the set. The hashed items are sorted
+        and merged with the set in one pass, so the filter is decoded at
+        most once however many items are asked about.
+        """
+        if not self.n:
+            return False
+        f = self.n * self.m
+        queries = sorted(hash_to_range(self.key, item, f) for item in items)
+        if not queries:
+            return False
+        values = self.values()
+        value = next(values)
+        for query in queries:
+            while value < query:
+                value = next(values, None)
+                if value is None:
+                    return False
+            if value == query:
+                return True
+        return False
+
+
+def block_key(raw_block):
+    """SipHash key of a block, the first 16 bytes of its hash in the order
+    it is hashed, not the reversed one of BlockHeader.hash()
+    """
+    return hash256(bytes(raw_block[:HEADER_SIZE]))[:16]
+
+
+def block_scripts(raw_block, utxo_set=None):
+    """The set of scripts the basic filter of a serialized block holds:
+    every output script except empty and OP_RETURN ones, and the script of
+    every output spent. Spent outputs come from utxo_set, which should be
+    the set as it was before the block, or from earlier in the block.
+    """
+    scripts = set()
+    created = {}
+    for view in Block.tx_views(raw_block):
+        for i in range(len(view.in_offsets)):
+            prev_tx = view.prev_tx(i)
+            prev_index = view.prev_index(i)
+            if prev_tx == COINBASE_PREV_TX and prev_index == COINBASE_PREV_INDEX:
+                continue
+            script_pubkey = created.get(outpoint(prev_tx, prev_index))
+            if script_pubkey is None:
+                entry = utxo_set.get(prev_tx, prev_index) if utxo_set is not None else None
+                if entry is None:
+                    raise ValueError('output spent by {}:{} is missing'.format(view.id(), i))
+                script_pubkey = entry[1]
+            if script_pubkey:
+                scripts.add(bytes(script_pubkey))
+        tx_hash = view.hash()
+        for i in range(len(view.out_offsets)):
+            script_pubkey = bytes(view.script_pubkey(i))
+            created[outpoint(tx_hash, i)] = script_pubkey
+            if script_pubkey and script_pubkey[0] != 0x6a:
+                scripts.add(script_pubkey)
+    return scripts
+
+
+def block_filter(raw_block, utxo_set=None):
+    """Builds the basic filter of a serialized block or a Block"""
+    if isinstance(raw_block, Block):
+        raw_block = raw_block.serialize()
+    return GCSFilter.build(block_key(raw_block), block_scripts(raw_block, utxo_set))
+
+
+def filter_header(filter_hash, prev_header):
+    """Header of a filter from its hash and the previous header"""
+    return hash256(filter_hash[::-1] + prev_header[::-1])[::-1]
+
+
+class FilterHeaderChain:
+    """Headers of the filters of consecutive blocks"""
+
+    def __init__(self, prev_header=b'\x00' * 32):
+        self.prev_header = prev_header
+        self.headers = []
+
+    def __len__(self):
+        return len(self.headers)
+
+    def tip(self):
+        return self.headers[-1] if self.headers else self.prev_header
+
+    def add(self, gcs_filter):
+        """Adds the filter of the next block and returns its header"""
+        header = filter_header(gcs_filter.hash(), self.tip())
+        self.headers.append(header)
+        return header
+
+    def check(self, height, gcs_filter):
+        """Whether gcs_filter is the one committed to at height, such as a
+        filter downloaded from a peer
+        """
+        prev_header = self.headers[height - 1] if height else self.prev_header
+        return filter_header(gcs_filter.hash(), prev_header) == self.headers[height]
@@ -0,0 +1,152 @@
+"""Block header chain.
+
+Headers are kept as raw 80 byte records in one bytearray, with parallel
+arrays for the parent and height of every header and a dict from block
+hash to record number. Headers are added in batches and no BlockHeader
+objects are made unless asked for.
+"""
+from array import array
+from io import BytesIO
+
+from block import BlockHeader, HEADER_SIZE
+from helper import bits_to_target, hash256
+
+GENESIS_HEADER = bytes.fromhex(
+    '0100000000000000000000000000000000000000000000000000000000000000000000003ba3ed'
+    'fd7a7b12b27ac72c3e67768f617fc81bc3888a51323a9fb8aa4b1e5e4a29ab5f49ffff001d1dac2b7c')
+# the easiest target mainnet allows
+POW_LIMIT = bits_to_target(bytes.fromhex('ffff001d'))
+
+
+class HeaderChain:
+    """Every header that connects to the genesis header, and the chain
+    with the most work through them.
+    Block hashes given to and returned by the chain are in the same byte
+    order as BlockHeader.hash(). The proof of work of a header is checked
+    against its own bits, difficulty adjustments are not checked.
+    """
+
+    def __init__(self, genesis=GENESIS_HEADER, pow_limit=POW_LIMIT):
+        self.pow_limit = pow_limit
+        # bits -> target, bits hardly ever change
+        self._targets = {}
+        # one record per header we know of, in the order they were added
+        self.raw = bytearray(genesis)
+        self.hashes = [hash256(genesis)]
+        self.parents = array('l', [-1])
+        self.heights = array('l', [0])
+        self.work = [2 ** 256 // (self._target(bytes(genesis[72:76])) + 1)]
+        # record number by hash256 of the header
+        self.index = {self.hashes[0]: 0}
+        # record numbers of the best chain by height
+        self.active = array('l', [0])
+        self.reorgs = 0
+
+    def __repr__(self):
+        return 'HeaderChain(height {}, tip {})'.format(self.height(), self.tip().hex())
+
+    def __len__(self):
+        return len(self.active)
+
+    def __contains__(self, block_hash):
+        """Whether the block is on the best chain"""
+        return self.height_of(block_hash) is not None
+
+    def _target(self, bits):
+        target = self._targets.get(bits)
+        if target is None:
+            target = self._targets[bits] = bits_to_target(bits)
+        return target
+
+    def add_headers(self, raw):
+        """Adds serialized headers stored back to back. Headers that are
+        already known are skipped. Every header is checked before any is
+        added, ValueError is raised if one does not connect or does not
+        have enough proof of work.
+        Returns the number of new headers.
+        """
+        raw = memoryview(raw)
+        if len(raw) % HEADER_SIZE:
+            raise ValueError('{} bytes is not a whole number of headers'.format(len(raw)))
+        index = self.index
+        start = len(self.hashes)
+        # hash -> record number of the new headers
+        batch = {}
+        new = []
+        for offset in range(0, len(raw), HEADER_SIZE):
+            header = raw[offset:offset + HEADER_SIZE]
+            h = hash256(header)
+            if h in index or h in batch:
+                continue
+            prev = header[4:36].tobytes()
+            parent = batch.get(prev)
+            if parent is None:
+                parent = index.get(prev)
+                if parent is None:
+                    raise ValueError('header {} does not connect'.format(h[::-1].hex()))
+            target = self._target(header[72:76].tobytes())
+            if target > self.pow_limit:
+                raise ValueError('header {} target is too easy'.format(h[::-1].hex()))
+            if int.from_bytes(h, 'little') > target:
+                raise ValueError('header {} does not have enough proof of work'.format(h[::-1].hex()))
+            batch[h] = start + len(new)
+            new.append((h, parent, target, header))
+        best = self.active[-1]
+        for h, parent, target, header in new:
+            record = len(self.hashes)
+            self.raw += header
+            self.hashes.append(h)
+            self.parents.append(parent)
+            self.heights.append(self.heights[parent] + 1)
+            # expected number of hashes it took
+            self.work.append(self.work[parent] + 2 ** 256 // (target + 1))
+            index[h] = record
+            if self.work[record] > self.work[best]:
+                best = record
+        if best != self.active[-1]:
+            self._switch(best)
+        return len(new)
+
+    def _switch(self, record):
+        """Makes the chain ending in record the best chain"""
+        active, heights, parents = self.active, self.heights, self.parents
+        path = []
+        while heights[record] >= len(active) or active[heights[record]] != record:
+            path.append(record)
+            record = parents[record]
+        fork = heights[record]
+        if fork + 1 < len(active):
+            self.reorgs += 1
+            del active[fork + 1:]
+        active.extend(reversed(path))
+
+    def height(self):
+        """Height of the tip"""
+        return len(self.active) - 1
+
+    def tip(self):
+        return self.hashes[self.active[-1]][::-1]
+
+    def total_work(self):
+        return self.work[self.active[-1]]
+
+    def block_hash(self, height):
+        """Hash of the block at height on the best chain"""
+        return self.hashes[self.active[height]][::-1]
+
+    def height_of(self, block_hash):
+        """Height of the block if it is on the best chain, else None"""
+        record = self.index.get(block_hash[::-1])
+        if record is None:
+            return None
+        height = self.heights[record]
+        if height >= len(self.active) or self.active[height] != record:
+            return None
+        return height
+
+    def raw_header(self, height):
+        record = self.active[height]
+        return bytes(self.raw[record * HEADER_SIZE:(record + 1) * HEADER_SIZE])
+
+    def header(self, height):
+        return BlockHeader.parse(BytesIO(self.raw_header(height)))
@@ -0,0 +1,116 @@
+"""Columnar export of transaction outputs to NumPy.
+
+Every output becomes one row of fixed width columns:
+
+    txid         32 bytes, same byte order as Tx.hash()
+    vout         uint32
+    amount       uint64, satoshi
+    script_type  uint8, one of the types of script.classify_script
+    hash160      20 bytes, zero for outputs without one
+
+The transactions are walked with TxView, so amounts are read straight out
+of the serialized transactions and no TxIn, TxOut or Script is made.
+numpy is only needed for this module.
+"""
+import os
+from array import array
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from helper import hash160
+from script import P2PK, classify_script
+from tx import TxView
+
+# name and numpy type of every column
+COLUMNS = (
+    ('txid', ('u1', 32)),
+    ('vout', 'u4'),
+    ('amount', '<u8'),
+    ('script_type', 'u1'),
+    ('hash160', ('u1', 20)),
+)
+NO_HASH160 = bytes(20)
+
+
+def _require_numpy():
+    if np is None:
+        raise ImportError('the columnar export needs numpy')
+
+
+def _views(txs):
+    """TxViews of Tx objects, TxViews or serialized transactions"""
+    for tx in txs:
+        if isinstance(tx, TxView):
+            yield tx
+        elif isinstance(tx, (bytes, bytearray, memoryview)):
+            yield TxView(tx)
+        else:
+            yield TxView(tx.serialize())
+
+
+def output_columns(txs):
+    """Returns a dict of column name -> numpy array with one row for every
+    output of txs, which can be Tx objects, TxViews or serialized
+    transactions
+    """
+    _require_numpy()
+    txids = bytearray()
+    vouts = array('I')
+    amounts = bytearray()
+    script_types = bytearray()
+    hashes = bytearray()
+    for view in _views(txs):
+        txid = view.hash()
+        buf = view.buf
+        for vout, offset in enumerate(view.out_offsets):
+            txids += txid
+            vouts.append(vout)
+            # the amount is the first 8 bytes of the output, little endian
+            amounts += buf[offset:offset + 8]
+            script_type, payload = classify_script(view.script_pubkey(vout))
+            if script_type == P2PK:
+                payload = hash160(payload)
+            elif payload is None or len(payload) != 20:
+                payload = NO_HASH160
+            script_types.append(script_type)
+            hashes += payload
+    rows = len(vouts)
+    return {
+        'txid': np.frombuffer(txids, dtype=np.uint8).reshape(rows, 32),
+        'vout': np.frombuffer(vouts, dtype=np.uint32),
+        'amount': np.frombuffer(amounts, dtype='<u8'),
+        'script_type': np.frombuffer(script_types, dtype=np.uint8),
+        'hash160': np.frombuffer(hashes, dtype=np.uint8).reshape(rows, 20),
+    }
+
+
+def output_table(txs):
+    """Returns the output columns as one structured array"""
+    columns = output_columns(txs)
+    table = np.empty(len(columns['vout']), dtype=np.dtype(list(COLUMNS)))
+    for name, column in columns.items():
+        table[name] = column
+    return table
+
+
+def save_outputs(directory, txs):
+    """Writes every output column to directory/<name>.npy and returns the
+    number of rows
+    """
+    columns = output_columns(txs)
+    os.makedirs(directory, exist_ok=True)
+    for name, column in columns.items():
+        np.save(os.path.join(directory, name + '.npy'), column)
+    return len(columns['vout'])
+
+
+def load_outputs(directory, mmap_mode='r'):
+    """Reads the columns written by save_outputs, memory mapped by default"""
+    _require_numpy()
+    return {
+        name: np.load(os.path.join(directory, name + '.npy'), mmap_mode=mmap_mode)
+        for name, _ in COLUMNS
+    }
@@ -14,6 +14,8 @@ N = 0xfffffffffffffffffffffffffffffffebaaedce6af48a03bbfd25e8cd0364141
 
 
 class S256Field(FieldElement):
+    __slots__ = ()
+
     def __init__(self, num, prime=None):
         super().__init__(num=num, prime=P)
 
@@ -25,6 +27,10 @@ class S256Field(FieldElement):
 
 
 class S256Point(Point):
+    __slots__ = ()
+    # an interning.InternPool that parse shares points through
+    intern_pool = None
+
     def __init__(self, x, y, a=None, b=None):
         a, b = S256Field(A), S256Field(B)
         if type(x) == int:
@@ -44,10 +50,15 @@ class S256Point(Point):
         return super().__rmul__(coef)
 
     def verify(self, z, sig):
+        # r and s have to be in [1, N-1], s = 0 has no inverse
+        if not (0 < sig.r < N and 0 < sig.s < N):
+            return False
         s_inv = pow(sig.s, N - 2, N)
         u = z * s_inv % N
         v = sig.r * s_inv % N
         total = u * G + v * self
+        if total.x is None:
+            return False
         return total.x.num == sig.r
 
     def sec(self, compressed=True):
@@ -63,11 +74,19 @@ class S256Point(Point):
     @classmethod
     def parse(cls, sec_bin):
         """returns a Point object from an SEC binary (not hex)"""
-        if sec_bin[0] == 4:
-            x = int.from_bytes(sec_bin[1:32], 'big')
+        if cls.intern_pool is not None:
+            return cls.intern_pool.point(sec_bin)
+        return cls.from_sec(sec_bin)
+
+    @classmethod
+    def from_sec(cls, sec_bin):
+        """parse without the intern pool, always a new Point"""
+        if len(sec_bin) == 65 and sec_bin[0] == 4:
+            x = int.from_bytes(sec_bin[1:33], 'big')
             y = int.from_bytes(sec_bin[33:65], 'big')
             return S256Point(x=x, y=y)
-
+        if len(sec_bin) != 33 or sec_bin[0] not in (2, 3):
+            raise SyntaxError('Bad SEC pubkey')
         is_even = sec_bin[0] == 2
         x = S256Field(int.from_bytes(sec_bin[1:], 'big'))
         alpha = x ** 3 + S256Field(B)
@@ -102,6 +121,8 @@ G = S256Point(0x79be667ef9dcbbac55a06295ce870b07029bfcdb2dce28d959f2815b16f81798
 
 
 class Signature:
+    __slots__ = ('r', 's')
+
     def __init__(self, r, s):
         self.r = r
         self.s = s
@@ -126,6 +147,10 @@ class Signature:
 
     @classmethod
     def parse(cls, signature_bin):
+        # 0x30 length 0x02 rlength r 0x02 slength s, with r and s at least
+        # one byte each
+        if len(signature_bin) < 8:
+            raise SyntaxError('Signature too short')
         s = BytesIO(signature_bin)
         compound = s.read(1)[0]
         if compound != 0x30:
@@ -137,18 +162,57 @@ class Signature:
         if marker != 0x02:
             raise SyntaxError('Bad Signature')
         rlength = s.read(1)[0]
+        # room for r, the s marker and the s length
+        if rlength == 0 or 4 + rlength + 2 > len(signature_bin):
+            raise SyntaxError('Bad Signature Length')
         r = int.from_bytes(s.read(rlength), 'big')
         marker = s.read(1)[0]
         if marker != 0x02:
             raise SyntaxError('Bad Signature')
         slength = s.read(1)[0]
+        if slength == 0 or len(signature_bin) != 6 + rlength + slength:
+            raise SyntaxError('Bad Signature Length')
         s = int.from_bytes(s.read(slength), 'big')
-        if len(signature_bin) != 6 + rlength + slength:
-            raise SyntaxError('Signature too long')
-
         return cls(r, s)
 
 
+class SignatureBatch:
+    """Collects (sec, der, z) signature checks so they can all be verified
+    together once a script or transaction has been evaluated
+    """
+
+    def __init__(self):
+        self.checks = []
+
+    def __len__(self):
+        return len(self.checks)
+
+    def add(self, sec, der, z):
+        self.checks.append((sec, der, z))
+
+    def verify(self):
+        """Returns whether every collected signature is valid.
+        Repeated checks are only done once and every pubkey is parsed once.
+        """
+        points = {}
+        done = set()
+        for check in self.checks:
+            if check in done:
+                continue
+            sec, der, z = check
+            try:
+                point = points.get(sec)
+                if point is None:
+                    point = points[sec] = S256Point.parse(sec)
+                sig = Signature.parse(der)
+            except (ValueError, SyntaxError):
+                return False
+            if not point.verify(z, sig):
+                return False
+            done.add(check)
+        return True
+
+
 class PrivateKey:
     def __init__(self, secret):
         self.secret = secret
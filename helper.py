@@ -48,9 +48,11 @@ def decode_base58(s):
         num += BASE58_ALPHABET.index(c)
 
     combined = num.to_bytes(25, byteorder='big')
-    checksum = combined[:4]
+    checksum = combined[-4:]
     if hash256(combined[:-4])[:4] != checksum:
         raise ValueError('Bad address: {} {}'.format(checksum, hash256(combined[:-4])[:4]))
+    # drop the version byte and the checksum, leaving the hash160
+    return combined[1:-4]
 
 
 def little_endian_to_int(b):
@@ -65,7 +67,13 @@ def int_to_little_endian(n, length):
 
 def read_varint(s):
     """read_varint reads a variable integer from a stream"""
-    i = s.read(1)[0]
+    return read_varint_rest(s.read(1)[0], s)
+
+
+def read_varint_rest(i, s):
+    """read_varint_rest reads the rest of a variable integer whose first
+    byte i has already been read from the stream
+    """
     if i == 0xfd:
         # 0xfd means the next two bytes are the number
         return little_endian_to_int(s.read(2))
@@ -80,6 +88,21 @@ def read_varint(s):
         return i
 
 
+def read_varint_at(b, offset):
+    """read_varint_at reads a variable integer at offset in a buffer.
+    Returns the integer and the offset right after it
+    """
+    i = b[offset]
+    if i == 0xfd:
+        return little_endian_to_int(b[offset + 1:offset + 3]), offset + 3
+    elif i == 0xfe:
+        return little_endian_to_int(b[offset + 1:offset + 5]), offset + 5
+    elif i == 0xff:
+        return little_endian_to_int(b[offset + 1:offset + 9]), offset + 9
+    else:
+        return i, offset + 1
+
+
 def encode_varint(i):
     """encodes an integer as a varint"""
     if i < 0xfd:
@@ -94,6 +117,13 @@ def encode_varint(i):
         raise ValueError('integer too large: {}'.format(i))
 
 
+def bits_to_target(bits):
+    """turns the 4 byte bits field of a block header into a target"""
+    exponent = bits[-1]
+    coefficient = little_endian_to_int(bits[:-1])
+    return coefficient * 256 ** (exponent - 3)
+
+
 class HelperTest(TestCase):
     def test_little_endian_to_int(self):
         h = bytes.fromhex('99c3980000000000')
@@ -110,3 +140,17 @@ class HelperTest(TestCase):
         n = 10011545
         want = b'\x99\xc3\x98\x00\x00\x00\x00\x00'
         self.assertEqual(int_to_little_endian(n, 8), want)
+
+    def test_read_varint_at(self):
+        b = memoryview(bytes.fromhex('00fd0001fe00000100ff0000000001000000'))
+        self.assertEqual(read_varint_at(b, 0), (0, 1))
+        self.assertEqual(read_varint_at(b, 1), (0x100, 4))
+        self.assertEqual(read_varint_at(b, 4), (0x10000, 9))
+        self.assertEqual(read_varint_at(b, 9), (0x100000000, 18))
+
+    def test_decode_base58(self):
+        h160 = bytes.fromhex('1520f087720e1811802ded9bc38018da99111f90')
+        self.assertEqual(decode_base58('mhSfwmFGmD5KcJxUfVdxrfe55uCqkptc6a'), h160)
+        self.assertEqual(decode_base58(encode_base58_checksum(b'\x05' + h160)), h160)
+        with self.assertRaises(ValueError):
+            decode_base58('mhSfwmFGmD5KcJxUfVdxrfe55uCqkptc6b')
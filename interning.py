@@ -0,0 +1,102 @@
+"""Sharing of repeated ScriptPubKeys and public keys.
+
+Reused addresses put the same ScriptPubKey and the same SEC public key in
+thousands of transactions. With a pool installed, TxOut.parse and
+S256Point.parse hand out one shared object for each distinct byte string,
+so the copies take no memory and anything cached on the object, such as
+the parsed cmds of a Script, is only worked out once.
+
+    pool = InternPool()
+    pool.install()
+"""
+import threading
+from collections import OrderedDict
+
+from ecc import S256Point
+from script import Script
+from tx import TxOut
+
+KINDS = ('bytes', 'script', 'point')
+
+
+class InternPool:
+    """Least recently used pools of byte strings, Scripts and S256Points,
+    each holding at most max_entries objects.
+    Shared Scripts must not be changed in place, replace a transaction's
+    script with a new Script instead.
+    """
+
+    def __init__(self, max_entries=100000):
+        self.max_entries = max_entries
+        self._pools = {kind: OrderedDict() for kind in KINDS}
+        self._lock = threading.Lock()
+        self.stats = {kind: {'requests': 0, 'hits': 0, 'bytes_saved': 0} for kind in KINDS}
+        self.evictions = 0
+
+    def __repr__(self):
+        return 'InternPool({} entries, {:.0%} shared)'.format(len(self), self.dedup_ratio())
+
+    def __len__(self):
+        return sum(len(pool) for pool in self._pools.values())
+
+    def _intern(self, kind, raw, make):
+        pool = self._pools[kind]
+        stats = self.stats[kind]
+        with self._lock:
+            stats['requests'] += 1
+            obj = pool.get(raw)
+            if obj is not None:
+                pool.move_to_end(raw)
+                stats['hits'] += 1
+                stats['bytes_saved'] += len(raw)
+                return obj
+        # parsing a point takes a square root, do it outside the lock
+        obj = make(raw)
+        with self._lock:
+            obj = pool.setdefault(raw, obj)
+            if len(pool) > self.max_entries:
+                pool.popitem(last=False)
+                self.evictions += 1
+        return obj
+
+    def intern_bytes(self, raw):
+        """Returns the shared copy of a byte string"""
+        raw = bytes(raw)
+        return self._intern('bytes', raw, lambda raw: raw)
+
+    def script(self, raw):
+        """Returns the shared Script for a raw script (no length prefix)"""
+        return self._intern('script', bytes(raw), lambda raw: Script(raw=raw))
+
+    def point(self, sec):
+        """Returns the shared S256Point for a SEC public key"""
+        return self._intern('point', bytes(sec), S256Point.from_sec)
+
+    def dedup_ratio(self):
+        """Share of the requests that were answered with an existing object"""
+        requests = sum(stats['requests'] for stats in self.stats.values())
+        if not requests:
+            return 0.0
+        return sum(stats['hits'] for stats in self.stats.values()) / requests
+
+    def report(self):
+        result = {kind: dict(stats, entries=len(self._pools[kind])) for kind, stats in self.stats.items()}
+        result['dedup_ratio'] = self.dedup_ratio()
+        result['evictions'] = self.evictions
+        return result
+
+    def install(self):
+        """Makes TxOut.parse and S256Point.parse go through this pool"""
+        TxOut.intern_pool = self
+        S256Point.intern_pool = self
+
+    def uninstall(self):
+        if TxOut.intern_pool is self:
+            TxOut.intern_pool = None
+        if S256Point.intern_pool is self:
+            S256Point.intern_pool = None
+
+    def clear(self):
+        with self._lock:
+            for pool in self._pools.values():
+                pool.clear()
@@ -0,0 +1,395 @@
+"""Pool of unconfirmed transactions.
+
+Every transaction knows its in-pool parents and children, and keeps the
+fee and size of itself together with all of its in-pool ancestors and of
+itself together with all of its descendants. Those package totals are
+updated when a transaction comes or goes, only for the transactions it is
+connected to, so nothing ever rescans the whole pool.
+
+Two heaps order the pool: by ancestor fee rate for block templates, best
+first, and by descendant fee rate for eviction, worst first. Entries are
+never removed from the heaps, an entry whose totals changed is pushed again
+and the stale copies are skipped when they come out.
+"""
+import heapq
+from itertools import count
+
+MAX_ANCESTORS = 25
+MAX_DESCENDANTS = 25
+# at most this many transactions can be replaced at once
+MAX_REPLACED = 100
+# satoshi per virtual byte
+MIN_RELAY_FEE_RATE = 1
+
+
+def vsize(tx):
+    """Virtual size: the witness data counts a quarter"""
+    weight = 3 * len(tx.serialize_legacy()) + len(tx.serialize())
+    return (weight + 3) // 4
+
+
+class MempoolEntry:
+    __slots__ = (
+        'tx', 'txid', 'fee', 'size', 'parents', 'children',
+        'ancestor_fee', 'ancestor_size', 'ancestor_count',
+        'descendant_fee', 'descendant_size', 'descendant_count',
+    )
+
+    def __init__(self, tx, txid, fee, size):
+        self.tx = tx
+        self.txid = txid
+        self.fee = fee
+        self.size = size
+        # txids of the in-pool transactions this one spends from and that
+        # spend from it
+        self.parents = set()
+        self.children = set()
+        self.ancestor_fee = fee
+        self.ancestor_size = size
+        self.ancestor_count = 1
+        self.descendant_fee = fee
+        self.descendant_size = size
+        self.descendant_count = 1
+
+    def __repr__(self):
+        return 'MempoolEntry({}, fee {}, size {})'.format(self.txid.hex(), self.fee, self.size)
+
+    def fee_rate(self):
+        return self.fee / self.size
+
+    def ancestor_fee_rate(self):
+        return self.ancestor_fee / self.ancestor_size
+
+    def descendant_fee_rate(self):
+        return self.descendant_fee / self.descendant_size
+
+
+class Mempool:
+    """Transactions are keyed by Tx.hash().
+    Fees of inputs spending transactions in the pool come from the parent,
+    the others from utxo_set if given, otherwise from TxIn as usual.
+    Raises ValueError for transactions that cannot go in.
+    """
+
+    def __init__(self, utxo_set=None, max_size=300 * 1000 * 1000, testnet=False):
+        self.utxo_set = utxo_set
+        self.max_size = max_size
+        self.testnet = testnet
+        self.entries = {}
+        # (prev_tx, prev_index) -> txid of the transaction spending it
+        self.spent = {}
+        self.total_size = 0
+        # raised when transactions are evicted for space
+        self.min_fee_rate = MIN_RELAY_FEE_RATE
+        self._counter = count()
+        # (-ancestor fee rate, counter, txid) and (descendant fee rate, counter, txid)
+        self._ancestor_heap = []
+        self._descendant_heap = []
+        # txid -> counter of the newest copy in each heap
+        self._ancestor_current = {}
+        self._descendant_current = {}
+
+    def __repr__(self):
+        return 'Mempool({} txs, {} vbytes)'.format(len(self.entries), self.total_size)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, txid):
+        return txid in self.entries
+
+    def get(self, txid):
+        entry = self.entries.get(txid)
+        return entry.tx if entry is not None else None
+
+    def _push_ancestor(self, entry):
+        n = next(self._counter)
+        self._ancestor_current[entry.txid] = n
+        heapq.heappush(self._ancestor_heap, (-entry.ancestor_fee_rate(), n, entry.txid))
+
+    def _push_descendant(self, entry):
+        n = next(self._counter)
+        self._descendant_current[entry.txid] = n
+        heapq.heappush(self._descendant_heap, (entry.descendant_fee_rate(), n, entry.txid))
+
+    def _compact(self):
+        """Drops the stale copies once they outnumber the live ones"""
+        if len(self._ancestor_heap) + len(self._descendant_heap) <= 4 * len(self.entries) + 64:
+            return
+        self._ancestor_heap = []
+        self._descendant_heap = []
+        for entry in self.entries.values():
+            self._push_ancestor(entry)
+            self._push_descendant(entry)
+
+    def ancestors(self, txid):
+        """txids of all in-pool ancestors, not including txid"""
+        result = set()
+        todo = list(self.entries[txid].parents)
+        while todo:
+            parent = todo.pop()
+            if parent not in result:
+                result.add(parent)
+                todo.extend(self.entries[parent].parents)
+        return result
+
+    def descendants(self, txid):
+        """txids of all in-pool descendants, not including txid"""
+        result = set()
+        todo = list(self.entries[txid].children)
+        while todo:
+            child = todo.pop()
+            if child not in result:
+                result.add(child)
+                todo.extend(self.entries[child].children)
+        return result
+
+    def conflicts(self, tx):
+        """txids of the pool transactions spending any output tx spends"""
+        result = set()
+        for tx_in in tx.tx_ins:
+            txid = self.spent.get((tx_in.prev_tx, tx_in.prev_index))
+            if txid is not None:
+                result.add(txid)
+        return result
+
+    def _fee(self, tx):
+        for i, tx_in in enumerate(tx.tx_ins):
+            parent = self.entries.get(tx_in.prev_tx)
+            if parent is not None:
+                try:
+                    tx_out = parent.tx.tx_outs[tx_in.prev_index]
+                except IndexError:
+                    raise ValueError('input {} spends an output that does not exist'.format(i))
+                tx_in.prevout = (tx_out.amount, tx_out.script_pubkey.raw_serialize())
+            elif self.utxo_set is not None:
+                prevout = self.utxo_set.get(tx_in.prev_tx, tx_in.prev_index)
+                if prevout is None:
+                    raise ValueError('input {} spends an unknown output'.format(i))
+                tx_in.prevout = prevout
+        return tx.fee(testnet=self.testnet)
+
+    def add(self, tx, fee=None):
+        """Adds tx, replacing the transactions it conflicts with if it pays
+        enough for that. Returns the txids that were replaced.
+        """
+        txid = tx.hash()
+        if txid in self.entries:
+            raise ValueError('{} is already in the pool'.format(txid.hex()))
+        if tx.is_coinbase():
+            raise ValueError('coinbase transactions cannot go in the pool')
+        if fee is None:
+            fee = self._fee(tx)
+        if fee < 0:
+            raise ValueError('{} spends more than its inputs'.format(txid.hex()))
+        entry = MempoolEntry(tx, txid, fee, vsize(tx))
+        if entry.fee_rate() < self.min_fee_rate:
+            raise ValueError('fee rate {:.2f} is below {:.2f}'.format(entry.fee_rate(), self.min_fee_rate))
+        for tx_in in tx.tx_ins:
+            if tx_in.prev_tx in self.entries:
+                entry.parents.add(tx_in.prev_tx)
+        ancestors = set()
+        for parent in entry.parents:
+            ancestors.add(parent)
+            ancestors |= self.ancestors(parent)
+        if len(ancestors) + 1 > MAX_ANCESTORS:
+            raise ValueError('too many unconfirmed ancestors')
+        for ancestor in ancestors:
+            if self.entries[ancestor].descendant_count + 1 > MAX_DESCENDANTS:
+                raise ValueError('too many unconfirmed descendants')
+        replaced = self.conflicts(tx)
+        if replaced:
+            replaced = self._check_replacement(entry, ancestors, replaced)
+            for conflict in list(replaced):
+                if conflict in self.entries:
+                    self._remove_with_descendants(conflict)
+        # package totals of the new transaction and everything above it
+        for ancestor in ancestors:
+            other = self.entries[ancestor]
+            entry.ancestor_fee += other.fee
+            entry.ancestor_size += other.size
+            entry.ancestor_count += 1
+            other.descendant_fee += fee
+            other.descendant_size += entry.size
+            other.descendant_count += 1
+            self._push_descendant(other)
+        for parent in entry.parents:
+            self.entries[parent].children.add(txid)
+        for tx_in in tx.tx_ins:
+            self.spent[(tx_in.prev_tx, tx_in.prev_index)] = txid
+        self.entries[txid] = entry
+        self.total_size += entry.size
+        self._push_ancestor(entry)
+        self._push_descendant(entry)
+        if self.total_size > self.max_size:
+            self.trim(self.max_size)
+        self._compact()
+        return replaced
+
+    def _check_replacement(self, entry, ancestors, conflicts):
+        """Replace by fee rules. Returns every txid that would be replaced,
+        the conflicts and their descendants, or raises ValueError.
+        """
+        replaced = set(conflicts)
+        for conflict in conflicts:
+            replaced |= self.descendants(conflict)
+        if len(replaced) > MAX_REPLACED:
+            raise ValueError('replaces {} transactions, at most {}'.format(len(replaced), MAX_REPLACED))
+        if replaced & ancestors:
+            raise ValueError('spends an output of a transaction it replaces')
+        for conflict in conflicts:
+            if entry.fee_rate() <= self.entries[conflict].fee_rate():
+                raise ValueError('fee rate is not higher than the one of {}'.format(conflict.hex()))
+        replaced_fee = sum(self.entries[txid].fee for txid in replaced)
+        if entry.fee < replaced_fee:
+            raise ValueError('pays {} but replaces {} in fees'.format(entry.fee, replaced_fee))
+        if entry.fee - replaced_fee < MIN_RELAY_FEE_RATE * entry.size:
+            raise ValueError('does not pay for its own relay')
+        return replaced
+
+    def _unlink(self, entry):
+        del self.entries[entry.txid]
+        self._ancestor_current.pop(entry.txid, None)
+        self._descendant_current.pop(entry.txid, None)
+        self.total_size -= entry.size
+        for tx_in in entry.tx.tx_ins:
+            outpoint = (tx_in.prev_tx, tx_in.prev_index)
+            if self.spent.get(outpoint) == entry.txid:
+                del self.spent[outpoint]
+        for parent in entry.parents:
+            if parent in self.entries:
+                self.entries[parent].children.discard(entry.txid)
+        for child in entry.children:
+            if child in self.entries:
+                self.entries[child].parents.discard(entry.txid)
+
+    def _remove_with_descendants(self, txid):
+        """Removes txid and everything spending from it, returns the
+        removed txids
+        """
+        removed = self.descendants(txid)
+        removed.add(txid)
+        # the ancestors that stay lose the removed transactions from their
+        # descendant totals
+        touched = set()
+        for removed_txid in removed:
+            entry = self.entries[removed_txid]
+            for ancestor in self.ancestors(removed_txid):
+                if ancestor not in removed:
+                    other = self.entries[ancestor]
+                    other.descendant_fee -= entry.fee
+                    other.descendant_size -= entry.size
+                    other.descendant_count -= 1
+                    touched.add(ancestor)
+        for removed_txid in removed:
+            self._unlink(self.entries[removed_txid])
+        for ancestor in touched:
+            self._push_descendant(self.entries[ancestor])
+        return removed
+
+    def remove(self, txid):
+        """Removes a transaction and its descendants, e.g. because it is no
+        longer valid. Returns the removed txids.
+        """
+        if txid not in self.entries:
+            return set()
+        return self._remove_with_descendants(txid)
+
+    def remove_for_block(self, txs):
+        """Takes out the transactions of a new block and everything that
+        conflicts with them. Returns the txids of the conflicts removed.
+        """
+        conflicts = set()
+        for tx in txs:
+            txid = tx.hash()
+            entry = self.entries.get(txid)
+            if entry is not None:
+                # confirmed, its descendants have one ancestor less
+                for descendant in self.descendants(txid):
+                    other = self.entries[descendant]
+                    other.ancestor_fee -= entry.fee
+                    other.ancestor_size -= entry.size
+                    other.ancestor_count -= 1
+                    self._push_ancestor(other)
+                self._unlink(entry)
+                continue
+            for conflict in self.conflicts(tx):
+                if conflict in self.entries:
+                    conflicts |= self._remove_with_descendants(conflict)
+        return conflicts
+
+    def trim(self, max_size):
+        """Evicts the packages with the lowest descendant fee rate until the
+        pool fits in max_size vbytes. The minimum fee rate for new
+        transactions goes up to just above the highest evicted one.
+        Returns the evicted txids.
+        """
+        evicted = set()
+        heap = self._descendant_heap
+        while self.total_size > max_size and heap:
+            fee_rate, n, txid = heapq.heappop(heap)
+            if self._descendant_current.get(txid) != n:
+                continue
+            evicted |= self._remove_with_descendants(txid)
+            self.min_fee_rate = max(self.min_fee_rate, fee_rate + MIN_RELAY_FEE_RATE)
+        return evicted
+
+    def best(self):
+        """The entry with the highest ancestor fee rate"""
+        heap = self._ancestor_heap
+        while heap:
+            _, n, txid = heap[0]
+            if self._ancestor_current.get(txid) == n:
+                return self.entries[txid]
+            heapq.heappop(heap)
+        return None
+
+    def block_template(self, max_size=1000000 - 1000):
+        """Returns transactions for a block of at most max_size vbytes, in
+        an order where parents come before children.
+        Packages are picked by ancestor fee rate. Once a package is in, the
+        totals of its descendants are lowered so they are judged only by
+        what is still left to include.
+        """
+        entries = self.entries
+        fee = {}
+        size = {}
+        current = {}
+        heap = []
+        counter = count()
+        for txid, entry in entries.items():
+            fee[txid] = entry.ancestor_fee
+            size[txid] = entry.ancestor_size
+            n = next(counter)
+            current[txid] = n
+            heap.append((-fee[txid] / size[txid], n, txid))
+        heapq.heapify(heap)
+        selected = set()
+        result = []
+        total = 0
+        while heap:
+            _, n, txid = heapq.heappop(heap)
+            if txid in selected or current.get(txid) != n:
+                continue
+            if total + size[txid] > max_size:
+                # the package does not fit, maybe a smaller one will
+                continue
+            package = [txid]
+            for ancestor in self.ancestors(txid):
+                if ancestor not in selected:
+                    package.append(ancestor)
+            # fewer ancestors first puts parents before their children
+            package.sort(key=lambda t: entries[t].ancestor_count)
+            for member in package:
+                entry = entries[member]
+                selected.add(member)
+                result.append(entry.tx)
+                total += entry.size
+                for descendant in self.descendants(member):
+                    if descendant not in selected:
+                        fee[descendant] -= entry.fee
+                        size[descendant] -= entry.size
+                        n = next(counter)
+                        current[descendant] = n
+                        heapq.heappush(heap, (-fee[descendant] / size[descendant], n, descendant))
+        return result
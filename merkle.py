@@ -0,0 +1,138 @@
+"""Merkle roots and inclusion proofs.
+
+Hashes are in internal byte order, the reverse of how tx ids are shown:
+tx.hash()[::-1]. An odd node at the end of a level is paired with itself.
+"""
+import hashlib
+
+
+def merkle_parent(hash1, hash2):
+    """Takes the binary hashes and calculates the hash256"""
+    h = hashlib.sha256(hash1)
+    h.update(hash2)
+    return hashlib.sha256(h.digest()).digest()
+
+
+def merkle_root(hashes):
+    """Returns the merkle root of a list of hashes, level by level in a
+    single list that shrinks to the root
+    """
+    level = list(hashes)
+    if not level:
+        raise ValueError('no hashes')
+    sha256 = hashlib.sha256
+    while len(level) > 1:
+        if len(level) % 2 == 1:
+            level.append(level[-1])
+        for i in range(0, len(level), 2):
+            h = sha256(level[i])
+            h.update(level[i + 1])
+            level[i // 2] = sha256(h.digest()).digest()
+        del level[len(level) // 2:]
+    return level[0]
+
+
+def verify_merkle_proof(leaf, index, proof, root):
+    """Returns whether leaf is at index of a tree with this root, proof is
+    the list of sibling hashes from the bottom up
+    """
+    h = leaf
+    for sibling in proof:
+        if index & 1:
+            h = merkle_parent(sibling, h)
+        else:
+            h = merkle_parent(h, sibling)
+        index >>= 1
+    return index == 0 and h == root
+
+
+class MerkleTree:
+    """Keeps every level of the tree so proofs need no hashing"""
+
+    def __init__(self, hashes):
+        level = list(hashes)
+        if not level:
+            raise ValueError('no hashes')
+        self.levels = [level]
+        while len(level) > 1:
+            if len(level) % 2 == 1:
+                level = level + [level[-1]]
+            level = [merkle_parent(level[i], level[i + 1]) for i in range(0, len(level), 2)]
+            self.levels.append(level)
+
+    def __repr__(self):
+        return 'MerkleTree({}, {} leaves)'.format(self.root()[::-1].hex(), len(self))
+
+    def __len__(self):
+        return len(self.levels[0])
+
+    def root(self):
+        return self.levels[-1][0]
+
+    def proof(self, index):
+        """Returns the sibling hashes from the leaf at index up to the root"""
+        if not 0 <= index < len(self):
+            raise IndexError('no leaf {}'.format(index))
+        proof = []
+        for level in self.levels[:-1]:
+            sibling = index ^ 1
+            # the last node of an odd level is its own sibling
+            proof.append(level[sibling] if sibling < len(level) else level[index])
+            index >>= 1
+        return proof
+
+
+class IncrementalMerkleTree:
+    """Merkle root of a growing list of hashes.
+    Only the roots of the complete subtrees (peaks) are kept, peaks[k]
+    covering 2 ** k leaves, so appending hashes O(log n) times at most.
+    """
+
+    def __init__(self, hashes=()):
+        self.peaks = []
+        self.count = 0
+        self.extend(hashes)
+
+    def __repr__(self):
+        return 'IncrementalMerkleTree({} leaves)'.format(self.count)
+
+    def __len__(self):
+        return self.count
+
+    def append(self, h):
+        peaks = self.peaks
+        k = 0
+        while k < len(peaks) and peaks[k] is not None:
+            h = merkle_parent(peaks[k], h)
+            peaks[k] = None
+            k += 1
+        if k == len(peaks):
+            peaks.append(h)
+        else:
+            peaks[k] = h
+        self.count += 1
+
+    def extend(self, hashes):
+        for h in hashes:
+            self.append(h)
+
+    def root(self):
+        """Combines the peaks from the bottom up, duplicating the last node
+        of every odd level the way merkle_root does
+        """
+        if not self.count:
+            raise ValueError('no hashes')
+        top = len(self.peaks) - 1
+        carry = None
+        for k, peak in enumerate(self.peaks):
+            if carry is None:
+                if peak is None:
+                    continue
+                if k == top:
+                    return peak
+                carry = merkle_parent(peak, peak)
+            elif peak is None:
+                carry = merkle_parent(carry, carry)
+            else:
+                carry = merkle_parent(peak, carry)
+        return carry
@@ -1,141 +1,147 @@
 import hashlib
+from logging import getLogger
 
+from ecc import (
+    S256Point,
+    Signature,
+)
 from helper import (
     hash160,
     hash256,
 )
 
 
-def encode_num(num):
+LOGGER = getLogger(__name__)
+
+
+def _encode_num(num):
     if num == 0:
         return b''
     abs_num = abs(num)
-    negative = num < 0
-    result = bytearray()
-    while abs_num:
-        result.append(abs_num & 0xff)
-        abs_num >>= 8
-    # if the top bit is set,
-    # for negative numbers we ensure that the top bit is set
-    # for positive numbers we ensure that the top bit is not set
-    if result[-1] & 0x80:
-        if negative:
-            result.append(0x80)
-        else:
-            result.append(0)
-    elif negative:
-        result[-1] |= 0x80
-    return bytes(result)
+    # leave room for the sign bit at the top of the last byte
+    length = abs_num.bit_length() // 8 + 1
+    if num < 0:
+        abs_num |= 1 << (length * 8 - 1)
+    return abs_num.to_bytes(length, 'little')
+
+
+# encodings of the numbers scripts use most, shared by every stack
+ENCODED_NUMS = {num: _encode_num(num) for num in range(-255, 256)}
+# decoded value of every one byte element
+DECODED_BYTES = tuple(-(c & 0x7f) if c & 0x80 else c for c in range(256))
+
+TRUE = ENCODED_NUMS[1]
+FALSE = ENCODED_NUMS[0]
+
+
+def encode_num(num):
+    encoded = ENCODED_NUMS.get(num)
+    if encoded is None:
+        return _encode_num(num)
+    return encoded
 
 
 def decode_num(element):
-    if element == b'':
+    length = len(element)
+    if length == 1:
+        return DECODED_BYTES[element[0]]
+    if length == 0:
         return 0
-    # reverse for big endian
-    big_endian = element[::-1]
+    result = int.from_bytes(element, 'little')
     # top bit being 1 means it's negative
-    if big_endian[0] & 0x80:
-        negative = True
-        result = big_endian[0] & 0x7f
-    else:
-        negative = False
-        result = big_endian[0]
-    for c in big_endian[1:]:
-        result <<= 8
-        result += c
-    if negative:
-        return -result
-    else:
-        return result
+    sign = 1 << (length * 8 - 1)
+    if result & sign:
+        return -(result ^ sign)
+    return result
 
 
 def op_0(stack):
-    stack.append(encode_num(0))
+    stack.append(FALSE)
     return True
 
 
 def op_1negate(stack):
-    stack.append(encode_num(-1))
+    stack.append(ENCODED_NUMS[-1])
     return True
 
 
 def op_1(stack):
-    stack.append(encode_num(1))
+    stack.append(ENCODED_NUMS[1])
     return True
 
 
 def op_2(stack):
-    stack.append(encode_num(2))
+    stack.append(ENCODED_NUMS[2])
     return True
 
 
 def op_3(stack):
-    stack.append(encode_num(3))
+    stack.append(ENCODED_NUMS[3])
     return True
 
 
 def op_4(stack):
-    stack.append(encode_num(4))
+    stack.append(ENCODED_NUMS[4])
     return True
 
 
 def op_5(stack):
-    stack.append(encode_num(5))
+    stack.append(ENCODED_NUMS[5])
     return True
 
 
 def op_6(stack):
-    stack.append(encode_num(6))
+    stack.append(ENCODED_NUMS[6])
     return True
 
 
 def op_7(stack):
-    stack.append(encode_num(7))
+    stack.append(ENCODED_NUMS[7])
     return True
 
 
 def op_8(stack):
-    stack.append(encode_num(8))
+    stack.append(ENCODED_NUMS[8])
     return True
 
 
 def op_9(stack):
-    stack.append(encode_num(9))
+    stack.append(ENCODED_NUMS[9])
     return True
 
 
 def op_10(stack):
-    stack.append(encode_num(10))
+    stack.append(ENCODED_NUMS[10])
     return True
 
 
 def op_11(stack):
-    stack.append(encode_num(11))
+    stack.append(ENCODED_NUMS[11])
     return True
 
 
 def op_12(stack):
-    stack.append(encode_num(12))
+    stack.append(ENCODED_NUMS[12])
     return True
 
 
 def op_13(stack):
-    stack.append(encode_num(13))
+    stack.append(ENCODED_NUMS[13])
     return True
 
 
 def op_14(stack):
-    stack.append(encode_num(14))
+    stack.append(ENCODED_NUMS[14])
     return True
 
 
 def op_15(stack):
-    stack.append(encode_num(15))
+    stack.append(ENCODED_NUMS[15])
     return True
 
 
 def op_16(stack):
-    stack.append(encode_num(16))
+    stack.append(ENCODED_NUMS[16])
     return True
 
 
@@ -382,14 +388,18 @@ def op_equal(stack):
     element1 = stack.pop()
     element2 = stack.pop()
     if element1 == element2:
-        stack.append(encode_num(1))
+        stack.append(TRUE)
     else:
-        stack.append(encode_num(0))
+        stack.append(FALSE)
     return True
 
 
 def op_equalverify(stack):
-    return op_equal(stack) and op_verify(stack)
+    # same as op_equal followed by op_verify without the round trip
+    # through the stack
+    if len(stack) < 2:
+        return False
+    return stack.pop() == stack.pop()
 
 
 def op_1add(stack):
@@ -432,9 +442,9 @@ def op_not(stack):
         return False
     element = stack.pop()
     if decode_num(element) == 0:
-        stack.append(encode_num(1))
+        stack.append(TRUE)
     else:
-        stack.append(encode_num(0))
+        stack.append(FALSE)
     return True
 
 
@@ -443,9 +453,9 @@ def op_0notequal(stack):
         return False
     element = stack.pop()
     if decode_num(element) == 0:
-        stack.append(encode_num(0))
+        stack.append(FALSE)
     else:
-        stack.append(encode_num(1))
+        stack.append(TRUE)
     return True
 
 
@@ -473,9 +483,9 @@ def op_booland(stack):
     element1 = decode_num(stack.pop())
     element2 = decode_num(stack.pop())
     if element1 and element2:
-        stack.append(encode_num(1))
+        stack.append(TRUE)
     else:
-        stack.append(encode_num(0))
+        stack.append(FALSE)
     return True
 
 
@@ -485,9 +495,9 @@ def op_boolor(stack):
     element1 = decode_num(stack.pop())
     element2 = decode_num(stack.pop())
     if element1 or element2:
-        stack.append(encode_num(1))
+        stack.append(TRUE)
     else:
-        stack.append(encode_num(0))
+        stack.append(FALSE)
     return True
 
 
@@ -497,14 +507,18 @@ def op_numequal(stack):
     element1 = decode_num(stack.pop())
     element2 = decode_num(stack.pop())
     if element1 == element2:
-        stack.append(encode_num(1))
+        stack.append(TRUE)
     else:
-        stack.append(encode_num(0))
+        stack.append(FALSE)
     return True
 
 
 def op_numequalverify(stack):
-    return op_numequal(stack) and op_verify(stack)
+    # same as op_numequal followed by op_verify without the round trip
+    # through the stack
+    if len(stack) < 2:
+        return False
+    return decode_num(stack.pop()) == decode_num(stack.pop())
 
 
 def op_numnotequal(stack):
@@ -513,9 +527,9 @@ def op_numnotequal(stack):
     element1 = decode_num(stack.pop())
     element2 = decode_num(stack.pop())
     if element1 == element2:
-        stack.append(encode_num(0))
+        stack.append(FALSE)
     else:
-        stack.append(encode_num(1))
+        stack.append(TRUE)
     return True
 
 
@@ -525,9 +539,9 @@ def op_lessthan(stack):
     element1 = decode_num(stack.pop())
     element2 = decode_num(stack.pop())
     if element2 < element1:
-        stack.append(encode_num(1))
+        stack.append(TRUE)
     else:
-        stack.append(encode_num(0))
+        stack.append(FALSE)
     return True
 
 
@@ -537,9 +551,9 @@ def op_greaterthan(stack):
     element1 = decode_num(stack.pop())
     element2 = decode_num(stack.pop())
     if element2 > element1:
-        stack.append(encode_num(1))
+        stack.append(TRUE)
     else:
-        stack.append(encode_num(0))
+        stack.append(FALSE)
     return True
 
 
@@ -549,9 +563,9 @@ def op_lessthanorequal(stack):
     element1 = decode_num(stack.pop())
     element2 = decode_num(stack.pop())
     if element2 <= element1:
-        stack.append(encode_num(1))
+        stack.append(TRUE)
     else:
-        stack.append(encode_num(0))
+        stack.append(FALSE)
     return True
 
 
@@ -561,9 +575,9 @@ def op_greaterthanorequal(stack):
     element1 = decode_num(stack.pop())
     element2 = decode_num(stack.pop())
     if element2 >= element1:
-        stack.append(encode_num(1))
+        stack.append(TRUE)
     else:
-        stack.append(encode_num(0))
+        stack.append(FALSE)
     return True
 
 
@@ -598,9 +612,9 @@ def op_within(stack):
     minimum = decode_num(stack.pop())
     element = decode_num(stack.pop())
     if minimum <= element < maximum:
-        stack.append(encode_num(1))
+        stack.append(TRUE)
     else:
-        stack.append(encode_num(0))
+        stack.append(FALSE)
     return True
 
 
@@ -629,7 +643,11 @@ def op_sha256(stack):
 
 
 def op_hash160(stack):
-    raise NotImplementedError
+    if len(stack) < 1:
+        return False
+    element = stack.pop()
+    stack.append(hash160(element))
+    return True
 
 
 def op_hash256(stack):
@@ -640,20 +658,90 @@ def op_hash256(stack):
     return True
 
 
-def op_checksig(stack, z):
-    raise NotImplementedError
+def _check_signature(sec_pubkey, der_signature, z):
+    """Whether the signature is valid, a pubkey or signature that cannot
+    be parsed is an invalid signature
+    """
+    try:
+        point = S256Point.parse(sec_pubkey)
+        sig = Signature.parse(der_signature)
+    except (ValueError, SyntaxError) as e:
+        LOGGER.info(e)
+        return False
+    return point.verify(z, sig)
+
+
+def op_checksig(stack, z, batch=None):
+    """If a SignatureBatch is passed, the check is recorded there and the
+    signature is assumed to be valid until the batch is verified. That is
+    only the same as checking it right away when a failed check fails the
+    whole script, Script.evaluate only passes a batch in that case.
+    """
+    if len(stack) < 2:
+        return False
+    sec_pubkey = stack.pop()
+    # signature has a hashtype byte on the end which we drop
+    der_signature = stack.pop()[:-1]
+    if not der_signature:
+        # an empty signature is a legitimate way to fail the check
+        stack.append(FALSE)
+        return True
+    if batch is not None:
+        batch.add(sec_pubkey, der_signature, z)
+        stack.append(TRUE)
+        return True
+    if _check_signature(sec_pubkey, der_signature, z):
+        stack.append(TRUE)
+    else:
+        stack.append(FALSE)
+    return True
 
 
-def op_checksigverify(stack, z):
-    return op_checksig(stack, z) and op_verify(stack)
+def op_checksigverify(stack, z, batch=None):
+    return op_checksig(stack, z, batch) and op_verify(stack)
 
 
-def op_checkmultisig(stack, z):
-    raise NotImplementedError
+def op_checkmultisig(stack, z, batch=None):
+    """Signatures have to be in the same order as the pubkeys they belong
+    to, so they are matched against the pubkeys in a single pass.
+    With a SignatureBatch and as many signatures as pubkeys every pair is
+    known up front and the checks are deferred to the batch.
+    """
+    if len(stack) < 1:
+        return False
+    n = decode_num(stack.pop())
+    if not 0 <= n <= 20 or len(stack) < n + 1:
+        return False
+    # both lists end up reversed, which keeps them in the same order
+    sec_pubkeys = [stack.pop() for _ in range(n)]
+    m = decode_num(stack.pop())
+    if not 0 <= m <= n or len(stack) < m + 1:
+        return False
+    # signature has a hashtype byte on the end which we drop
+    der_signatures = [stack.pop()[:-1] for _ in range(m)]
+    # OP_CHECKMULTISIG off-by-one bug consumes an extra element
+    stack.pop()
+    if batch is not None and m == n and all(der_signatures):
+        for sec_pubkey, der_signature in zip(sec_pubkeys, der_signatures):
+            batch.add(sec_pubkey, der_signature, z)
+        stack.append(TRUE)
+        return True
+    i = 0
+    for j, sec_pubkey in enumerate(sec_pubkeys):
+        if i == m or m - i > n - j:
+            # done, or not enough pubkeys left for the signatures
+            break
+        if der_signatures[i] and _check_signature(sec_pubkey, der_signatures[i], z):
+            i += 1
+    if i == m:
+        stack.append(TRUE)
+    else:
+        stack.append(FALSE)
+    return True
 
 
-def op_checkmultisigverify(stack, z):
-    return op_checkmultisig(stack, z) and op_verify(stack)
+def op_checkmultisigverify(stack, z, batch=None):
+    return op_checkmultisig(stack, z, batch) and op_verify(stack)
 
 
 def op_checklocktimeverify(stack, locktime, sequence):
@@ -691,6 +779,9 @@ def op_checksequenceverify(stack, version, sequence):
     return True
 
 
+# OP_RIPEMD160, OP_SHA1, OP_SHA256, OP_HASH160 and OP_HASH256
+HASH_OPS = (166, 167, 168, 169, 170)
+
 OP_CODE_FUNCTIONS = {
     0: op_0,
     79: op_1negate,
@@ -0,0 +1,302 @@
+"""Full block validation as a pipeline.
+
+    parse -> merkle -> utxo -> script -> signatures
+
+Each stage runs in its own thread and hands blocks to the next one through
+a bounded queue, so a slow stage holds the earlier ones back instead of
+letting blocks pile up in memory. The signature checks collected by the
+script stage go to a process pool, so the elliptic curve math runs on other
+cores while the following blocks are parsed, hashed and evaluated.
+"""
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+from queue import Empty, Full, Queue
+from threading import Event, Lock, Thread
+
+from block import Block
+from ecc import SignatureBatch
+from tx import _verify_signatures
+from utxo import UtxoSet
+
+STAGES = ('parse', 'merkle', 'utxo', 'script', 'signatures')
+# marks the end of the blocks in a queue
+_DONE = object()
+
+
+class _Stopped(Exception):
+    pass
+
+
+class BlockResult:
+    """Outcome of validating one block.
+    reason is None for a valid block, otherwise one of 'parse', 'merkle',
+    'missing-input', 'fee', 'script', 'signature' or 'previous-block'.
+    location is (tx index, input index) of the failing input, input index
+    is None for a transaction that spends more than its inputs.
+    """
+
+    def __init__(self, index, block_hash, reason=None, location=None):
+        self.index = index
+        self.block_hash = block_hash
+        self.reason = reason
+        self.location = location
+
+    def __repr__(self):
+        block_hash = self.block_hash.hex() if self.block_hash is not None else None
+        if self.valid:
+            return 'BlockResult({}, {}, valid)'.format(self.index, block_hash)
+        return 'BlockResult({}, {}, {} at {})'.format(self.index, block_hash, self.reason, self.location)
+
+    @property
+    def valid(self):
+        return self.reason is None
+
+
+class _Item:
+    """A block on its way through the pipeline"""
+
+    def __init__(self, index, raw):
+        self.index = index
+        self.raw = raw
+        self.block = None
+        self.reason = None
+        self.location = None
+        # signature checks and the (tx index, input index) of each
+        self.checks = []
+        self.owners = []
+        # (future, position of its first check in owners)
+        self.futures = []
+        # changes made to the UTXO set, see UtxoSet.rollback
+        self.undo = []
+
+    def fail(self, reason, location=None):
+        self.reason = reason
+        self.location = location
+
+
+class Pipeline:
+    """Validates blocks in order against utxo_set, spending and adding
+    outputs as it goes.
+    Results come out in the order the blocks went in and do not depend on
+    timing. A block after an invalid one is reported as 'previous-block'.
+    The UTXO stage runs ahead of the signature checks, so the changes of
+    each block are kept until its result is out: those of the first
+    invalid block and every one after it are rolled back, as are those of
+    the blocks not yet reported when run stops early. The UTXO set ends up
+    as it was after the last valid block reported.
+    The proof of work of the headers is not checked here, see HeaderChain.
+    """
+
+    def __init__(self, utxo_set=None, testnet=False, max_workers=None, chunk_size=64,
+                 queue_size=4, executor=None):
+        if utxo_set is None:
+            utxo_set = UtxoSet(testnet=testnet)
+        self.utxo_set = utxo_set
+        self.testnet = testnet
+        self.max_workers = max_workers
+        self.chunk_size = chunk_size
+        self.queue_size = queue_size
+        self.executor = executor
+        self.stats = {name: {'items': 0, 'seconds': 0.0, 'blocked': 0.0} for name in STAGES}
+
+    def report(self):
+        """Per stage blocks handled, seconds busy, seconds blocked on a full
+        queue and blocks per busy second
+        """
+        result = {}
+        for name, stats in self.stats.items():
+            stats = dict(stats)
+            stats['per_sec'] = stats['items'] / stats['seconds'] if stats['seconds'] else None
+            result[name] = stats
+        return result
+
+    def _parse(self, item):
+        try:
+            item.block = Block.parse(BytesIO(item.raw), testnet=self.testnet)
+        except (IndexError, SyntaxError, ValueError):
+            item.fail('parse')
+        item.raw = None
+
+    def _merkle(self, item):
+        if not item.block.check_merkle_root():
+            item.fail('merkle')
+
+    def _utxo(self, item, applied, lock, halt):
+        with lock:
+            if halt.is_set():
+                item.fail('previous-block')
+                return
+            # rolled back by run if this block or an earlier one fails
+            applied.append(item)
+            self._apply(item)
+
+    def _apply(self, item):
+        utxo_set = self.utxo_set
+        for tx_index, tx in enumerate(item.block.txs):
+            if not tx.is_coinbase():
+                input_sum = 0
+                for input_index, tx_in in enumerate(tx.tx_ins):
+                    prevout = utxo_set.get(tx_in.prev_tx, tx_in.prev_index)
+                    if prevout is None:
+                        item.fail('missing-input', (tx_index, input_index))
+                        return
+                    # the later stages read the spent output from here
+                    tx_in.prevout = prevout
+                    input_sum += prevout[0]
+                if input_sum < sum(tx_out.amount for tx_out in tx.tx_outs):
+                    item.fail('fee', (tx_index, None))
+                    return
+            utxo_set.add(tx, item.undo)
+
+    def _script(self, item):
+        for tx_index, tx in enumerate(item.block.txs):
+            if tx.is_coinbase():
+                continue
+            for input_index in range(len(tx.tx_ins)):
+                batch = SignatureBatch()
+                if not tx.verify_input(input_index, batch):
+                    item.fail('script', (tx_index, input_index))
+                    return
+                item.checks += batch.checks
+                item.owners += [(tx_index, input_index)] * len(batch)
+
+    def _signatures(self, item, executor):
+        checks = item.checks
+        for start in range(0, len(checks), self.chunk_size):
+            chunk = checks[start:start + self.chunk_size]
+            item.futures.append((executor.submit(_verify_signatures, chunk), start))
+        item.checks = None
+
+    def _get(self, queue, stop):
+        while True:
+            try:
+                return queue.get(timeout=0.1)
+            except Empty:
+                if stop.is_set():
+                    raise _Stopped()
+
+    def _put(self, queue, item, stop, stats):
+        start = time.perf_counter()
+        while True:
+            try:
+                queue.put(item, timeout=0.1)
+                break
+            except Full:
+                if stop.is_set():
+                    raise _Stopped()
+        stats['blocked'] += time.perf_counter() - start
+
+    def _source(self, raw_blocks, outbox, stop, errors):
+        stats = self.stats['parse']
+        try:
+            for index, raw in enumerate(raw_blocks):
+                start = time.perf_counter()
+                item = _Item(index, raw)
+                self._parse(item)
+                stats['seconds'] += time.perf_counter() - start
+                stats['items'] += 1
+                self._put(outbox, item, stop, stats)
+            self._put(outbox, _DONE, stop, stats)
+        except _Stopped:
+            pass
+        except BaseException as e:
+            errors.append(e)
+            stop.set()
+
+    def _stage(self, name, func, inbox, outbox, stop, errors):
+        stats = self.stats[name]
+        try:
+            while True:
+                item = self._get(inbox, stop)
+                if item is not _DONE:
+                    start = time.perf_counter()
+                    if item.reason is None:
+                        func(item)
+                    stats['seconds'] += time.perf_counter() - start
+                    stats['items'] += 1
+                self._put(outbox, item, stop, stats)
+                if item is _DONE:
+                    return
+        except _Stopped:
+            pass
+        except BaseException as e:
+            errors.append(e)
+            stop.set()
+
+    def _rollback(self, applied, lock, halt):
+        """Stops the UTXO stage and rolls back the blocks it applied that
+        have not been reported valid, latest first
+        """
+        with lock:
+            halt.set()
+            while applied:
+                self.utxo_set.rollback(applied.pop().undo)
+
+    def run(self, raw_blocks):
+        """Validates serialized blocks and yields a BlockResult for each.
+        To read them from a BlockFile, pass
+        (raw for _, raw in block_file.raw_blocks()).
+        """
+        own_executor = self.executor is None
+        executor = ProcessPoolExecutor(max_workers=self.max_workers) if own_executor else self.executor
+        stop = Event()
+        errors = []
+        # blocks whose changes are in the UTXO set but not reported yet
+        applied = deque()
+        lock = Lock()
+        halt = Event()
+        stages = [
+            ('merkle', self._merkle),
+            ('utxo', lambda item: self._utxo(item, applied, lock, halt)),
+            ('script', self._script),
+            ('signatures', lambda item: self._signatures(item, executor)),
+        ]
+        # queues[i] feeds stages[i], the last one feeds the loop below
+        queues = [Queue(maxsize=self.queue_size) for _ in range(len(stages) + 1)]
+        threads = [Thread(target=self._source, args=(raw_blocks, queues[0], stop, errors), daemon=True)]
+        for i, (name, func) in enumerate(stages):
+            threads.append(Thread(target=self._stage, args=(name, func, queues[i], queues[i + 1], stop, errors),
+                                  daemon=True))
+        for thread in threads:
+            thread.start()
+        stats = self.stats['signatures']
+        failed = False
+        try:
+            while True:
+                try:
+                    item = self._get(queues[-1], stop)
+                except _Stopped:
+                    raise errors[0]
+                if item is _DONE:
+                    break
+                start = time.perf_counter()
+                for i, (future, first) in enumerate(item.futures):
+                    position = future.result()
+                    if position is not None:
+                        item.fail('signature', item.owners[first + position])
+                        for later, _ in item.futures[i + 1:]:
+                            later.cancel()
+                        break
+                stats['seconds'] += time.perf_counter() - start
+                block_hash = item.block.hash() if item.block is not None else None
+                if failed:
+                    yield BlockResult(item.index, block_hash, 'previous-block')
+                    continue
+                failed = item.reason is not None
+                if failed:
+                    self._rollback(applied, lock, halt)
+                else:
+                    with lock:
+                        # every block before this one was reported already
+                        applied.popleft()
+                        item.undo = None
+                yield BlockResult(item.index, block_hash, item.reason, item.location)
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
+            self._rollback(applied, lock, halt)
+            if own_executor:
+                executor.shutdown(wait=True)
@@ -3,6 +3,8 @@ from field_element import FieldElement
 
 # 椭圆曲线上的点
 class Point:
+    __slots__ = ('a', 'b', 'x', 'y')
+
     def __init__(self, x, y, a, b):
         self.a = a
         self.b = b
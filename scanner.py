@@ -0,0 +1,189 @@
+"""Finds the outputs paying to, and the inputs spending from, a set of
+hash160s in a stream of transactions or blocks.
+
+Transactions are walked with TxView and the raw script bytes are matched
+against a set of hash160s, so no Tx, Script or point is made for the
+transactions that do not match. Spends are found two ways:
+
+    - the outpoint was a matching output earlier in the stream
+    - the last push of the script_sig (the SEC pubkey of p2pkh, the redeem
+      script of p2sh) or of the witness (the SEC pubkey of p2wpkh) hashes
+      to one of the hash160s
+
+The second way also finds spends of outputs made before the stream
+started, at the cost of one hash160 per input. It can be turned off with
+match_keys=False.
+"""
+from block import Block, HEADER_SIZE
+from helper import decode_base58, hash160, hash256, little_endian_to_int
+from script import P2PK, P2PKH, P2SH, P2WPKH, classify_script
+from tx import TxView
+from utxo import outpoint
+
+# output types matched by their hash160
+HASH160_TYPES = (P2PKH, P2SH, P2WPKH)
+COINBASE_PREV_TX = b'\x00' * 32
+
+
+def last_push(script):
+    """Data of the last push of a raw script, None if the script is empty,
+    does not end with a push or is cut short
+    """
+    data = None
+    i = 0
+    n = len(script)
+    while i < n:
+        op = script[i]
+        i += 1
+        if 1 <= op <= 75:
+            length = op
+        elif op == 76:
+            length = script[i] if i < n else 0
+            i += 1
+        elif op == 77:
+            length = little_endian_to_int(script[i:i + 2])
+            i += 2
+        elif op == 78:
+            length = little_endian_to_int(script[i:i + 4])
+            i += 4
+        else:
+            data = None
+            continue
+        data = script[i:i + length]
+        i += length
+    if i > n:
+        return None
+    return data
+
+
+class Hit:
+    """A matching output or input.
+    kind is 'output' or 'input', txid and index locate the output or the
+    input, block is the hash of the block it was found in, if any.
+    For an input, prev_tx and prev_index are the output it spends and
+    script_type and amount are only known when that output was seen
+    earlier in the stream.
+    """
+    __slots__ = ('kind', 'txid', 'index', 'hash160', 'script_type', 'amount', 'prev_tx', 'prev_index', 'block')
+
+    def __init__(self, kind, txid, index, hash160, script_type=None, amount=None,
+                 prev_tx=None, prev_index=None, block=None):
+        self.kind = kind
+        self.txid = txid
+        self.index = index
+        self.hash160 = hash160
+        self.script_type = script_type
+        self.amount = amount
+        self.prev_tx = prev_tx
+        self.prev_index = prev_index
+        self.block = block
+
+    def __repr__(self):
+        return 'Hit({} {}:{} {})'.format(self.kind, self.txid.hex(), self.index, self.hash160.hex())
+
+
+class Scanner:
+    """Matches transactions against a set of hash160s, from
+    S256Point.hash160 or decoded addresses
+    """
+
+    def __init__(self, hash160s=(), addresses=(), match_keys=True):
+        self.hash160s = set()
+        # outpoint -> (hash160, script type, amount) of matching outputs
+        # that have not been spent in the stream yet
+        self.watched = {}
+        self.match_keys = match_keys
+        self.stats = {'txs': 0, 'outputs': 0, 'inputs': 0, 'hits': 0}
+        for h160 in hash160s:
+            self.add_hash160(h160)
+        for address in addresses:
+            self.add_address(address)
+
+    def add_hash160(self, h160):
+        if len(h160) != 20:
+            raise ValueError('a hash160 is 20 bytes, not {}'.format(len(h160)))
+        self.hash160s.add(bytes(h160))
+
+    def add_address(self, address):
+        """Adds the hash160 of a base58 p2pkh or p2sh address"""
+        self.add_hash160(decode_base58(address))
+
+    def add_point(self, point):
+        """Adds the hash160s of both SEC formats of a public key"""
+        self.add_hash160(point.hash160(compressed=True))
+        self.add_hash160(point.hash160(compressed=False))
+
+    def scan_view(self, view, block=None):
+        """Returns the hits of one TxView, spends first"""
+        hits = []
+        hash160s = self.hash160s
+        watched = self.watched
+        txid = view.hash()
+        stats = self.stats
+        stats['txs'] += 1
+        stats['inputs'] += len(view.in_offsets)
+        stats['outputs'] += len(view.out_offsets)
+        buf = view.buf
+        for index, offset in enumerate(view.in_offsets):
+            prev = buf[offset:offset + 36].tobytes()
+            if prev[:32] == COINBASE_PREV_TX:
+                continue
+            prev_tx = prev[31::-1]
+            prev_index = little_endian_to_int(prev[32:])
+            found = watched.pop(outpoint(prev_tx, prev_index), None)
+            if found is not None:
+                h160, script_type, amount = found
+                hits.append(Hit('input', txid, index, h160, script_type, amount, prev_tx, prev_index, block))
+                continue
+            if not self.match_keys or not hash160s:
+                continue
+            candidates = [last_push(view.script_sig(index))]
+            if view.segwit:
+                witness = view.witness(index)
+                if witness:
+                    candidates.append(witness[-1])
+            for data in candidates:
+                if data:
+                    h160 = hash160(data)
+                    if h160 in hash160s:
+                        hits.append(Hit('input', txid, index, h160, None, None, prev_tx, prev_index, block))
+                        break
+        for index in range(len(view.out_offsets)):
+            script_type, payload = classify_script(view.script_pubkey(index))
+            if script_type in HASH160_TYPES:
+                h160 = payload
+            elif script_type == P2PK:
+                h160 = hash160(payload)
+            else:
+                continue
+            if h160 in hash160s:
+                amount = view.amount(index)
+                watched[outpoint(txid, index)] = (h160, script_type, amount)
+                hits.append(Hit('output', txid, index, h160, script_type, amount, block=block))
+        stats['hits'] += len(hits)
+        return hits
+
+    def scan(self, txs, block=None):
+        """Yields the hits of txs, which can be Tx objects, TxViews or
+        serialized transactions, in the order they are in the stream
+        """
+        for tx in txs:
+            if isinstance(tx, TxView):
+                view = tx
+            elif isinstance(tx, (bytes, bytearray, memoryview)):
+                view = TxView(tx)
+            else:
+                view = TxView(tx.serialize())
+            for hit in self.scan_view(view, block):
+                yield hit
+
+    def scan_blocks(self, raw_blocks):
+        """Yields the hits of serialized blocks, hit.block is the hash of
+        the block. To read them from a BlockFile, pass
+        (raw for _, raw in block_file.raw_blocks()).
+        """
+        for raw in raw_blocks:
+            block_hash = hash256(raw[:HEADER_SIZE])[::-1]
+            for view in Block.tx_views(raw):
+                for hit in self.scan_view(view, block_hash):
+                    yield hit
@@ -1,14 +1,19 @@
+import hashlib
 from io import BytesIO
 from logging import getLogger
+from time import perf_counter
 from unittest import TestCase
 
 from helper import (
     encode_varint,
+    hash160,
     int_to_little_endian,
     little_endian_to_int,
     read_varint,
 )
 from op import (
+    decode_num,
+    HASH_OPS,
     OP_CODE_FUNCTIONS,
     OP_CODE_NAMES,
 )
@@ -17,13 +22,138 @@ from op import (
 LOGGER = getLogger(__name__)
 
 
+class ScriptLimitError(ValueError):
+    """Raised when a script goes over one of its ScriptLimits"""
+
+    def __init__(self, reason, limit):
+        super().__init__('script exceeded {} limit of {}'.format(reason, limit))
+        # one of 'ops', 'stack', 'element' or 'sigops'
+        self.reason = reason
+        self.limit = limit
+
+
+class ScriptLimits:
+    """Resource budget for one Script.evaluate call.
+    The defaults are the consensus limits, except for sigops which are
+    limited per block in consensus and per script here.
+    """
+
+    def __init__(self, max_ops=201, max_stack=1000, max_element_size=520, max_sigops=20000):
+        # opcodes above OP_16 that can be run
+        self.max_ops = max_ops
+        # items on the stack and altstack together
+        self.max_stack = max_stack
+        # bytes in a single pushed element
+        self.max_element_size = max_element_size
+        # signature checks, OP_CHECKMULTISIG counts one per pubkey
+        self.max_sigops = max_sigops
+
+
+DEFAULT_LIMITS = ScriptLimits()
+
+
+def p2pkh_script(h160):
+    """Takes a hash160 and returns the p2pkh ScriptPubKey"""
+    return Script([0x76, 0xa9, h160, 0x88, 0xac])
+
+
+def p2sh_script(h160):
+    """Takes a hash160 and returns the p2sh ScriptPubKey"""
+    return Script([0xa9, h160, 0x87])
+
+
+def p2wpkh_script(h160):
+    """Takes a hash160 and returns the p2wpkh ScriptPubKey"""
+    return Script([0x00, h160])
+
+
+def p2wsh_script(h256):
+    """Takes a sha256 and returns the p2wsh ScriptPubKey"""
+    return Script([0x00, h256])
+
+
+# ScriptPubKey types, see classify_script
+NONSTANDARD, P2PKH, P2SH, P2WPKH, P2WSH, P2PK, NULL_DATA = range(7)
+SCRIPT_TYPE_NAMES = ('nonstandard', 'p2pkh', 'p2sh', 'p2wpkh', 'p2wsh', 'p2pk', 'nulldata')
+
+
+def classify_script(raw):
+    """Matches a raw ScriptPubKey (bytes-like, no length prefix) against
+    the standard templates without parsing it.
+    Returns (script type, payload), the payload is the hash160 for p2pkh,
+    p2sh and p2wpkh, the sha256 for p2wsh, the SEC pubkey for p2pk and
+    None otherwise.
+    """
+    n = len(raw)
+    if n == 25 and raw[0] == 0x76 and raw[1] == 0xa9 and raw[2] == 20 and raw[23] == 0x88 and raw[24] == 0xac:
+        return P2PKH, bytes(raw[3:23])
+    if n == 23 and raw[0] == 0xa9 and raw[1] == 20 and raw[22] == 0x87:
+        return P2SH, bytes(raw[2:22])
+    if n == 22 and raw[0] == 0x00 and raw[1] == 20:
+        return P2WPKH, bytes(raw[2:22])
+    if n == 34 and raw[0] == 0x00 and raw[1] == 32:
+        return P2WSH, bytes(raw[2:34])
+    if (n == 35 and raw[0] == 33 or n == 67 and raw[0] == 65) and raw[n - 1] == 0xac:
+        return P2PK, bytes(raw[1:n - 1])
+    if n and raw[0] == 0x6a:
+        return NULL_DATA, None
+    return NONSTANDARD, None
+
+
+class Commands(list):
+    """A list of script commands that tells its Script when it changes"""
+    __slots__ = ('_script',)
+
+    def __init__(self, script, cmds=()):
+        super().__init__(cmds)
+        self._script = script
+
+    def __reduce__(self):
+        # pickle would append the items before _script is set, build it
+        # in one go instead
+        return Commands, (self._script, list(self))
+
+    def _changed(self):
+        self._script._raw = None
+
+
+def _mutator(name):
+    method = getattr(list, name)
+
+    def wrapper(self, *args, **kwargs):
+        self._changed()
+        return method(self, *args, **kwargs)
+    wrapper.__name__ = name
+    return wrapper
+
+
+for _name in ('__setitem__', '__delitem__', '__iadd__', '__imul__', 'append', 'extend',
+              'insert', 'pop', 'remove', 'clear', 'reverse', 'sort'):
+    setattr(Commands, _name, _mutator(_name))
+
+
 class Script:
+    __slots__ = ('_cmds', '_raw')
+
+    def __init__(self, cmds=None, raw=None):
+        # raw is the serialization (without the length prefix). Without
+        # cmds they are parsed from raw the first time they are needed, so
+        # a parsed script that is never looked at only holds its bytes.
+        if cmds is None and raw is None:
+            cmds = []
+        self._cmds = None if cmds is None else Commands(self, cmds)
+        self._raw = raw
 
-    def __init__(self, cmds=None):
-        if cmds is None:
-            self.cmds = []
-        else:
-            self.cmds = cmds
+    @property
+    def cmds(self):
+        if self._cmds is None:
+            self._cmds = Commands(self, self.parse_cmds(self._raw))
+        return self._cmds
+
+    @cmds.setter
+    def cmds(self, cmds):
+        self._cmds = Commands(self, cmds)
+        self._raw = None
 
     def __repr__(self):
         result = []
@@ -38,123 +168,328 @@ class Script:
                 result.append(cmd.hex())
         return ' '.join(result)
 
+    def __add__(self, other):
+        return Script(self.cmds + other.cmds)
+
     @classmethod
     def parse(cls, s):
+        # we keep the field around as the cached serialization
+        return cls(raw=cls.read_raw(s))
+
+    @staticmethod
+    def read_raw(s):
+        """Reads a length prefixed script and returns it without the prefix"""
         # get the length of the entire field
         length = read_varint(s)
+        # read the whole field at once
+        raw = s.read(length)
+        if len(raw) != length:
+            raise SyntaxError('parsing script failed')
+        return raw
+
+    @staticmethod
+    def parse_cmds(raw):
+        """Splits a raw script (no length prefix) into a list of cmds"""
         # initialize the cmds array
         cmds = []
+        length = len(raw)
         # initialize the number of bytes we've read to 0
         count = 0
         # loop until we've read length bytes
         while count < length:
             # get the current byte
-            current = s.read(1)
+            current_byte = raw[count]
             # increment the bytes we've read
             count += 1
-            # convert the current byte to an integer
-            current_byte = current[0]
             # if the current byte is between 1 and 75 inclusive
             if 1 <= current_byte <= 75:
                 # we have a cmd set n to be the current byte
                 n = current_byte
-                # add the next n bytes as a cmd
-                cmds.append(s.read(n))
-                # increase the count by n
-                count += n
             elif current_byte == 76:
                 # op_pushdata1
-                data_length = little_endian_to_int(s.read(1))
-                cmds.append(s.read(data_length))
-                count += data_length + 1
+                if count >= length:
+                    raise SyntaxError('parsing script failed')
+                n = raw[count]
+                count += 1
             elif current_byte == 77:
                 # op_pushdata2
-                data_length = little_endian_to_int(s.read(2))
-                cmds.append(s.read(data_length))
-                count += data_length + 2
+                n = little_endian_to_int(raw[count:count + 2])
+                count += 2
             else:
-                # we have an opcode. set the current byte to op_code
-                op_code = current_byte
-                # add the op_code to the list of cmds
-                cmds.append(op_code)
+                # we have an opcode, add it to the list of cmds
+                cmds.append(current_byte)
+                continue
+            # add the next n bytes as a cmd
+            cmds.append(raw[count:count + n])
+            count += n
         if count != length:
             raise SyntaxError('parsing script failed')
-        return cls(cmds)
+        return cmds
 
     def raw_serialize(self):
-        # initialize what we'll send back
-        result = b''
+        # the bytes we were parsed from stay valid until cmds is changed
+        if self._raw is not None:
+            return self._raw
+        result = bytearray()
         # go through each cmd
         for cmd in self.cmds:
             # if the cmd is an integer, it's an opcode
             if type(cmd) == int:
-                # turn the cmd into a single byte integer using int_to_little_endian
-                result += int_to_little_endian(cmd, 1)
+                result.append(cmd)
+                continue
+            # otherwise, this is an element
+            # get the length in bytes
+            length = len(cmd)
+            # for large lengths, we have to use a pushdata opcode
+            if length <= 75:
+                result.append(length)
+            elif length < 0x100:
+                # 76 is pushdata1
+                result.append(76)
+                result.append(length)
+            elif length <= 520:
+                # 77 is pushdata2
+                result.append(77)
+                result += int_to_little_endian(length, 2)
             else:
-                # otherwise, this is an element
-                # get the length in bytes
-                length = len(cmd)
-                # for large lengths, we have to use a pushdata opcode
-                if length < 75:
-                    # turn the length into a single byte integer
-                    result += int_to_little_endian(length, 1)
-                elif 75 < length < 0x100:
-                    # 76 is pushdata1
-                    result += int_to_little_endian(76, 1)
-                    result += int_to_little_endian(length, 1)
-                elif 0x100 <= length <= 520:
-                    # 77 is pushdata2
-                    result += int_to_little_endian(77, 1)
-                    result += int_to_little_endian(length, 2)
-                else:
-                    raise ValueError('too long an cmd')
-                result += cmd
-        return result
+                raise ValueError('too long an cmd')
+            result += cmd
+        self._raw = bytes(result)
+        return self._raw
 
     def serialize(self):
         # get the raw serialization (no prepended length)
         result = self.raw_serialize()
-        # get the length of the whole thing
-        total = len(result)
         # encode_varint the total length of the result and prepend
-        return encode_varint(total) + result
+        return encode_varint(len(result)) + result
+
+    def is_p2pkh_script_pubkey(self):
+        """Returns whether this follows the
+        OP_DUP OP_HASH160 <20 byte hash> OP_EQUALVERIFY OP_CHECKSIG pattern."""
+        cmds = self.cmds
+        return len(cmds) == 5 and cmds[0] == 0x76 and cmds[1] == 0xa9 \
+            and type(cmds[2]) == bytes and len(cmds[2]) == 20 \
+            and cmds[3] == 0x88 and cmds[4] == 0xac
+
+    def is_p2sh_script_pubkey(self):
+        """Returns whether this follows the
+        OP_HASH160 <20 byte hash> OP_EQUAL pattern."""
+        cmds = self.cmds
+        return len(cmds) == 3 and cmds[0] == 0xa9 \
+            and type(cmds[1]) == bytes and len(cmds[1]) == 20 \
+            and cmds[2] == 0x87
+
+    def is_p2wpkh_script_pubkey(self):
+        """Returns whether this follows the OP_0 <20 byte hash> pattern."""
+        cmds = self.cmds
+        return len(cmds) == 2 and cmds[0] == 0x00 \
+            and type(cmds[1]) == bytes and len(cmds[1]) == 20
+
+    def is_p2wsh_script_pubkey(self):
+        """Returns whether this follows the OP_0 <32 byte hash> pattern."""
+        cmds = self.cmds
+        return len(cmds) == 2 and cmds[0] == 0x00 \
+            and type(cmds[1]) == bytes and len(cmds[1]) == 32
+
+    def evaluate(self, z, witness=None, batch=None, tracer=None, limits=None):
+        """Runs the script against the signature hash z.
+        P2SH redeem scripts are run when the script ends in a p2sh
+        ScriptPubKey, and the witness is run for p2wpkh and p2wsh programs.
+        With a SignatureBatch the signature checks that have to pass for
+        the script to pass are only collected, the caller has to verify the
+        batch before trusting a True result.
+        A ScriptTracer, if given, is told about every command that runs.
+        Raises ScriptLimitError as soon as the script goes over limits,
+        which defaults to DEFAULT_LIMITS.
+        """
+        if limits is None:
+            limits = DEFAULT_LIMITS
+        if tracer is None:
+            return self._run(z, witness, batch, None, limits)
+        tracer.begin(self)
+        try:
+            result = self._run(z, witness, batch, tracer, limits)
+        except ScriptLimitError:
+            tracer.end(False)
+            raise
+        tracer.end(result)
+        return result
 
-    def evaluate(self, z):
+    def _run(self, z, witness, batch, tracer, limits):
+        max_ops = limits.max_ops
+        max_stack = limits.max_stack
+        max_element_size = limits.max_element_size
+        max_sigops = limits.max_sigops
+        ops = 0
+        sigops = 0
         # create a copy as we may need to add to this list if we have a
         # RedeemScript
         cmds = self.cmds[:]
         stack = []
         altstack = []
+        # BIP16 only applies to a ScriptPubKey after a push only ScriptSig,
+        # so the p2sh pattern is looked for until anything else runs
+        p2sh = True
         while len(cmds) > 0:
             cmd = cmds.pop(0)
             if type(cmd) == int:
+                # pushing small numbers is free, like in consensus
+                if cmd > 96:
+                    p2sh = False
+                    ops += 1
+                    if ops > max_ops:
+                        raise ScriptLimitError('ops', max_ops)
+                    if cmd in (172, 173):
+                        sigops += 1
+                    elif cmd in (174, 175):
+                        # every pubkey may need a signature check
+                        sigops += decode_num(stack[-1]) if stack else 20
+                    if sigops > max_sigops:
+                        raise ScriptLimitError('sigops', max_sigops)
+                if tracer is not None:
+                    hashed = len(stack[-1]) if cmd in HASH_OPS and stack else 0
+                    start = perf_counter()
                 # do what the opcode says
-                operation = OP_CODE_FUNCTIONS[cmd]
+                operation = OP_CODE_FUNCTIONS.get(cmd)
+                if operation is None:
+                    LOGGER.info('unknown op: {}'.format(cmd))
+                    return False
                 if cmd in (99, 100):
                     # op_if/op_notif require the cmds array
-                    if not operation(stack, cmds):
-                        LOGGER.info('bad op: {}'.format(OP_CODE_NAMES[cmd]))
-                        return False
+                    ok = operation(stack, cmds)
                 elif cmd in (107, 108):
                     # op_toaltstack/op_fromaltstack require the altstack
-                    if not operation(stack, altstack):
-                        LOGGER.info('bad op: {}'.format(OP_CODE_NAMES[cmd]))
-                        return False
+                    ok = operation(stack, altstack)
                 elif cmd in (172, 173, 174, 175):
                     # these are signing operations, they need a sig_hash
-                    # to check against
-                    if not operation(stack, z):
-                        LOGGER.info('bad op: {}'.format(OP_CODE_NAMES[cmd]))
-                        return False
+                    # to check against. A check is only deferred when its
+                    # failure fails the script, which is the VERIFY forms
+                    # and the last cmd, so e.g. OP_CHECKSIG OP_NOT gives the
+                    # same result with and without a batch
+                    deferred = cmd in (173, 175) or not cmds
+                    ok = operation(stack, z, batch if deferred else None)
                 else:
-                    if not operation(stack):
-                        LOGGER.info('bad op: {}'.format(OP_CODE_NAMES[cmd]))
-                        return False
+                    ok = operation(stack)
+                if tracer is not None:
+                    tracer.op(cmd, perf_counter() - start, len(stack) + len(altstack), hashed, ok)
+                if not ok:
+                    LOGGER.info('bad op: {}'.format(OP_CODE_NAMES[cmd]))
+                    return False
             else:
+                if len(cmd) > max_element_size:
+                    raise ScriptLimitError('element', max_element_size)
                 # add the cmd to the stack
                 stack.append(cmd)
+                if tracer is not None:
+                    tracer.push(len(stack) + len(altstack))
+                if p2sh and len(cmds) == 3 and cmds[0] == 0xa9 \
+                        and type(cmds[1]) == bytes and len(cmds[1]) == 20 \
+                        and cmds[2] == 0x87:
+                    # p2sh, the element we just pushed is the RedeemScript
+                    # and has to hash to the 20 bytes
+                    h160 = cmds[1]
+                    del cmds[:]
+                    p2sh = False
+                    if hash160(stack.pop()) != h160:
+                        LOGGER.info('bad p2sh h160')
+                        return False
+                    cmds.extend(Script.parse_cmds(cmd))
+                if witness is not None and len(stack) == 2 and stack[0] == b'' \
+                        and len(stack[1]) in (20, 32):
+                    # the witness program, it is only run once
+                    p2sh = False
+                    program = stack.pop()
+                    stack.pop()
+                    if len(program) == 20:
+                        # p2wpkh, the witness is the signature and pubkey
+                        if len(witness) != 2:
+                            LOGGER.info('bad p2wpkh witness')
+                            return False
+                        cmds.extend(witness)
+                        cmds.extend(p2pkh_script(program).cmds)
+                    else:
+                        # p2wsh, the last witness item is the WitnessScript
+                        if not witness:
+                            LOGGER.info('empty p2wsh witness')
+                            return False
+                        witness_script = witness[-1]
+                        if hashlib.sha256(witness_script).digest() != program:
+                            LOGGER.info('bad p2wsh sha256')
+                            return False
+                        cmds.extend(witness[:-1])
+                        cmds.extend(Script.parse_cmds(witness_script))
+                    witness = None
+            if len(stack) + len(altstack) > max_stack:
+                raise ScriptLimitError('stack', max_stack)
         if len(stack) == 0:
             return False
         if stack.pop() == b'':
             return False
         return True
+
+
+class ScriptTracer:
+    """Collects per-opcode statistics over any number of Script.evaluate
+    calls. One tracer should only be used from one thread at a time, use
+    merge to combine the counters of several tracers.
+    """
+
+    def __init__(self):
+        self.evaluations = 0
+        self.failures = 0
+        self.pushes = 0
+        self.max_stack_depth = 0
+        self.bytes_hashed = 0
+        # op code -> [times run, seconds spent, times failed]
+        self.ops = {}
+
+    def begin(self, script):
+        self.evaluations += 1
+
+    def end(self, result):
+        if not result:
+            self.failures += 1
+
+    def push(self, depth):
+        self.pushes += 1
+        if depth > self.max_stack_depth:
+            self.max_stack_depth = depth
+
+    def op(self, cmd, seconds, depth, hashed, ok):
+        stats = self.ops.get(cmd)
+        if stats is None:
+            stats = self.ops[cmd] = [0, 0.0, 0]
+        stats[0] += 1
+        stats[1] += seconds
+        if not ok:
+            stats[2] += 1
+        if depth > self.max_stack_depth:
+            self.max_stack_depth = depth
+        self.bytes_hashed += hashed
+
+    def merge(self, other):
+        self.evaluations += other.evaluations
+        self.failures += other.failures
+        self.pushes += other.pushes
+        self.max_stack_depth = max(self.max_stack_depth, other.max_stack_depth)
+        self.bytes_hashed += other.bytes_hashed
+        for cmd, (count, seconds, failed) in other.ops.items():
+            stats = self.ops.setdefault(cmd, [0, 0.0, 0])
+            stats[0] += count
+            stats[1] += seconds
+            stats[2] += failed
+
+    def report(self):
+        """Returns the counters as a dict of plain values, slowest op first"""
+        ops = {}
+        for cmd, (count, seconds, failed) in sorted(self.ops.items(), key=lambda item: -item[1][1]):
+            name = OP_CODE_NAMES.get(cmd, 'OP_[{}]'.format(cmd))
+            ops[name] = {'count': count, 'seconds': seconds, 'failures': failed}
+        return {
+            'evaluations': self.evaluations,
+            'failures': self.failures,
+            'pushes': self.pushes,
+            'max_stack_depth': self.max_stack_depth,
+            'bytes_hashed': self.bytes_hashed,
+            'ops': ops,
+        }
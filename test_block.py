@@ -0,0 +1,103 @@
+import json
+import os
+import tempfile
+from io import BytesIO
+from unittest import TestCase
+
+from block import Block, BlockFile, BlockHeader, MAINNET_MAGIC, TESTNET_MAGIC, write_blocks
+from tx import Tx
+
+GENESIS_HEADER = bytes.fromhex(
+    '0100000000000000000000000000000000000000000000000000000000000000000000003ba3ed'
+    'fd7a7b12b27ac72c3e67768f617fc81bc3888a51323a9fb8aa4b1e5e4a29ab5f49ffff001d1dac2b7c')
+
+
+class BlockTest(TestCase):
+    cache_file = 'tx.cache'
+
+    def setUp(self):
+        with open(self.cache_file) as f:
+            self.raws = [bytes.fromhex(raw_hex) for raw_hex in json.load(f).values()]
+
+    def blocks(self):
+        """Two blocks made out of the cached transactions, the second one on
+        top of the first
+        """
+        first = BlockHeader.parse(BytesIO(GENESIS_HEADER))
+        second = BlockHeader(2, first.hash(), b'\x11' * 32, first.timestamp + 600, first.bits, b'\x00' * 4)
+        blocks = [
+            Block(first, [Tx.parse(BytesIO(raw)) for raw in self.raws[:5]]),
+            Block(second, [Tx.parse(BytesIO(raw)) for raw in self.raws[5:]]),
+        ]
+        for block in blocks:
+            block.header.merkle_root = block.merkle_root()
+        return blocks
+
+    def test_header(self):
+        header = BlockHeader.parse(BytesIO(GENESIS_HEADER))
+        self.assertEqual(header.id(), '000000000019d6689c085ae165831e934ff763ae46a2a6c172b3f1b60a8ce26f')
+        self.assertEqual(header.merkle_root.hex(), '4a5e1e4baab89f3a32518a88c31bc87f618f76673e2cc77ab2127b7afdeda33b')
+        self.assertEqual(header.serialize(), GENESIS_HEADER)
+        self.assertEqual(header.difficulty(), 1)
+        self.assertTrue(header.check_pow())
+        header.nonce = b'\x00' * 4
+        self.assertFalse(header.check_pow())
+
+    def test_parse(self):
+        block = self.blocks()[0]
+        raw = block.serialize()
+        parsed = Block.parse(BytesIO(raw))
+        self.assertEqual(parsed.id(), block.id())
+        self.assertEqual([tx.id() for tx in parsed.txs], [tx.id() for tx in block.txs])
+        self.assertEqual(parsed.serialize(), raw)
+        self.assertEqual([view.id() for view in Block.tx_views(raw)], [tx.id() for tx in block.txs])
+        self.assertTrue(parsed.check_merkle_root())
+        parsed.txs.pop()
+        self.assertFalse(parsed.check_merkle_root())
+
+    def test_block_file(self):
+        blocks = self.blocks()
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, 'blk00000.dat')
+            write_blocks(filename, blocks)
+            # preallocated space at the end
+            with open(filename, 'ab') as f:
+                f.write(bytes(1000))
+            with BlockFile(filename) as block_file:
+                self.assertEqual([block.id() for block in block_file], [block.id() for block in blocks])
+                self.assertEqual([header.id() for header in block_file.headers()], [block.id() for block in blocks])
+                tx_ids = []
+                for _, raw in block_file.raw_blocks():
+                    tx_ids += [view.id() for view in Block.tx_views(raw)]
+                self.assertEqual(len(tx_ids), len(self.raws))
+            with BlockFile(filename, magic=TESTNET_MAGIC) as block_file:
+                with self.assertRaises(SyntaxError):
+                    next(iter(block_file))
+            with open(filename, 'r+b') as f:
+                f.truncate(len(MAINNET_MAGIC) + 4 + len(blocks[0].serialize()) + 100)
+            with BlockFile(filename) as block_file:
+                blocks_read = block_file.raw_blocks()
+                next(blocks_read)
+                with self.assertRaises(SyntaxError):
+                    next(blocks_read)
+
+    def test_block_file_close(self):
+        blocks = self.blocks()
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, 'blk00000.dat')
+            write_blocks(filename, blocks)
+            # closed while iterating
+            block_file = BlockFile(filename)
+            it = iter(block_file)
+            next(it)
+            block_file.close()
+            self.assertEqual(list(it), [])
+            with BlockFile(filename) as block_file:
+                raw_blocks = block_file.raw_blocks()
+                _, raw = next(raw_blocks)
+                header = raw[:80]
+            # the view is released, the slice taken of it still reads
+            with self.assertRaises(ValueError):
+                raw[0]
+            self.assertEqual(bytes(header), blocks[0].header.serialize())
+            header.release()
@@ -0,0 +1,83 @@
+from unittest import TestCase
+
+from block import Block, BlockHeader
+from blockfilter import FilterHeaderChain, GCSFilter, block_filter, block_key, block_scripts, siphash
+from script import Script, p2pkh_script
+from tx import Tx, TxIn, TxOut
+from utxo import UtxoSet
+
+# the testnet genesis block, the first BIP158 test vector
+TESTNET_GENESIS = bytes.fromhex(
+    '0100000000000000000000000000000000000000000000000000000000000000000000003ba3ed'
+    'fd7a7b12b27ac72c3e67768f617fc81bc3888a51323a9fb8aa4b1e5e4adae5494dffff001d1aa4ae18'
+    '0101000000010000000000000000000000000000000000000000000000000000000000000000ffff'
+    'ffff4d04ffff001d0104455468652054696d65732030332f4a616e2f32303039204368616e63656c'
+    '6c6f72206f6e206272696e6b206f66207365636f6e64206261696c6f757420666f722062616e6b73'
+    'ffffffff0100f2052a01000000434104678afdb0fe5548271967f1a67130b7105cd6a828e03909a6'
+    '7962e0ea1f61deb649f6bc3f4cef38c4f35504e51ec112de5c384df7ba0b8d578a4c702b6bf11d5f'
+    'ac00000000')
+
+
+def script(i):
+    return p2pkh_script(i.to_bytes(20, 'big')).raw_serialize()
+
+
+class BlockFilterTest(TestCase):
+
+    def test_siphash(self):
+        key = bytes(range(16))
+        self.assertEqual(siphash(key, b''), 0x726fdb47dd0e0e31)
+        self.assertEqual(siphash(key, bytes(range(15))), 0xa129ca6149be45e5)
+
+    def test_genesis(self):
+        gcs_filter = block_filter(TESTNET_GENESIS)
+        self.assertEqual(gcs_filter.serialize().hex(), '019dfca8')
+        chain = FilterHeaderChain()
+        header = chain.add(gcs_filter)
+        self.assertEqual(header.hex(), '21584579b7eb08997773e5aeff3a7f932700042d0ed2a6129012b7d7ae81b750')
+        self.assertEqual(chain.tip(), header)
+        self.assertTrue(chain.check(0, gcs_filter))
+        self.assertFalse(chain.check(0, GCSFilter.build(gcs_filter.key, [b'\x51'])))
+
+    def test_match(self):
+        key = bytes(16)
+        items = [script(i) for i in range(1000)]
+        gcs_filter = GCSFilter.build(key, items)
+        parsed = GCSFilter.parse(gcs_filter.serialize(), key)
+        self.assertEqual(len(parsed), 1000)
+        values = list(parsed.values())
+        self.assertEqual(values, sorted(values))
+        for item in items[::50]:
+            self.assertTrue(parsed.match(item))
+        others = [script(i) for i in range(1000, 1500)]
+        # a false positive is about 1 in 784931
+        self.assertFalse(parsed.match_any(others))
+        self.assertTrue(parsed.match_any(others + [items[500]]))
+        self.assertFalse(parsed.match_any([]))
+        empty = GCSFilter.build(key, [])
+        self.assertEqual(empty.serialize(), b'\x00')
+        self.assertFalse(empty.match(items[0]))
+        with self.assertRaises(SyntaxError):
+            list(GCSFilter(2, gcs_filter.data[:2], key).values())
+
+    def test_block_scripts(self):
+        funding = Tx(1, [TxIn(b'\x01' * 32, 0)], [TxOut(1000, p2pkh_script(bytes(20)))], 0)
+        utxo_set = UtxoSet()
+        utxo_set.add(funding)
+        coinbase = Tx(1, [TxIn(b'\x00' * 32, 0xffffffff, Script([b'\x00' * 4]))],
+                      [TxOut(5000, Script([0x6a, b'commitment'])), TxOut(5000, p2pkh_script(b'\x02' * 20))], 0)
+        spend = Tx(1, [TxIn(funding.hash(), 0)], [TxOut(900, p2pkh_script(b'\x03' * 20))], 0)
+        # spends an output made earlier in the same block
+        chained = Tx(1, [TxIn(spend.hash(), 0)], [TxOut(800, p2pkh_script(b'\x04' * 20))], 0)
+        header = BlockHeader(1, b'\x00' * 32, b'\x00' * 32, 1500000000, bytes.fromhex('ffff7f20'), b'\x00' * 4)
+        block = Block(header, [coinbase, spend, chained])
+        header.merkle_root = block.merkle_root()
+        raw = block.serialize()
+        self.assertEqual(block_scripts(raw, utxo_set), {
+            p2pkh_script(h160).raw_serialize() for h160 in (bytes(20), b'\x02' * 20, b'\x03' * 20, b'\x04' * 20)
+        })
+        gcs_filter = block_filter(block, utxo_set)
+        self.assertEqual(gcs_filter.key, block_key(raw))
+        self.assertTrue(gcs_filter.match(p2pkh_script(bytes(20)).raw_serialize()))
+        with self.assertRaises(ValueError):
+            block_scripts(raw)
@@ -0,0 +1,97 @@
+from io import BytesIO
+from unittest import TestCase
+
+from block import BlockHeader
+from chain import GENESIS_HEADER, HeaderChain
+
+# regtest difficulty, about every other nonce works
+EASY_BITS = bytes.fromhex('ffff7f20')
+
+
+def mine(prev_block, count, timestamp=1500000000, version=1):
+    """Returns count serialized headers on top of prev_block"""
+    result = []
+    for i in range(count):
+        header = BlockHeader(version, prev_block, b'\x00' * 32, timestamp + i, EASY_BITS, b'\x00' * 4)
+        nonce = 0
+        while not header.check_pow():
+            nonce += 1
+            header.nonce = nonce.to_bytes(4, 'little')
+        result.append(header.serialize())
+        prev_block = header.hash()
+    return result
+
+
+class HeaderChainTest(TestCase):
+
+    def setUp(self):
+        self.genesis = mine(b'\x00' * 32, 1, timestamp=1400000000)[0]
+        self.chain = HeaderChain(self.genesis, pow_limit=2 ** 256)
+        self.genesis_hash = BlockHeader.parse(BytesIO(self.genesis)).hash()
+
+    def test_mainnet_genesis(self):
+        chain = HeaderChain()
+        self.assertEqual(chain.height(), 0)
+        self.assertEqual(chain.tip().hex(), '000000000019d6689c085ae165831e934ff763ae46a2a6c172b3f1b60a8ce26f')
+        self.assertEqual(chain.raw_header(0), GENESIS_HEADER)
+        # regtest headers are too easy for mainnet
+        with self.assertRaises(ValueError):
+            chain.add_headers(b''.join(mine(chain.tip(), 1)))
+
+    def test_add_headers(self):
+        headers = mine(self.genesis_hash, 10)
+        self.assertEqual(self.chain.add_headers(b''.join(headers[:4])), 4)
+        # known headers are skipped
+        self.assertEqual(self.chain.add_headers(b''.join(headers)), 6)
+        self.assertEqual(self.chain.height(), 10)
+        self.assertEqual(len(self.chain), 11)
+        for height, raw in enumerate(headers, 1):
+            block_hash = BlockHeader.parse(BytesIO(raw)).hash()
+            self.assertEqual(self.chain.block_hash(height), block_hash)
+            self.assertEqual(self.chain.height_of(block_hash), height)
+            self.assertEqual(self.chain.raw_header(height), raw)
+            self.assertIn(block_hash, self.chain)
+        self.assertEqual(self.chain.header(10).serialize(), headers[-1])
+        self.assertEqual(self.chain.tip(), self.chain.block_hash(10))
+        self.assertIsNone(self.chain.height_of(b'\x00' * 32))
+
+    def test_invalid(self):
+        headers = mine(self.genesis_hash, 3)
+        with self.assertRaises(ValueError):
+            self.chain.add_headers(headers[0][:79])
+        # the second header is missing
+        with self.assertRaises(ValueError):
+            self.chain.add_headers(headers[0] + headers[2])
+        # nothing of a bad batch is added
+        self.assertEqual(self.chain.height(), 0)
+        self.assertEqual(len(self.chain.hashes), 1)
+        # find a nonce that does not work
+        header = BlockHeader.parse(BytesIO(headers[0]))
+        nonce = 0
+        while header.check_pow():
+            nonce += 1
+            header.nonce = nonce.to_bytes(4, 'little')
+        with self.assertRaises(ValueError):
+            self.chain.add_headers(header.serialize())
+
+    def test_reorg(self):
+        main = mine(self.genesis_hash, 5)
+        self.chain.add_headers(b''.join(main))
+        fork_point = BlockHeader.parse(BytesIO(main[1])).hash()
+        # a shorter fork does not change the best chain
+        fork = mine(fork_point, 2, timestamp=1600000000)
+        self.chain.add_headers(b''.join(fork))
+        self.assertEqual(self.chain.height(), 5)
+        self.assertEqual(self.chain.reorgs, 0)
+        fork_hash = BlockHeader.parse(BytesIO(fork[0])).hash()
+        self.assertNotIn(fork_hash, self.chain)
+        # extending it past the best chain does
+        longer = mine(BlockHeader.parse(BytesIO(fork[-1])).hash(), 2, timestamp=1600000100)
+        self.chain.add_headers(b''.join(longer))
+        self.assertEqual(self.chain.reorgs, 1)
+        self.assertEqual(self.chain.height(), 6)
+        self.assertEqual(self.chain.height_of(fork_hash), 3)
+        self.assertIsNone(self.chain.height_of(BlockHeader.parse(BytesIO(main[2])).hash()))
+        self.assertEqual(self.chain.block_hash(2), fork_point)
+        self.assertEqual(self.chain.raw_header(6), longer[-1])
+        self.assertEqual(self.chain.total_work(), self.chain.work[self.chain.active[-1]])
@@ -0,0 +1,60 @@
+import json
+import tempfile
+from io import BytesIO
+from unittest import TestCase, skipIf
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from script import P2PKH, classify_script
+from tx import Tx, TxView
+
+if numpy is not None:
+    from columnar import load_outputs, output_columns, output_table, save_outputs
+
+
+@skipIf(numpy is None, 'numpy is not installed')
+class ColumnarTest(TestCase):
+    cache_file = 'tx.cache'
+
+    def setUp(self):
+        with open(self.cache_file) as f:
+            self.raws = [bytes.fromhex(raw_hex) for raw_hex in json.load(f).values()]
+        self.txs = [Tx.parse(BytesIO(raw)) for raw in self.raws]
+
+    def test_output_columns(self):
+        # any mix of Tx objects, views and bytes
+        inputs = self.txs[:5] + [TxView(raw) for raw in self.raws[5:10]] + self.raws[10:]
+        columns = output_columns(inputs)
+        rows = [(tx, vout, tx_out) for tx in self.txs for vout, tx_out in enumerate(tx.tx_outs)]
+        self.assertEqual(len(columns['amount']), len(rows))
+        for row, (tx, vout, tx_out) in enumerate(rows):
+            self.assertEqual(columns['txid'][row].tobytes(), tx.hash())
+            self.assertEqual(columns['vout'][row], vout)
+            self.assertEqual(columns['amount'][row], tx_out.amount)
+            script_type, payload = classify_script(tx_out.script_pubkey.raw_serialize())
+            self.assertEqual(columns['script_type'][row], script_type)
+            if script_type == P2PKH:
+                self.assertEqual(columns['hash160'][row].tobytes(), tx_out.script_pubkey.cmds[2])
+        # vectorized totals per script type
+        totals = numpy.bincount(columns['script_type'], weights=columns['amount'])
+        self.assertEqual(totals.sum(), sum(tx_out.amount for _, _, tx_out in rows))
+
+    def test_output_table(self):
+        table = output_table(self.txs)
+        columns = output_columns(self.txs)
+        self.assertEqual(table.dtype.names, ('txid', 'vout', 'amount', 'script_type', 'hash160'))
+        for name, column in columns.items():
+            self.assertTrue((table[name] == column).all())
+        self.assertEqual(len(output_table([])), 0)
+
+    def test_save_outputs(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            rows = save_outputs(tmp, self.raws)
+            columns = load_outputs(tmp)
+            self.assertEqual(len(columns['vout']), rows)
+            for name, column in output_columns(self.raws).items():
+                self.assertTrue((columns[name] == column).all())
+            del columns
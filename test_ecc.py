@@ -90,6 +90,11 @@ class SignatureTest(TestCase):
             self.assertEqual(sig2.r, r)
             self.assertEqual(sig2.s, s)
 
+    def test_parse_invalid(self):
+        for der in ('', '3000', '300602010102', '3006020101020100ff', '3006020001020101', '3006020501020101'):
+            with self.assertRaises(SyntaxError):
+                Signature.parse(bytes.fromhex(der))
+
 
 class S256Test(TestCase):
     def test_order(self):
@@ -124,6 +129,19 @@ class S256Test(TestCase):
         r = 0xeff69ef2b1bd93a66ed5219add4fb51e11a840f404876325a1e8ffe0529a2c
         s = 0xc7207fee197d27c618aea621406f6bf5ef6fca38681d82b2f06fddbdce6feab6
         self.assertTrue(point.verify(z, Signature(r, s)))
+        # out of range r or s never verify
+        self.assertFalse(point.verify(z, Signature(r, 0)))
+        self.assertFalse(point.verify(z, Signature(r, s + N)))
+        self.assertFalse(point.verify(z, Signature(0, s)))
+
+    def test_parse_invalid(self):
+        sec = G.sec()
+        for bad in (b'', sec[:1], sec[:-1], b'\x05' + sec[1:], G.sec(compressed=False)[:-1]):
+            with self.assertRaises(SyntaxError):
+                S256Point.parse(bad)
+        # an x with no point on the curve
+        with self.assertRaises(ValueError):
+            S256Point.parse(b'\x02' + (5).to_bytes(32, 'big'))
 
     def test_sec(self):
         coefficient = 999 ** 3
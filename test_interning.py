@@ -0,0 +1,62 @@
+import json
+from io import BytesIO
+from unittest import TestCase
+
+from ecc import G, PrivateKey, S256Point
+from interning import InternPool
+from tx import Tx, TxOut
+
+
+class InternPoolTest(TestCase):
+    cache_file = 'tx.cache'
+
+    def setUp(self):
+        self.pool = InternPool()
+        self.pool.install()
+
+    def tearDown(self):
+        self.pool.uninstall()
+
+    def test_scripts(self):
+        with open(self.cache_file) as f:
+            raws = [bytes.fromhex(raw_hex) for raw_hex in json.load(f).values()]
+        first = [Tx.parse(BytesIO(raw)) for raw in raws]
+        second = [Tx.parse(BytesIO(raw)) for raw in raws]
+        for tx1, tx2 in zip(first, second):
+            self.assertEqual(tx1.serialize(), tx2.serialize())
+            for out1, out2 in zip(tx1.tx_outs, tx2.tx_outs):
+                self.assertIs(out1.script_pubkey, out2.script_pubkey)
+        stats = self.pool.stats['script']
+        self.assertEqual(stats['requests'], 2 * sum(len(tx.tx_outs) for tx in first))
+        self.assertGreaterEqual(self.pool.dedup_ratio(), 0.5)
+        self.assertEqual(self.pool.report()['script']['entries'], stats['requests'] - stats['hits'])
+        self.pool.uninstall()
+        self.assertIsNone(TxOut.intern_pool)
+        third = Tx.parse(BytesIO(raws[0]))
+        self.assertIsNot(third.tx_outs[0].script_pubkey, first[0].tx_outs[0].script_pubkey)
+
+    def test_points(self):
+        sec = PrivateKey(12345).point.sec()
+        point = S256Point.parse(sec)
+        self.assertIs(S256Point.parse(sec), point)
+        self.assertEqual(point, S256Point.from_sec(sec))
+        # the two SEC formats are different keys for the same point
+        compressed = self.pool.point(G.sec())
+        uncompressed = self.pool.point(G.sec(compressed=False))
+        self.assertIsNot(compressed, uncompressed)
+        self.assertEqual(compressed, uncompressed)
+        self.assertEqual(self.pool.stats['point'], {'requests': 4, 'hits': 1, 'bytes_saved': 33})
+
+    def test_bounded(self):
+        pool = InternPool(max_entries=2)
+        a, b, c = (bytes([i]) * 20 for i in range(3))
+        shared = pool.intern_bytes(a)
+        self.assertIs(pool.intern_bytes(bytearray(a)), shared)
+        pool.intern_bytes(b)
+        # a was used last, b goes
+        pool.intern_bytes(a)
+        pool.intern_bytes(c)
+        self.assertEqual(pool.evictions, 1)
+        self.assertIs(pool.intern_bytes(a), shared)
+        self.assertEqual(len(pool), 2)
+        self.assertEqual(pool.stats['bytes']['bytes_saved'], 60)
@@ -0,0 +1,125 @@
+from unittest import TestCase
+
+from mempool import Mempool, vsize
+from script import p2pkh_script
+from tx import Tx, TxIn, TxOut
+from utxo import UtxoSet
+
+SCRIPT = p2pkh_script(b'\x00' * 20)
+
+
+def make_tx(inputs, amounts):
+    """inputs are (prev tx hash, index), amounts are of the outputs"""
+    tx_ins = [TxIn(prev_tx, prev_index) for prev_tx, prev_index in inputs]
+    return Tx(1, tx_ins, [TxOut(amount, SCRIPT) for amount in amounts], 0)
+
+
+class MempoolTest(TestCase):
+
+    def setUp(self):
+        # ten confirmed outputs of 100000 satoshi
+        self.funding = make_tx([(b'\xff' * 32, 0)], [100000] * 10)
+        self.utxo_set = UtxoSet()
+        self.utxo_set.add(self.funding)
+        self.pool = Mempool(utxo_set=self.utxo_set)
+
+    def spend(self, index, fee, outputs=1):
+        """Spends a confirmed output paying fee"""
+        amount = (100000 - fee) // outputs
+        return make_tx([(self.funding.hash(), index)], [amount] * outputs)
+
+    def test_packages(self):
+        parent = self.spend(0, 1000, outputs=2)
+        self.pool.add(parent)
+        child = make_tx([(parent.hash(), 0)], [parent.tx_outs[0].amount - 5000])
+        self.pool.add(child)
+        grandchild = make_tx([(child.hash(), 0), (parent.hash(), 1)],
+                             [child.tx_outs[0].amount + parent.tx_outs[1].amount - 3000])
+        self.pool.add(grandchild)
+        entries = self.pool.entries
+        self.assertEqual(entries[parent.hash()].children, {child.hash(), grandchild.hash()})
+        self.assertEqual(entries[grandchild.hash()].parents, {child.hash(), parent.hash()})
+        self.assertEqual(entries[parent.hash()].descendant_fee, 9000)
+        self.assertEqual(entries[parent.hash()].descendant_count, 3)
+        self.assertEqual(entries[child.hash()].descendant_fee, 8000)
+        self.assertEqual(entries[grandchild.hash()].ancestor_fee, 9000)
+        self.assertEqual(entries[grandchild.hash()].ancestor_size,
+                         vsize(parent) + vsize(child) + vsize(grandchild))
+        self.assertEqual(self.pool.ancestors(grandchild.hash()), {parent.hash(), child.hash()})
+        # confirming the parent takes it out of the children's totals
+        self.pool.remove_for_block([parent])
+        self.assertNotIn(parent.hash(), self.pool)
+        self.assertEqual(entries[grandchild.hash()].ancestor_fee, 8000)
+        self.assertEqual(entries[grandchild.hash()].ancestor_count, 2)
+        self.assertEqual(entries[child.hash()].parents, set())
+        # removing the child takes the grandchild with it
+        self.assertEqual(self.pool.remove(child.hash()), {child.hash(), grandchild.hash()})
+        self.assertEqual(len(self.pool), 0)
+        self.assertEqual(self.pool.total_size, 0)
+        self.assertEqual(self.pool.spent, {})
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            self.pool.add(make_tx([(b'\xee' * 32, 0)], [1000]))
+        with self.assertRaises(ValueError):
+            self.pool.add(self.spend(0, -1))
+        # below 1 satoshi per vbyte
+        with self.assertRaises(ValueError):
+            self.pool.add(self.spend(0, 10))
+        tx = self.spend(0, 1000)
+        self.pool.add(tx)
+        with self.assertRaises(ValueError):
+            self.pool.add(tx)
+
+    def test_block_template(self):
+        # a parent paying little with a child paying a lot beats a
+        # transaction paying a medium fee rate
+        parent = self.spend(0, 200)
+        child = make_tx([(parent.hash(), 0)], [parent.tx_outs[0].amount - 20000])
+        medium = self.spend(1, 5000)
+        low = self.spend(2, 300)
+        for tx in (parent, child, medium, low):
+            self.pool.add(tx)
+        self.assertEqual(self.pool.best().txid, child.hash())
+        template = self.pool.block_template()
+        self.assertEqual([tx.hash() for tx in template], [parent.hash(), child.hash(), medium.hash(), low.hash()])
+        # room for one package of two only
+        size = vsize(parent) + vsize(child)
+        template = self.pool.block_template(max_size=size)
+        self.assertEqual([tx.hash() for tx in template], [parent.hash(), child.hash()])
+        # room for one transaction, the child cannot go without its parent
+        template = self.pool.block_template(max_size=vsize(medium))
+        self.assertEqual([tx.hash() for tx in template], [medium.hash()])
+
+    def test_replace(self):
+        original = self.spend(0, 1000)
+        self.pool.add(original)
+        child = make_tx([(original.hash(), 0)], [original.tx_outs[0].amount - 1000])
+        self.pool.add(child)
+        self.assertEqual(self.pool.conflicts(self.spend(0, 5000)), {original.hash()})
+        # pays less than what it replaces
+        with self.assertRaises(ValueError):
+            self.pool.add(self.spend(0, 1500))
+        replacement = self.spend(0, 5000)
+        self.assertEqual(self.pool.add(replacement), {original.hash(), child.hash()})
+        self.assertEqual(set(self.pool.entries), {replacement.hash()})
+        self.assertEqual(self.pool.spent[(self.funding.hash(), 0)], replacement.hash())
+        # a block with a conflicting spend removes it
+        confirmed = self.spend(0, 100)
+        self.assertEqual(self.pool.remove_for_block([confirmed]), {replacement.hash()})
+        self.assertEqual(len(self.pool), 0)
+
+    def test_trim(self):
+        txs = [self.spend(i, 1000 * (i + 1)) for i in range(5)]
+        for tx in txs:
+            self.pool.add(tx)
+        size = vsize(txs[0])
+        evicted = self.pool.trim(3 * size)
+        self.assertEqual(evicted, {txs[0].hash(), txs[1].hash()})
+        self.assertGreater(self.pool.min_fee_rate, 2000 / size)
+        with self.assertRaises(ValueError):
+            self.pool.add(txs[1])
+        pool = Mempool(utxo_set=self.utxo_set, max_size=2 * size)
+        for tx in txs:
+            pool.add(tx)
+        self.assertEqual(set(pool.entries), {txs[3].hash(), txs[4].hash()})
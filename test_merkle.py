@@ -0,0 +1,68 @@
+from unittest import TestCase
+
+from helper import hash256
+from merkle import IncrementalMerkleTree, MerkleTree, merkle_parent, merkle_root, verify_merkle_proof
+
+
+def naive_merkle_root(hashes):
+    while len(hashes) > 1:
+        if len(hashes) % 2 == 1:
+            hashes = hashes + [hashes[-1]]
+        hashes = [hash256(hashes[i] + hashes[i + 1]) for i in range(0, len(hashes), 2)]
+    return hashes[0]
+
+
+class MerkleTest(TestCase):
+
+    def test_merkle_parent(self):
+        tx_hash0 = bytes.fromhex('c117ea8ec828342f4dfb0ad6bd140e03a50720ece40169ee38bdc15d9eb64cf5')
+        tx_hash1 = bytes.fromhex('c131474164b412e3406696da1ee20ab0fc9bf41c8f05fa8ceea7a08d672d7cc5')
+        want = bytes.fromhex('8b30c5ba100f6f2e5ad1e2a742e5020491240f8eb514fe97c713c31718ad7ecd')
+        self.assertEqual(merkle_parent(tx_hash0, tx_hash1), want)
+
+    def test_merkle_root(self):
+        hex_hashes = [
+            'c117ea8ec828342f4dfb0ad6bd140e03a50720ece40169ee38bdc15d9eb64cf5',
+            'c131474164b412e3406696da1ee20ab0fc9bf41c8f05fa8ceea7a08d672d7cc5',
+            'f391da6ecfeed1814efae39e7fcb3838ae0b02c02ae7d0a5848a66947c0727b0',
+            '3d238a92a94532b946c90e19c49351c763696cff3db400485b813aecb8a13181',
+            '10092f2633be5f3ce349bf9ddbde36caa3dd10dfa0ec8106bce23acbff637dae',
+            '7d37b3d54fa6a64869084bfd2e831309118b9e833610e6228adacdbd1b4ba161',
+            '8118a77e542892fe15ae3fc771a4abfd2f5d5d5997544c3487ac36b5c85170fc',
+            'dff6879848c2c9b62fe652720b8df5272093acfaa45a43cdb3696fe2466a3877',
+            'b825c0745f46ac58f7d3759e6dc535a1fec7820377f24d4c2c6ad2cc55c0cb59',
+            '95513952a04bd8992721e9b7e2937f1c04ba31e0469fbe615a78197f68f52b7c',
+            '2e6d722e5e4dbdf2447ddecc9f7dabb8e299bae921c99ad5b0184cd9eb8e5908',
+            'b13a750047bc0bdceb2473e5fe488c2596d7a7124b4e716fdd29b046ef99bbf0',
+        ]
+        hashes = [bytes.fromhex(h) for h in hex_hashes]
+        want = 'acbcab8bcc1af95d8d563b77d24c3d19b18f1486383d75a5085c4e86c86beed6'
+        self.assertEqual(merkle_root(hashes).hex(), want)
+        self.assertEqual(MerkleTree(hashes).root().hex(), want)
+        self.assertEqual(IncrementalMerkleTree(hashes).root().hex(), want)
+        with self.assertRaises(ValueError):
+            merkle_root([])
+
+    def test_proof(self):
+        for n in range(1, 20):
+            hashes = [hash256(bytes([i])) for i in range(n)]
+            tree = MerkleTree(hashes)
+            root = naive_merkle_root(hashes)
+            self.assertEqual(tree.root(), root)
+            for i, h in enumerate(hashes):
+                proof = tree.proof(i)
+                self.assertTrue(verify_merkle_proof(h, i, proof, root))
+                if i ^ 1 < n:
+                    self.assertFalse(verify_merkle_proof(h, i ^ 1, proof, root))
+                self.assertFalse(verify_merkle_proof(h, i + 2 ** len(proof), proof, root))
+                self.assertFalse(verify_merkle_proof(hash256(h), i, proof, root))
+
+    def test_incremental(self):
+        tree = IncrementalMerkleTree()
+        hashes = []
+        for i in range(70):
+            h = hash256(bytes([i]))
+            tree.append(h)
+            hashes.append(h)
+            self.assertEqual(tree.root(), naive_merkle_root(hashes))
+        self.assertEqual(len(tree), 70)
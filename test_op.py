@@ -0,0 +1,105 @@
+from unittest import TestCase
+
+from ecc import PrivateKey, SignatureBatch
+from op import (
+    decode_num,
+    encode_num,
+    op_checkmultisig,
+    op_checksig,
+    op_hash160,
+)
+
+
+class OpTest(TestCase):
+    def test_op_hash160(self):
+        stack = [b'hello world']
+        self.assertTrue(op_hash160(stack))
+        self.assertEqual(stack[0].hex(), 'd7d5ee7824ff93f94c3055af9382c86c68b5ca92')
+
+    def test_op_checksig(self):
+        z = 0x7c076ff316692a3d7eb3c3bb0f8b1488cf72e1afcd929e29307032997a838a3d
+        sec = bytes.fromhex(
+            '04887387e452b8eacc4acfde10d9aaf7f6d9a0f975aabb10d006e4da568744d06c61de6d95231cd89026e286df3b6ae4a894'
+            'a3378e393e93a0f45b666329a0ae34')
+        sig = bytes.fromhex(
+            '3045022000eff69ef2b1bd93a66ed5219add4fb51e11a840f404876325a1e8ffe0529a2c022100c7207fee197d27c618aea62'
+            '1406f6bf5ef6fca38681d82b2f06fddbdce6feab601')
+        stack = [sig, sec]
+        self.assertTrue(op_checksig(stack, z))
+        self.assertEqual(decode_num(stack[0]), 1)
+        stack = [sig, sec]
+        self.assertTrue(op_checksig(stack, z + 1))
+        self.assertEqual(decode_num(stack[0]), 0)
+
+    def test_op_checkmultisig(self):
+        z = 0xe71bfa115715d6fd33796948126f40a8cdd39f187e4afb03896795189fe1423c
+        sig1 = bytes.fromhex(
+            '3045022100dc92655fe37036f47756db8102e0d7d5e28b3beb83a8fef4f5dc0559bddfb94e02205a36d4e4e6c7fcd16658c5'
+            '0783e00c341609977aed3ad00937bf4ee942a8993701')
+        sig2 = bytes.fromhex(
+            '3045022100da6bee3c93766232079a01639d07fa869598749729ae323eab8eef53577d611b02207bef15429dcadce2121ea0'
+            '7f233115c6f09034c0be68db99980b9a6c5e75402201')
+        sec1 = bytes.fromhex('022626e955ea6ea6d98850c994f9107b036b1334f18ca8830bfff1295d21cfdb70')
+        sec2 = bytes.fromhex('03b287eaf122eea69030a0e9feed096bed8045c8b98bec453e1ffac7fbdbd4bb71')
+        stack = [b'', sig1, sig2, b'\x02', sec1, sec2, b'\x02']
+        self.assertTrue(op_checkmultisig(stack, z))
+        self.assertEqual(decode_num(stack[0]), 1)
+        # signatures in the wrong order do not match
+        stack = [b'', sig2, sig1, b'\x02', sec1, sec2, b'\x02']
+        self.assertTrue(op_checkmultisig(stack, z))
+        self.assertEqual(decode_num(stack[0]), 0)
+
+    def test_checksig_invalid(self):
+        z = 0x1234
+        key = PrivateKey(101)
+        sec = key.point.sec()
+        sig = key.sign(z).der() + b'\x01'
+        # s = 0, a short DER, an empty and a truncated pubkey all fail the
+        # check without failing the script
+        for stack in ([bytes.fromhex('3006020101020100') + b'\x01', sec], [b'\x30\x00\x01', sec],
+                      [sig, b''], [sig, sec[:20]]):
+            self.assertTrue(op_checksig(stack, z))
+            self.assertEqual(stack, [b''])
+        stack = [b'', sig, b'\x01', b'', sec, b'\x02']
+        self.assertTrue(op_checkmultisig(stack, z))
+        self.assertEqual(decode_num(stack[0]), 1)
+        stack = [b'', b'\x30\x00\x01', b'\x01', sec, b'\x01']
+        self.assertTrue(op_checkmultisig(stack, z))
+        self.assertEqual(decode_num(stack[0]), 0)
+        for sec_pubkey, der in ((sec, bytes.fromhex('3006020101020100')), (b'', sig[:-1]), (sec, b'\x30\x00')):
+            batch = SignatureBatch()
+            batch.add(sec_pubkey, der, z)
+            self.assertFalse(batch.verify())
+
+    def test_checkmultisig_batch(self):
+        z = 0x1234
+        keys = [PrivateKey(secret) for secret in (101, 202, 303)]
+        secs = [key.point.sec() for key in keys]
+        sigs = [key.sign(z).der() + b'\x01' for key in keys]
+        # 1-of-3 has to be matched right away
+        batch = SignatureBatch()
+        stack = [b'', sigs[2], b'\x01'] + secs + [b'\x03']
+        self.assertTrue(op_checkmultisig(stack, z, batch))
+        self.assertEqual(decode_num(stack[0]), 1)
+        self.assertEqual(len(batch), 0)
+        # 3-of-3 is deferred
+        stack = [b''] + sigs + [b'\x03'] + secs + [b'\x03']
+        self.assertTrue(op_checkmultisig(stack, z, batch))
+        self.assertEqual(len(batch), 3)
+        self.assertTrue(batch.verify())
+        batch.add(secs[0], sigs[1][:-1], z)
+        self.assertFalse(batch.verify())
+
+    def test_encode_decode_num(self):
+        cases = (
+            (0, ''), (1, '01'), (-1, '81'), (16, '10'), (127, '7f'), (-127, 'ff'), (128, '8000'),
+            (-128, '8080'), (255, 'ff00'), (256, '0001'), (-256, '0081'), (32767, 'ff7f'),
+            (500000000, '0065cd1d'), (-2 ** 31, '0000008080'),
+        )
+        for num, hex_encoding in cases:
+            self.assertEqual(encode_num(num).hex(), hex_encoding)
+            self.assertEqual(decode_num(bytes.fromhex(hex_encoding)), num)
+        # negative zero and non-minimal encodings still decode
+        self.assertEqual(decode_num(b'\x80'), 0)
+        self.assertEqual(decode_num(b'\x01\x00\x00'), 1)
+        self.assertEqual(decode_num(b'\x01\x80'), -1)
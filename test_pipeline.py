@@ -0,0 +1,162 @@
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from unittest import TestCase
+
+from block import Block, BlockFile, BlockHeader, write_blocks
+from ecc import PrivateKey
+from pipeline import Pipeline
+from script import Script, p2pkh_script
+from tx import Tx, TxIn, TxOut, SIGHASH_ALL
+
+KEY = PrivateKey(8675309)
+OTHER = PrivateKey(12345)
+
+
+def coinbase(height, key):
+    tx_in = TxIn(b'\x00' * 32, 0xffffffff, Script([height.to_bytes(4, 'little')]))
+    return Tx(1, [tx_in], [TxOut(50 * 10 ** 8, p2pkh_script(key.point.hash160()))], 0)
+
+
+def spend(prev_tx, key, amount, to, signer=None):
+    """Spends the first output of prev_tx, signed by signer or key"""
+    tx_in = TxIn(prev_tx.hash(), 0)
+    prev_out = prev_tx.tx_outs[0]
+    tx_in.prevout = (prev_out.amount, prev_out.script_pubkey.raw_serialize())
+    tx = Tx(1, [tx_in], [TxOut(amount, p2pkh_script(to.point.hash160()))], 0)
+    der = (signer or key).sign(tx.sig_hash(0)).der()
+    tx_in.script_sig = Script([der + SIGHASH_ALL.to_bytes(1, 'big'), key.point.sec()])
+    tx_in.prevout = None
+    return tx
+
+
+def make_block(prev_block, txs):
+    header = BlockHeader(1, prev_block, b'\x00' * 32, 1500000000, bytes.fromhex('ffff7f20'), b'\x00' * 4)
+    block = Block(header, txs)
+    header.merkle_root = block.merkle_root()
+    return block
+
+
+class PipelineTest(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.executor = ProcessPoolExecutor(max_workers=2)
+        cb0 = coinbase(0, KEY)
+        cb1 = coinbase(1, KEY)
+        tx_a = spend(cb0, KEY, 49 * 10 ** 8, OTHER)
+        cb2 = coinbase(2, KEY)
+        tx_b = spend(tx_a, OTHER, 48 * 10 ** 8, KEY)
+        tx_c = spend(cb1, KEY, 40 * 10 ** 8, OTHER)
+        block0 = make_block(b'\x00' * 32, [cb0])
+        block1 = make_block(block0.hash(), [cb1, tx_a])
+        block2 = make_block(block1.hash(), [cb2, tx_b, tx_c])
+        cls.blocks = [block0, block1, block2]
+        cls.cb2 = cb2
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.executor.shutdown()
+
+    def run_pipeline(self, blocks, **kwargs):
+        pipeline = Pipeline(executor=self.executor, **kwargs)
+        results = list(pipeline.run(block.serialize() for block in blocks))
+        return pipeline, results
+
+    def test_valid(self):
+        pipeline, results = self.run_pipeline(self.blocks, queue_size=1, chunk_size=1)
+        self.assertEqual([result.index for result in results], [0, 1, 2])
+        self.assertTrue(all(result.valid for result in results))
+        self.assertEqual([result.block_hash for result in results], [block.hash() for block in self.blocks])
+        # the three coinbase outputs, less the two that were spent, plus
+        # the outputs of tx_a, tx_b and tx_c, less tx_a's that was spent
+        self.assertEqual(len(pipeline.utxo_set), 3)
+        report = pipeline.report()
+        for stats in report.values():
+            self.assertEqual(stats['items'], 3)
+
+    def test_invalid(self):
+        last = self.blocks[-1]
+        # signed by the wrong key
+        bad_signature = make_block(last.hash(), [coinbase(3, KEY), spend(self.cb2, KEY, 10 ** 8, OTHER, signer=OTHER)])
+        after = make_block(bad_signature.hash(), [coinbase(4, KEY)])
+        valid, _ = self.run_pipeline(self.blocks)
+        for queue_size in (1, 4):
+            pipeline, results = self.run_pipeline(self.blocks + [bad_signature, after], queue_size=queue_size)
+            self.assertEqual([result.reason for result in results], [None, None, None, 'signature', 'previous-block'])
+            self.assertEqual(results[3].location, (1, 0))
+            # neither the invalid block nor the one after it is left in
+            self.assertEqual(pipeline.utxo_set.outputs, valid.utxo_set.outputs)
+
+        # a signature and a pubkey that do not parse
+        for script_sig, reason in ((Script([b'\x30\x00\x01', KEY.point.sec()]), 'signature'),
+                                   (Script([b'\x30' * 71, b'']), 'script')):
+            tx = spend(self.cb2, KEY, 10 ** 8, OTHER)
+            tx.tx_ins[0].script_sig = script_sig
+            block = make_block(last.hash(), [coinbase(3, KEY), tx])
+            _, results = self.run_pipeline(self.blocks + [block])
+            self.assertEqual((results[3].reason, results[3].location), (reason, (1, 0)))
+
+        # wrong pubkey for the ScriptPubKey
+        bad_script = make_block(last.hash(), [coinbase(3, KEY), spend(self.cb2, OTHER, 10 ** 8, OTHER)])
+        _, results = self.run_pipeline(self.blocks + [bad_script])
+        self.assertEqual((results[3].reason, results[3].location), ('script', (1, 0)))
+
+        # spends an output whose ScriptPubKey does not parse
+        unspendable = coinbase(3, KEY)
+        unspendable.tx_outs[0].script_pubkey = Script(raw=b'\x4c')
+        block3 = make_block(last.hash(), [unspendable])
+        tx_in = TxIn(unspendable.hash(), 0, Script([b'\x01']))
+        block4 = make_block(block3.hash(), [coinbase(4, KEY), Tx(1, [tx_in], [TxOut(10 ** 8, Script([0x51]))], 0)])
+        _, results = self.run_pipeline(self.blocks + [block3, block4])
+        self.assertEqual([result.reason for result in results], [None, None, None, None, 'script'])
+        self.assertEqual(results[4].location, (1, 0))
+
+        # more out than in
+        too_much = make_block(last.hash(), [coinbase(3, KEY), spend(self.cb2, KEY, 51 * 10 ** 8, OTHER)])
+        _, results = self.run_pipeline(self.blocks + [too_much])
+        self.assertEqual((results[3].reason, results[3].location), ('fee', (1, None)))
+
+        # spends an output that was spent already
+        double_spend = make_block(last.hash(), [coinbase(3, KEY), self.blocks[1].txs[1]])
+        pipeline, results = self.run_pipeline(self.blocks + [double_spend])
+        self.assertEqual((results[3].reason, results[3].location), ('missing-input', (1, 0)))
+        # the coinbase applied before the failing transaction is taken back
+        self.assertEqual(pipeline.utxo_set.outputs, valid.utxo_set.outputs)
+
+        block = make_block(last.hash(), [coinbase(3, KEY)])
+        block.header.merkle_root = b'\x00' * 32
+        _, results = self.run_pipeline(self.blocks + [block])
+        self.assertEqual(results[3].reason, 'merkle')
+
+        pipeline = Pipeline(executor=self.executor)
+        results = list(pipeline.run([self.blocks[0].serialize(), b'\x01' * 10]))
+        self.assertEqual([result.reason for result in results], [None, 'parse'])
+        self.assertIsNone(results[1].block_hash)
+
+    def test_block_file(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, 'blk00000.dat')
+            write_blocks(filename, self.blocks)
+            with BlockFile(filename) as block_file:
+                pipeline = Pipeline(executor=self.executor)
+                results = list(pipeline.run(raw for _, raw in block_file.raw_blocks()))
+        self.assertEqual([result.block_hash for result in results], [block.hash() for block in self.blocks])
+        self.assertTrue(all(result.valid for result in results))
+
+    def test_stopped(self):
+        # the blocks not reported when the results stop being read are
+        # rolled back
+        pipeline = Pipeline(executor=self.executor)
+        results = pipeline.run(block.serialize() for block in self.blocks)
+        next(results)
+        results.close()
+        self.assertEqual(len(pipeline.utxo_set), 1)
+
+    def test_error(self):
+        def blocks():
+            yield self.blocks[0].serialize()
+            raise OSError('disk gone')
+        pipeline = Pipeline(executor=self.executor)
+        with self.assertRaises(OSError):
+            list(pipeline.run(blocks()))
@@ -0,0 +1,105 @@
+import os
+import tempfile
+from unittest import TestCase
+
+from block import BlockFile, write_blocks
+from helper import encode_base58_checksum, hash160
+from scanner import Scanner, last_push
+from script import P2PK, P2PKH, P2SH, P2WPKH, Script, p2pkh_script, p2sh_script, p2wpkh_script
+from test_pipeline import KEY, OTHER, make_block
+from tx import Tx, TxIn, TxOut
+
+# a 1 of 1 multisig redeem script
+REDEEM = Script([0x51, KEY.point.sec(), 0x51, 0xae]).raw_serialize()
+SIG = b'\x30' * 71
+
+
+class ScannerTest(TestCase):
+
+    def setUp(self):
+        h160 = KEY.point.hash160()
+        coinbase = Tx(1, [TxIn(b'\x00' * 32, 0xffffffff, Script([b'\x00' * 4]))],
+                      [TxOut(50 * 10 ** 8, p2pkh_script(h160))], 0)
+        self.funding = Tx(1, [TxIn(coinbase.hash(), 0, Script([SIG, KEY.point.sec()]))], [
+            TxOut(1000, p2pkh_script(h160)),
+            TxOut(2000, p2sh_script(hash160(REDEEM))),
+            TxOut(3000, p2wpkh_script(h160)),
+            TxOut(4000, Script([OTHER.point.sec(), 0xac])),
+            TxOut(5000, p2pkh_script(OTHER.point.hash160())),
+        ], 0)
+        tx_ins = [
+            TxIn(self.funding.hash(), 0, Script([SIG, KEY.point.sec()])),
+            TxIn(self.funding.hash(), 1, Script([0, SIG, REDEEM])),
+            TxIn(self.funding.hash(), 2, witness=[SIG, KEY.point.sec()]),
+            TxIn(self.funding.hash(), 3, Script([SIG])),
+            TxIn(self.funding.hash(), 4, Script([SIG, OTHER.point.sec()])),
+        ]
+        self.spending = Tx(1, tx_ins, [TxOut(14000, p2pkh_script(b'\x00' * 20))], 0, segwit=True)
+        self.coinbase = coinbase
+        self.p2sh_address = encode_base58_checksum(b'\x05' + hash160(REDEEM))
+
+    def scanner(self, **kwargs):
+        scanner = Scanner(addresses=[self.p2sh_address], **kwargs)
+        scanner.add_point(KEY.point)
+        scanner.add_hash160(OTHER.point.hash160())
+        return scanner
+
+    def test_last_push(self):
+        self.assertEqual(last_push(Script([SIG, REDEEM]).raw_serialize()), REDEEM)
+        self.assertEqual(last_push(b'\x4c\x02ab'), b'ab')
+        self.assertEqual(last_push(b'\x4d\x02\x00ab'), b'ab')
+        self.assertIsNone(last_push(b'\x02ab\x51'))
+        self.assertIsNone(last_push(b'\x05ab'))
+        self.assertIsNone(last_push(b''))
+
+    def test_scan(self):
+        scanner = self.scanner()
+        hits = list(scanner.scan([self.coinbase, self.funding.serialize(), self.spending]))
+        outputs = [hit for hit in hits if hit.kind == 'output']
+        inputs = [hit for hit in hits if hit.kind == 'input']
+        self.assertEqual([(hit.txid, hit.index) for hit in outputs],
+                         [(self.coinbase.hash(), 0)] + [(self.funding.hash(), i) for i in range(5)])
+        self.assertEqual([hit.script_type for hit in outputs], [P2PKH, P2PKH, P2SH, P2WPKH, P2PK, P2PKH])
+        self.assertEqual(outputs[2].hash160, hash160(REDEEM))
+        self.assertEqual(outputs[4].hash160, OTHER.point.hash160())
+        # every spend is of an output seen earlier, so the amounts are known
+        self.assertEqual([(hit.prev_tx, hit.prev_index, hit.amount) for hit in inputs],
+                         [(self.coinbase.hash(), 0, 50 * 10 ** 8)] +
+                         [(self.funding.hash(), i, 1000 * (i + 1)) for i in range(5)])
+        self.assertEqual(scanner.watched, {})
+        self.assertEqual(scanner.stats, {'txs': 3, 'outputs': 7, 'inputs': 7, 'hits': 12})
+
+    def test_match_keys(self):
+        # the outputs were made before the stream, only the pushed keys
+        # and redeem scripts give the spends away
+        hits = list(self.scanner().scan([self.spending]))
+        self.assertEqual([(hit.kind, hit.index, hit.hash160) for hit in hits], [
+            ('input', 0, KEY.point.hash160()),
+            ('input', 1, hash160(REDEEM)),
+            ('input', 2, KEY.point.hash160()),
+            ('input', 4, OTHER.point.hash160()),
+        ])
+        self.assertIsNone(hits[0].amount)
+        self.assertEqual(list(self.scanner(match_keys=False).scan([self.spending])), [])
+
+    def test_scan_blocks(self):
+        block0 = make_block(b'\x00' * 32, [self.coinbase, self.funding])
+        block1 = make_block(block0.hash(), [self.spending])
+        expected = [
+            ('output', 3, block0.hash()),
+            ('output', 4, block0.hash()),
+            ('input', 3, block1.hash()),
+            ('input', 4, block1.hash()),
+        ]
+        scanner = Scanner(hash160s=[OTHER.point.hash160()])
+        hits = list(scanner.scan_blocks([block0.serialize(), block1.serialize()]))
+        self.assertEqual([(hit.kind, hit.index, hit.block) for hit in hits], expected)
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, 'blk00000.dat')
+            write_blocks(filename, [block0, block1])
+            with BlockFile(filename) as block_file:
+                scanner = Scanner(hash160s=[OTHER.point.hash160()])
+                hits = list(scanner.scan_blocks(raw for _, raw in block_file.raw_blocks()))
+        self.assertEqual([(hit.kind, hit.index, hit.block) for hit in hits], expected)
+        with self.assertRaises(ValueError):
+            scanner.add_hash160(b'\x00' * 32)
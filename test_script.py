@@ -1,7 +1,28 @@
+import hashlib
+import pickle
 from io import BytesIO
 from unittest import TestCase
 
-from script import Script
+from ecc import PrivateKey, SignatureBatch
+from helper import hash160
+from script import (
+    P2PK,
+    P2PKH,
+    P2SH,
+    P2WPKH,
+    P2WSH,
+    NONSTANDARD,
+    NULL_DATA,
+    Script,
+    ScriptLimitError,
+    ScriptLimits,
+    ScriptTracer,
+    classify_script,
+    p2pkh_script,
+    p2sh_script,
+    p2wpkh_script,
+    p2wsh_script,
+)
 
 
 class ScriptTest(TestCase):
@@ -18,3 +39,109 @@ class ScriptTest(TestCase):
         script_pubkey = BytesIO(bytes.fromhex(want))
         script = Script.parse(script_pubkey)
         self.assertEqual(script.serialize().hex(), want)
+
+    def test_classify_script(self):
+        h160 = bytes(range(20))
+        h256 = bytes(range(32))
+        sec = bytes.fromhex('035d5c93d9ac96881f19ba1f686f15f009ded7c62efe85a872e6a19b43c15a2937')
+        tests = [
+            (p2pkh_script(h160), (P2PKH, h160)),
+            (p2sh_script(h160), (P2SH, h160)),
+            (p2wpkh_script(h160), (P2WPKH, h160)),
+            (p2wsh_script(h256), (P2WSH, h256)),
+            (Script([sec, 0xac]), (P2PK, sec)),
+            (Script([0x6a, b'hello']), (NULL_DATA, None)),
+            (Script([0x51]), (NONSTANDARD, None)),
+            (Script([]), (NONSTANDARD, None)),
+        ]
+        for script, want in tests:
+            raw = script.raw_serialize()
+            self.assertEqual(classify_script(raw), want)
+            self.assertEqual(classify_script(memoryview(raw)), want)
+        self.assertEqual(classify_script(p2pkh_script(h160).raw_serialize()[:-1]), (NONSTANDARD, None))
+
+    def test_serialize_cache(self):
+        raw = bytes.fromhex('1976a914bc3b654dca7e56b04dca18f2566cdaf02e8d9ada88ac')
+        script = Script.parse(BytesIO(raw))
+        self.assertIs(script.raw_serialize(), script.raw_serialize())
+        self.assertEqual(script.serialize(), raw)
+        script.cmds.append(0x87)
+        self.assertEqual(script.serialize().hex(), '1a' + raw[1:].hex() + '87')
+        script.cmds = [0x76, bytes(75)]
+        self.assertEqual(script.raw_serialize(), bytes([0x76, 75]) + bytes(75))
+
+    def test_pickle(self):
+        raw = bytes.fromhex('76a914bc3b654dca7e56b04dca18f2566cdaf02e8d9ada88ac')
+        script = Script(raw=raw)
+        self.assertEqual(len(script.cmds), 5)
+        copy = pickle.loads(pickle.dumps(script))
+        self.assertEqual(copy.cmds, script.cmds)
+        self.assertEqual(copy.raw_serialize(), raw)
+        # the copy's cmds still belong to it
+        copy.cmds.append(0x87)
+        self.assertEqual(copy.raw_serialize(), raw + b'\x87')
+        self.assertEqual(script.raw_serialize(), raw)
+
+    def test_checksig_batch(self):
+        key = PrivateKey(101)
+        z = 0x1234
+        sec = key.point.sec()
+        bad_sig = key.sign(z + 1).der() + b'\x01'
+        # a pubkey that does not parse fails the check, not the script
+        self.assertFalse(Script([key.sign(z).der() + b'\x01', b'', 0xac]).evaluate(z))
+        # OP_CHECKSIG OP_NOT passes with a bad signature, so the check
+        # cannot be deferred
+        script = Script([bad_sig, sec, 0xac, 0x91])
+        batch = SignatureBatch()
+        self.assertTrue(script.evaluate(z))
+        self.assertTrue(script.evaluate(z, batch=batch))
+        self.assertEqual(len(batch), 0)
+        # a final OP_CHECKSIG is
+        self.assertTrue(Script([bad_sig, sec, 0xac]).evaluate(z, batch=batch))
+        self.assertEqual(len(batch), 1)
+        self.assertFalse(batch.verify())
+
+    def test_p2sh_once(self):
+        # a hash lock looks like a p2sh ScriptPubKey, but only the
+        # ScriptPubKey after the ScriptSig is one
+        lock = Script([0xa9, hash160(b'hello'), 0x87]).raw_serialize()
+        program = Script([0x00, hashlib.sha256(lock).digest()])
+        self.assertTrue(program.evaluate(0, witness=[b'hello', lock]))
+        self.assertFalse(program.evaluate(0, witness=[b'goodbye', lock]))
+        self.assertTrue(Script([0x51, 0x63, b'hello'] + Script.parse_cmds(lock) + [0x68]).evaluate(0))
+        # the real thing
+        redeem = Script([0x51]).raw_serialize()
+        self.assertTrue((Script([redeem]) + p2sh_script(hash160(redeem))).evaluate(0))
+        self.assertFalse((Script([b'\x00']) + p2sh_script(hash160(b'\x00'))).evaluate(0))
+
+    def test_tracer(self):
+        # OP_2 OP_DUP OP_HASH256 OP_DROP OP_1ADD OP_3 OP_EQUAL
+        script = Script([0x52, 0x76, 0xaa, 0x75, 0x8b, 0x53, 0x87])
+        tracer = ScriptTracer()
+        self.assertTrue(script.evaluate(0, tracer=tracer))
+        self.assertFalse(Script([0x6a]).evaluate(0, tracer=tracer))
+        report = tracer.report()
+        self.assertEqual(report['evaluations'], 2)
+        self.assertEqual(report['failures'], 1)
+        self.assertEqual(report['max_stack_depth'], 2)
+        self.assertEqual(report['bytes_hashed'], 1)
+        self.assertEqual(report['ops']['OP_HASH256']['count'], 1)
+        self.assertEqual(report['ops']['OP_RETURN']['failures'], 1)
+
+    def test_limits(self):
+        # OP_1 OP_1 OP_1 OP_3DUP OP_3DUP ... keeps growing the stack
+        script = Script([0x51] * 3 + [0x6f] * 400)
+        with self.assertRaises(ScriptLimitError) as cm:
+            script.evaluate(0, limits=ScriptLimits(max_ops=1000))
+        self.assertEqual(cm.exception.reason, 'stack')
+        with self.assertRaises(ScriptLimitError) as cm:
+            script.evaluate(0)
+        self.assertEqual(cm.exception.reason, 'ops')
+        with self.assertRaises(ScriptLimitError) as cm:
+            Script([bytes(521)]).evaluate(0)
+        self.assertEqual(cm.exception.reason, 'element')
+        # OP_CHECKSIG OP_DROP OP_CHECKSIG with a budget of one
+        script = Script([b'\x01', b'\x02', 0xac, 0x75, b'\x01', b'\x02', 0xac])
+        with self.assertRaises(ScriptLimitError) as cm:
+            script.evaluate(0, limits=ScriptLimits(max_sigops=1))
+        self.assertEqual(cm.exception.reason, 'sigops')
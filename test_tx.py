@@ -1,7 +1,43 @@
+import hashlib
+import json
+import pickle
+import mmap
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import Executor, Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from io import BytesIO
 from unittest import TestCase
 
-from tx import TxFetcher, Tx
+from ecc import PrivateKey
+from helper import hash160
+from script import Script, p2sh_script, p2wsh_script
+from tx import TxCache, TxFetcher, Tx, TxIn, TxOut, TxView, verify_many
+
+
+class Stream:
+    """Only reads, like a socket"""
+
+    def __init__(self, raw):
+        self.s = BytesIO(raw)
+
+    def read(self, n):
+        return self.s.read(n)
+
+
+class InlineExecutor(Executor):
+    """Runs every call right away, in the calling thread"""
+
+    def __init__(self):
+        self.submitted = 0
+
+    def submit(self, fn, *args, **kwargs):
+        self.submitted += 1
+        future = Future()
+        future.set_result(fn(*args, **kwargs))
+        return future
 
 
 class TxTest(TestCase):
@@ -98,4 +134,386 @@ class TxTest(TestCase):
             'a87988ac005a6202000000001976a9143c82d7df364eb6c75be8c80df2b3eda8db57397088ac46430600')
         stream = BytesIO(raw_tx)
         tx = Tx.parse(stream)
-        self.assertEqual(tx.fee(), 140500)
\ No newline at end of file
+        self.assertEqual(tx.fee(), 140500)
+
+    def test_serialize_cache(self):
+        raw_tx = bytes.fromhex(
+            '0100000001813f79011acb80925dfe69b3def355fe914bd1d96a3f5f71bf8303c6a989c7d1000000006b483045022100ed81ff19'
+            '2e75a3fd2304004dcadb746fa5e24c5031ccfcf21320b0277457c98f02207a986d955c6e0cb35d446a89d3f56100f4d7f67801c3'
+            '1967743a9c8e10615bed01210349fc4e631e3624a545de3f89f5d8684c7b8138bd94bdd531d2e213bf016b278afeffffff02a135'
+            'ef01000000001976a914bc3b654dca7e56b04dca18f2566cdaf02e8d9ada88ac99c39800000000001976a9141c4bc762dd5423e3'
+            '32166702cb75f40df79fea1288ac19430600')
+        tx = Tx.parse(BytesIO(raw_tx))
+        # the bytes read are kept, nothing is put back together
+        self.assertEqual(tx._raw, raw_tx)
+        self.assertEqual(tx.serialize(), raw_tx)
+        self.assertIs(tx.serialize(), tx.serialize())
+        # a stream that cannot be read again
+        self.assertIsNone(Tx.parse(Stream(raw_tx))._raw)
+        self.assertEqual(Tx.parse(Stream(raw_tx)).serialize(), raw_tx)
+        self.assertIs(tx.hash(), tx.hash())
+        self.assertEqual(tx.id(), '452c629d67e41baec3ac6f04fe744b4b9617f8f859c63b3002f8684e7a4fee03')
+        tx.locktime += 1
+        self.assertEqual(tx.serialize()[-4:], bytes.fromhex('1a430600'))
+        tx.locktime -= 1
+        tx.tx_outs[0].amount -= 1
+        self.assertNotEqual(tx.serialize(), raw_tx)
+        tx.tx_outs[0].amount += 1
+        tx.tx_ins[0].script_sig.cmds.pop()
+        self.assertNotEqual(tx.id(), '452c629d67e41baec3ac6f04fe744b4b9617f8f859c63b3002f8684e7a4fee03')
+        tx.tx_outs.pop()
+        self.assertEqual(len(tx.serialize()), len(raw_tx) - 34 - 34)
+
+    def test_pickle(self):
+        tx = TxFetcher.fetch('452c629d67e41baec3ac6f04fe744b4b9617f8f859c63b3002f8684e7a4fee03')
+        self.assertEqual(len(tx.tx_ins[0].script_sig.cmds), 2)
+        copy = pickle.loads(pickle.dumps(tx))
+        self.assertEqual(copy.serialize(), tx.serialize())
+        self.assertEqual(copy.tx_ins[0].script_sig.cmds, tx.tx_ins[0].script_sig.cmds)
+
+    def test_view(self):
+        txs = [tx for (testnet, _), tx in TxFetcher.cache.items() if not testnet]
+        with tempfile.TemporaryFile() as f:
+            for tx in txs:
+                f.write(tx.serialize())
+            f.flush()
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                views = list(TxView.iter_all(m))
+                self.assertEqual(len(views), len(txs))
+                for tx, view in zip(txs, views):
+                    self.assertEqual(view.id(), tx.id())
+                    self.assertEqual(view.wtxid(), tx.wtxid())
+                    self.assertEqual(view.segwit, tx.segwit)
+                    self.assertEqual(view.version, tx.version)
+                    self.assertEqual(view.locktime, tx.locktime)
+                    self.assertEqual(view.amounts(), [tx_out.amount for tx_out in tx.tx_outs])
+                    last = len(tx.tx_ins) - 1
+                    self.assertEqual(view.prev_tx(last), tx.tx_ins[last].prev_tx)
+                    self.assertEqual(view.prev_index(last), tx.tx_ins[last].prev_index)
+                    self.assertEqual(view.sequence(last), tx.tx_ins[last].sequence)
+                    self.assertEqual(view.tx_in(last).serialize(), tx.tx_ins[last].serialize())
+                    self.assertEqual(view.witness(last), tx.tx_ins[last].witness)
+                    self.assertEqual(view.script_pubkey(0), tx.tx_outs[0].script_pubkey.raw_serialize())
+                    self.assertEqual(view.tx_out(0).serialize(), tx.tx_outs[0].serialize())
+                    self.assertEqual(view.tx().serialize(), tx.serialize())
+                del views, view
+
+    def test_parse_segwit(self):
+        with open(self.cache_file) as f:
+            disk_cache = json.load(f)
+        segwit = 0
+        for tx_id, raw_hex in disk_cache.items():
+            raw = bytes.fromhex(raw_hex)
+            tx = Tx.parse(BytesIO(raw))
+            self.assertEqual(tx.id(), tx_id)
+            self.assertEqual(tx.serialize(), raw)
+            self.assertEqual(tx.serialize_legacy(), Tx.parse(Stream(raw)).serialize_legacy())
+            if tx.segwit:
+                segwit += 1
+                self.assertTrue(any(tx_in.witness for tx_in in tx.tx_ins))
+                self.assertNotEqual(tx.wtxid(), tx_id)
+                self.assertLess(len(tx.serialize_legacy()), len(raw))
+                tx.tx_ins[0].witness.append(b'\x01')
+                self.assertEqual(len(tx.serialize()), len(raw) + 2)
+                self.assertEqual(tx.id(), tx_id)
+            else:
+                self.assertEqual(tx.wtxid(), tx_id)
+        self.assertEqual(segwit, 4)
+
+    def test_sig_hash(self):
+        tx = TxFetcher.fetch('452c629d67e41baec3ac6f04fe744b4b9617f8f859c63b3002f8684e7a4fee03')
+        want = int('27e0c5994dec7824e56dec6b2fcb342eb7cdb0d0957c2fce9882f715e85d81a6', 16)
+        self.assertEqual(tx.sig_hash(0), want)
+
+    def test_verify_p2pkh(self):
+        tx = TxFetcher.fetch('452c629d67e41baec3ac6f04fe744b4b9617f8f859c63b3002f8684e7a4fee03')
+        self.assertTrue(tx.verify())
+        tx = TxFetcher.fetch('5418099cc755cb9dd3ebc6cf1a7888ad53a1a3beb5a025bce89eb1bf7f1650a2', testnet=True)
+        self.assertTrue(tx.verify())
+
+    def test_verify_p2sh(self):
+        tx = TxFetcher.fetch('46df1a9484d0a81d03ce0ee543ab6e1a23ed06175c104a178268fad381216c2b')
+        self.assertTrue(tx.verify())
+        self.assertTrue(tx.verify(batch=True))
+
+    def test_verify_p2wpkh(self):
+        tx = TxFetcher.fetch('d869f854e1f8788bcff294cc83b280942a8c728de71eb709a2c29d10bfe21b7c', testnet=True)
+        self.assertTrue(tx.verify())
+
+    def test_verify_p2sh_p2wpkh(self):
+        tx = TxFetcher.fetch('c586389e5e4b3acb9d6c8be1c19ae8ab2795397633176f5a6442a261bbdefc3a')
+        self.assertTrue(tx.verify())
+
+    def test_verify_p2wsh(self):
+        tx = TxFetcher.fetch('78457666f82c28aa37b74b506745a7c7684dc7842a52a457b09f09446721e11c', testnet=True)
+        self.assertTrue(tx.verify())
+
+    def test_verify_bad_signature(self):
+        tx = Tx.parse(BytesIO(TxFetcher.fetch(
+            '452c629d67e41baec3ac6f04fe744b4b9617f8f859c63b3002f8684e7a4fee03').serialize()))
+        tx.locktime += 1
+        self.assertFalse(tx.verify())
+
+    def test_verify_stripped_witness(self):
+        # without their witnesses the witness programs are left on the stack
+        for tx_id, testnet in (('d869f854e1f8788bcff294cc83b280942a8c728de71eb709a2c29d10bfe21b7c', True),
+                               ('c586389e5e4b3acb9d6c8be1c19ae8ab2795397633176f5a6442a261bbdefc3a', False),
+                               ('78457666f82c28aa37b74b506745a7c7684dc7842a52a457b09f09446721e11c', True)):
+            tx = Tx.parse(BytesIO(TxFetcher.fetch(tx_id, testnet=testnet).serialize()), testnet=testnet)
+            for tx_in in tx.tx_ins:
+                tx_in.witness = []
+            self.assertFalse(tx.verify())
+            self.assertFalse(tx.verify(batch=True))
+        # a witness on an input that spends a legacy output
+        tx = Tx.parse(BytesIO(TxFetcher.fetch(
+            '452c629d67e41baec3ac6f04fe744b4b9617f8f859c63b3002f8684e7a4fee03').serialize()))
+        tx.tx_ins[0].witness = [b'\x01']
+        tx.segwit = True
+        self.assertFalse(tx.verify())
+
+    def test_verify_malformed(self):
+        raw = TxFetcher.fetch('46df1a9484d0a81d03ce0ee543ab6e1a23ed06175c104a178268fad381216c2b').serialize()
+        script_sigs = (
+            Script([]),
+            # RedeemScript with a truncated push
+            Script([b'', b'\x4c']),
+            # unknown opcode
+            Script([0xba, b'\x51']),
+        )
+        for script_sig in script_sigs:
+            tx = Tx.parse(BytesIO(raw))
+            tx.tx_ins[0].script_sig = script_sig
+            self.assertFalse(tx.verify())
+            self.assertFalse(tx.verify(batch=True))
+
+    def test_verify_bad_script_pubkey(self):
+        # outputs whose ScriptPubKey does not parse can be created, not spent
+        tx_in = TxIn(b'\x11' * 32, 0, Script([b'\x01']))
+        tx_in.prevout = (10000, b'\x4c')
+        tx = Tx(1, [tx_in], [TxOut(9000, p2sh_script(bytes(20)))], 0)
+        self.assertFalse(tx.verify_input(0))
+        self.assertFalse(tx.verify())
+        self.assertFalse(tx.verify(batch=True))
+
+    def test_verify_non_minimal_push(self):
+        key = PrivateKey(8675309)
+        # OP_1 OP_PUSHDATA1 <pubkey> OP_1 OP_CHECKMULTISIG, the pubkey would
+        # be re-encoded with a one byte push
+        redeem = b'\x51\x4c\x21' + key.point.sec() + b'\x51\xae'
+        self.assertNotEqual(Script(Script.parse_cmds(redeem)).raw_serialize(), redeem)
+        tx_in = TxIn(b'\x11' * 32, 0)
+        tx_in.prevout = (10000, p2sh_script(hash160(redeem)).raw_serialize())
+        tx = Tx(1, [tx_in], [TxOut(9000, p2sh_script(bytes(20)))], 0)
+        sig = key.sign(tx.sig_hash(0, Script(raw=redeem))).der() + b'\x01'
+        tx_in.script_sig = Script([b'', sig, redeem])
+        self.assertTrue(tx.verify())
+        self.assertTrue(tx.verify(batch=True))
+
+    def test_verify_hash_lock(self):
+        # a p2wsh hash lock, its WitnessScript looks like a p2sh ScriptPubKey
+        lock = Script([0xa9, hash160(b'hello'), 0x87]).raw_serialize()
+        tx_in = TxIn(b'\x11' * 32, 0, witness=[b'hello', lock])
+        tx_in.prevout = (10000, p2wsh_script(hashlib.sha256(lock).digest()).raw_serialize())
+        tx = Tx(1, [tx_in], [TxOut(9000, p2sh_script(bytes(20)))], 0, segwit=True)
+        self.assertTrue(tx.verify())
+        tx_in.witness = [b'goodbye', lock]
+        self.assertFalse(tx.verify())
+
+    def test_verify_many(self):
+        tx_ids = (
+            '452c629d67e41baec3ac6f04fe744b4b9617f8f859c63b3002f8684e7a4fee03',
+            '46df1a9484d0a81d03ce0ee543ab6e1a23ed06175c104a178268fad381216c2b',
+            'c586389e5e4b3acb9d6c8be1c19ae8ab2795397633176f5a6442a261bbdefc3a',
+        )
+        txs = [TxFetcher.fetch(tx_id) for tx_id in tx_ids]
+        self.assertIsNone(verify_many(txs, max_workers=2, chunk_size=1))
+        self.assertTrue(txs[1].verify(parallel=True, max_workers=2))
+        bad = Tx.parse(BytesIO(txs[1].serialize()))
+        bad.locktime += 1
+        self.assertEqual(verify_many(txs[:1] + [bad] + txs[2:], max_workers=2), (1, 0))
+        # a block starts with a coinbase, which spends nothing
+        coinbase = Tx(1, [TxIn(b'\x00' * 32, 0xffffffff, Script([b'\x00' * 4]))], [TxOut(50 * 10 ** 8, Script([0x51]))], 0)
+        self.assertTrue(coinbase.verify())
+        self.assertIsNone(verify_many([coinbase] + txs, executor=InlineExecutor()))
+        self.assertEqual(verify_many([coinbase, bad], executor=InlineExecutor()), (1, 0))
+
+    def test_verify_many_stops_early(self):
+        tx_ids = (
+            '452c629d67e41baec3ac6f04fe744b4b9617f8f859c63b3002f8684e7a4fee03',
+            '46df1a9484d0a81d03ce0ee543ab6e1a23ed06175c104a178268fad381216c2b',
+            'c586389e5e4b3acb9d6c8be1c19ae8ab2795397633176f5a6442a261bbdefc3a',
+        )
+        txs = [TxFetcher.fetch(tx_id) for tx_id in tx_ids]
+        # a signature that is not DER fails in the worker
+        bad = Tx.parse(BytesIO(txs[0].serialize()))
+        bad.tx_ins[0].script_sig.cmds[0] = b'\x30\x00\x01'
+        executor = InlineExecutor()
+        self.assertEqual(verify_many([bad] + txs[1:], chunk_size=1, executor=executor), (0, 0))
+        # the first chunk came back invalid before anything else was sent
+        self.assertEqual(executor.submitted, 1)
+
+    def test_footprint(self):
+        with open(self.cache_file) as f:
+            raws = [bytes.fromhex(raw_hex) for raw_hex in json.load(f).values()] * 10
+        tracemalloc.start()
+        try:
+            before = tracemalloc.get_traced_memory()[0]
+            txs = [Tx.parse(BytesIO(raw)) for raw in raws]
+            used = tracemalloc.get_traced_memory()[0] - before
+        finally:
+            tracemalloc.stop()
+        tx = txs[0]
+        for obj in (tx, tx.tx_ins[0], tx.tx_outs[0], tx.tx_ins[0].script_sig):
+            self.assertFalse(hasattr(obj, '__dict__'))
+        # scripts are only split into cmds when they are used
+        self.assertIsNone(tx.tx_ins[0].script_sig._cmds)
+        # only the Tx keeps a serialization, the inputs and outputs do not
+        self.assertFalse(hasattr(tx.tx_ins[0], '_raw'))
+        self.assertFalse(hasattr(tx.tx_outs[0], '_raw'))
+        # the transactions, their scripts and the serialization, about 5.5
+        # times the serialized size
+        serialized = sum(len(raw) for raw in raws)
+        self.assertLess(used / len(txs), 8000)
+        self.assertLess(used / serialized, 6)
+
+
+class TxServer(BaseHTTPRequestHandler):
+    """Serves /tx/<id>/hex out of the tx.cache file"""
+    txs = {}
+    requests = []
+    # number of requests to answer with a 503 before serving
+    failures = 0
+    delay = 0
+
+    def do_GET(self):
+        TxServer.requests.append(self.path)
+        time.sleep(self.delay)
+        tx_id = self.path.split('/')[-2]
+        if TxServer.failures > 0:
+            TxServer.failures -= 1
+            self.send_response(503)
+            self.end_headers()
+        elif tx_id in self.txs:
+            body = self.txs[tx_id].encode()
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        else:
+            self.send_response(404)
+            self.send_header('Content-Length', '9')
+            self.end_headers()
+            self.wfile.write(b'not found')
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TxFetcherTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        with open(TxTest.cache_file) as f:
+            TxServer.txs = json.load(f)
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), TxServer)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.saved = TxFetcher.cache, TxFetcher.mainnet_url, TxFetcher.backoff
+        TxFetcher.cache = TxCache()
+        TxFetcher.mainnet_url = 'http://127.0.0.1:{}/'.format(self.server.server_address[1])
+        TxFetcher.backoff = 0.01
+        TxServer.requests = []
+        TxServer.failures = 0
+        TxServer.delay = 0
+
+    def tearDown(self):
+        TxFetcher.cache, TxFetcher.mainnet_url, TxFetcher.backoff = self.saved
+
+    def test_fetch_many(self):
+        tx_ids = sorted(TxServer.txs)[:6]
+        txs = TxFetcher.fetch_many(tx_ids)
+        self.assertEqual([tx.id() for tx in txs], tx_ids)
+        self.assertEqual(len(TxServer.requests), 6)
+        TxFetcher.fetch_many(tx_ids)
+        self.assertEqual(len(TxServer.requests), 6)
+
+    def test_coalesce(self):
+        TxServer.delay = 0.2
+        tx_id = sorted(TxServer.txs)[0]
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(TxFetcher.fetch(tx_id))) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(TxServer.requests), 1)
+        self.assertEqual(len(results), 5)
+        self.assertTrue(all(tx is results[0] for tx in results))
+
+    def test_retry(self):
+        TxServer.failures = 2
+        tx_id = sorted(TxServer.txs)[0]
+        self.assertEqual(TxFetcher.fetch(tx_id).id(), tx_id)
+        self.assertEqual(len(TxServer.requests), 3)
+        with self.assertRaises(ValueError):
+            TxFetcher.fetch('00' * 32)
+
+
+class TxCacheTest(TestCase):
+    def test_lru(self):
+        with open(TxTest.cache_file) as f:
+            raws = [bytes.fromhex(raw_hex) for raw_hex in json.load(f).values()]
+        txs = [Tx.parse(BytesIO(raw)) for raw in raws[:4]]
+        cache = TxCache(max_entries=3)
+        for tx in txs:
+            cache.put(tx.id(), tx)
+        self.assertEqual(len(cache), 3)
+        self.assertIsNone(cache.get(txs[0].id()))
+        self.assertIs(cache.get(txs[1].id()), txs[1])
+        self.assertIsNone(cache.get(txs[1].id(), testnet=True))
+        cache.put(txs[0].id(), txs[0])
+        # txs[1] was used last, so txs[2] was evicted
+        self.assertIsNone(cache.get(txs[2].id()))
+        self.assertEqual(cache.stats(), {
+            'entries': 3, 'bytes': sum(len(txs[i].serialize()) for i in (0, 1, 3)),
+            'hits': 1, 'misses': 3, 'evictions': 2,
+        })
+
+    def test_raw(self):
+        with open(TxTest.cache_file) as f:
+            raws = [bytes.fromhex(raw_hex) for raw_hex in json.load(f).values()]
+        cache = TxCache(max_bytes=len(raws[1]) + len(raws[2]), store_raw=True)
+        for raw in raws[:3]:
+            tx = Tx.parse(BytesIO(raw))
+            cache.put(tx.id(), tx, testnet=True)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.bytes, len(raws[1]) + len(raws[2]))
+        tx = cache.get(Tx.parse(BytesIO(raws[2])).id(), testnet=True)
+        self.assertEqual(tx.serialize(), raws[2])
+        self.assertTrue(tx.testnet)
+        self.assertIsNot(tx, cache.get(tx.id(), testnet=True))
+
+    def test_load_cache(self):
+        old_cache = TxFetcher.cache
+        TxFetcher.cache = cache = TxCache()
+        try:
+            TxFetcher.load_cache(TxTest.cache_file)
+            # nothing is parsed and both networks share the bytes
+            entries = cache._entries
+            for (testnet, tx_id), (value, _) in entries.items():
+                self.assertIsInstance(value, bytes)
+                if not testnet:
+                    self.assertIs(entries[(True, tx_id)][0], value)
+            tx_id = '452c629d67e41baec3ac6f04fe744b4b9617f8f859c63b3002f8684e7a4fee03'
+            tx = cache.get(tx_id)
+            self.assertEqual(tx.id(), tx_id)
+            self.assertFalse(tx.testnet)
+            self.assertIs(cache.get(tx_id), tx)
+            self.assertTrue(cache.get(tx_id, testnet=True).testnet)
+        finally:
+            TxFetcher.cache = old_cache
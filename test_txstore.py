@@ -0,0 +1,83 @@
+import json
+import os
+import tempfile
+from io import BytesIO
+from unittest import TestCase
+
+from tx import Tx, TxCache, TxFetcher
+from txstore import TxStore
+
+
+class TxStoreTest(TestCase):
+    cache_file = 'tx.cache'
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.dir.name, 'tx.store')
+        with open(self.cache_file) as f:
+            self.raws = {tx_id: bytes.fromhex(raw_hex) for tx_id, raw_hex in json.load(f).items()}
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_import_json(self):
+        with TxStore(self.filename) as store:
+            self.assertEqual(store.import_json(self.cache_file), len(self.raws))
+            self.assertEqual(store.import_json(self.cache_file), 0)
+        with TxStore(self.filename) as store:
+            self.assertEqual(len(store), len(self.raws))
+            self.assertEqual(sorted(store.ids()), sorted(self.raws))
+            for tx_id, raw in self.raws.items():
+                self.assertIn(tx_id, store)
+                self.assertEqual(store.raw(tx_id), raw)
+                tx = store.get(tx_id, testnet=True)
+                self.assertEqual(tx.id(), tx_id)
+                self.assertTrue(tx.testnet)
+                self.assertEqual(store.view(tx_id).id(), tx_id)
+            self.assertIsNone(store.get('00' * 32))
+            self.assertNotIn('00' * 32, store)
+
+    def test_append(self):
+        tx_ids = sorted(self.raws)
+        with TxStore(self.filename) as store:
+            tx = Tx.parse(BytesIO(self.raws[tx_ids[0]]))
+            self.assertEqual(store.put(tx), tx_ids[0])
+            self.assertEqual(store.get(tx_ids[0]).id(), tx_ids[0])
+            # reading maps the file, later appends have to be remapped
+            store.put_raw(self.raws[tx_ids[1]])
+            self.assertEqual(store.raw(tx_ids[1]), self.raws[tx_ids[1]])
+            size = os.path.getsize(self.filename)
+            store.put(tx)
+            self.assertEqual(os.path.getsize(self.filename), size)
+
+    def test_recover(self):
+        tx_ids = sorted(self.raws)[:3]
+        with TxStore(self.filename) as store:
+            store.put_raw(self.raws[tx_ids[0]])
+        # a transaction the index never heard of and half of another one
+        with open(self.filename, 'ab') as f:
+            f.write(self.raws[tx_ids[1]])
+            f.write(self.raws[tx_ids[2]][:50])
+        with open(self.filename + '.idx', 'ab') as f:
+            f.write(b'\x00' * 7)
+        with TxStore(self.filename) as store:
+            self.assertEqual(sorted(store.ids()), tx_ids[:2])
+            self.assertEqual(store.raw(tx_ids[1]), self.raws[tx_ids[1]])
+            store.put_raw(self.raws[tx_ids[2]])
+        with TxStore(self.filename) as store:
+            self.assertEqual(sorted(store.ids()), tx_ids)
+            self.assertEqual(store.raw(tx_ids[2]), self.raws[tx_ids[2]])
+
+    def test_fetcher(self):
+        saved = TxFetcher.cache, TxFetcher.store, TxFetcher.mainnet_url
+        try:
+            TxFetcher.cache = TxCache()
+            TxFetcher.store = TxStore(self.filename)
+            TxFetcher.store.import_json(self.cache_file)
+            # nothing listens there, everything has to come from the store
+            TxFetcher.mainnet_url = 'http://127.0.0.1:1/'
+            tx_ids = sorted(self.raws)[:4]
+            self.assertEqual([tx.id() for tx in TxFetcher.fetch_many(tx_ids)], tx_ids)
+            TxFetcher.store.close()
+        finally:
+            TxFetcher.cache, TxFetcher.store, TxFetcher.mainnet_url = saved
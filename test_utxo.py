@@ -0,0 +1,69 @@
+import json
+from io import BytesIO
+from unittest import TestCase
+
+from tx import Tx, TxCache, TxFetcher, TxIn, TxView
+from utxo import UtxoSet
+
+
+class UtxoSetTest(TestCase):
+    cache_file = 'tx.cache'
+
+    def setUp(self):
+        with open(self.cache_file) as f:
+            self.raws = [bytes.fromhex(raw_hex) for raw_hex in json.load(f).values()]
+        self.txs = [Tx.parse(BytesIO(raw)) for raw in self.raws]
+
+    def test_add(self):
+        utxo_set = UtxoSet()
+        utxo_set.update(self.txs)
+        views = UtxoSet()
+        views.update(TxView(raw) for raw in self.raws)
+        self.assertEqual(utxo_set.outputs, views.outputs)
+        tx = self.txs[0]
+        self.assertEqual(utxo_set.amount(tx.hash(), 0), tx.tx_outs[0].amount)
+        self.assertEqual(utxo_set.get(tx.hash(), 0),
+                         (tx.tx_outs[0].amount, tx.tx_outs[0].script_pubkey.raw_serialize()))
+        self.assertEqual(utxo_set.script_pubkey(tx.hash(), 0).cmds, tx.tx_outs[0].script_pubkey.cmds)
+        self.assertIsNone(utxo_set.get(tx.hash(), len(tx.tx_outs)))
+        # spending removes the output
+        spend = Tx(1, [TxIn(tx.hash(), 0)], [], 0)
+        utxo_set.add(spend)
+        self.assertNotIn((tx.hash(), 0), utxo_set)
+        missing = utxo_set.missing
+        utxo_set.add(spend)
+        self.assertEqual(utxo_set.missing, missing + 1)
+
+    def test_rollback(self):
+        utxo_set = UtxoSet()
+        utxo_set.update(self.txs[:5])
+        before = dict(utxo_set.outputs)
+        tx = self.txs[0]
+        undo = []
+        for later in self.txs[5:] + [Tx(1, [TxIn(tx.hash(), 0)], [], 0)]:
+            utxo_set.add(later, undo)
+        self.assertNotEqual(utxo_set.outputs, before)
+        utxo_set.rollback(undo)
+        self.assertEqual(utxo_set.outputs, before)
+        self.assertEqual(undo, [])
+
+    def test_fee(self):
+        by_hash = {tx.hash(): tx for tx in self.txs}
+        # the transactions whose inputs all spend transactions we have
+        txs = [tx for tx in self.txs if all(tx_in.prev_tx in by_hash for tx_in in tx.tx_ins)]
+        self.assertTrue(txs)
+        saved = TxIn.utxo_set, TxFetcher.cache, TxFetcher.mainnet_url
+        try:
+            TxFetcher.cache = TxCache()
+            # nothing listens there, fetching would fail
+            TxFetcher.mainnet_url = 'http://127.0.0.1:1/'
+            for tx in txs:
+                TxIn.utxo_set = UtxoSet()
+                TxIn.utxo_set.update(by_hash[tx_in.prev_tx] for tx_in in tx.tx_ins)
+                input_sum = sum(by_hash[tx_in.prev_tx].tx_outs[tx_in.prev_index].amount for tx_in in tx.tx_ins)
+                self.assertEqual(tx.fee(), input_sum - sum(tx_out.amount for tx_out in tx.tx_outs))
+                tx_in = tx.tx_ins[0]
+                self.assertEqual(tx_in.script_pubkey().raw_serialize(),
+                                 by_hash[tx_in.prev_tx].tx_outs[tx_in.prev_index].script_pubkey.raw_serialize())
+        finally:
+            TxIn.utxo_set, TxFetcher.cache, TxFetcher.mainnet_url = saved
@@ -1,79 +1,302 @@
+import hashlib
 import json
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import (
+    Future,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+)
 from io import BytesIO
+from logging import getLogger
 
 import requests
+from requests.adapters import HTTPAdapter
 
 from helper import (
     encode_varint,
     hash256,
     int_to_little_endian,
-    little_endian_to_int, read_varint,
+    little_endian_to_int,
+    read_varint,
+    read_varint_at,
+    read_varint_rest,
+)
+from ecc import (
+    S256Point,
+    Signature,
+    SignatureBatch,
 )
-from script import Script
+from script import (
+    p2pkh_script,
+    Script,
+)
+
+
+LOGGER = getLogger(__name__)
+
+SIGHASH_ALL = 1
+
+
+class TxCache:
+    """Least recently used cache of transactions keyed by (testnet, tx_id)
+    that can be shared between threads.
+    It holds at most max_entries transactions and max_bytes of serialized
+    transactions, None means no limit. With store_raw only the serialized
+    bytes are kept and every get parses a new Tx, which takes much less
+    memory and never hands out the same object twice.
+    """
+
+    def __init__(self, max_entries=10000, max_bytes=100 * 1024 * 1024, store_raw=False):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.store_raw = store_raw
+        # (testnet, tx_id) -> (Tx or raw bytes, serialized size)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, tx_id, testnet=False):
+        """Returns the cached Tx or None"""
+        key = (testnet, tx_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        value, size = entry
+        if not isinstance(value, bytes):
+            return value
+        tx = Tx.parse(BytesIO(value), testnet=testnet)
+        if not self.store_raw:
+            # added with put_raw, keep the parsed Tx from now on
+            with self._lock:
+                if self._entries.get(key) is entry:
+                    self._entries[key] = (tx, size)
+        return tx
+
+    def put(self, tx_id, tx, testnet=False):
+        raw = tx.serialize()
+        self._put((testnet, tx_id), raw if self.store_raw else tx, len(raw))
+
+    def put_raw(self, tx_id, raw, testnet=False):
+        """Adds a serialized transaction, which is only parsed when it is
+        asked for
+        """
+        self._put((testnet, tx_id), bytes(raw), len(raw))
+
+    def _put(self, key, value, size):
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.bytes -= old[1]
+            self._entries[key] = (value, size)
+            self.bytes += size
+            while (self.max_entries is not None and len(self._entries) > self.max_entries) \
+                    or (self.max_bytes is not None and self.bytes > self.max_bytes and len(self._entries) > 1):
+                _, (_, size) = self._entries.popitem(last=False)
+                self.bytes -= size
+                self.evictions += 1
+
+    def items(self):
+        """Returns a list of ((testnet, tx_id), Tx) pairs"""
+        with self._lock:
+            entries = list(self._entries.items())
+        return [
+            (key, Tx.parse(BytesIO(value), testnet=key[0]) if isinstance(value, bytes) else value)
+            for key, (value, _) in entries
+        ]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        return {
+            'entries': len(self._entries),
+            'bytes': self.bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
 
 
 class TxFetcher:
-    cache = {}
+    cache = TxCache()
+    # a txstore.TxStore to look in before downloading, downloaded
+    # transactions are added to it
+    store = None
+    # the api base urls, point these somewhere else to use another server
+    mainnet_url = 'https://blockstream.info/api/'
+    testnet_url = 'https://blockstream.info/testnet/api/'
+    # seconds to wait for a response
+    timeout = 10
+    # extra attempts after a connection error, timeout or 5xx/429 response,
+    # waiting backoff, 2 * backoff, 4 * backoff ... seconds in between
+    retries = 3
+    backoff = 0.5
+    # most requests fetch_many runs at the same time
+    max_workers = 8
+    _session = None
+    _executor = None
+    # downloads in progress, (testnet, tx_id) -> Future
+    _pending = {}
+    _lock = threading.Lock()
 
     @classmethod
     def get_url(cls, testnet=False):
         if testnet:
-            return 'https://blockstream.info/testnet/api/'
+            return cls.testnet_url
         else:
-            return 'https://blockstream.info/api/'
+            return cls.mainnet_url
+
+    @classmethod
+    def session(cls):
+        """The keep-alive session shared by every request"""
+        with cls._lock:
+            if cls._session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=2, pool_maxsize=cls.max_workers)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                cls._session = session
+            return cls._session
 
     @classmethod
     def fetch(cls, tx_id, testnet=False, fresh=False):
-        if fresh or (tx_id not in cls.cache):
-            url = '{}/tx/{}/hex'.format(cls.get_url(testnet), tx_id)
-            response = requests.get(url)
+        if not fresh:
+            tx = cls.cache.get(tx_id, testnet)
+            if tx is not None:
+                return tx
+        # concurrent fetches of the same transaction share one download
+        key = (testnet, tx_id)
+        with cls._lock:
+            future = cls._pending.get(key)
+            downloading = future is None
+            if downloading:
+                future = cls._pending[key] = Future()
+        if not downloading:
+            return future.result()
+        try:
+            tx = None
+            if cls.store is not None and not fresh:
+                tx = cls.store.get(tx_id, testnet)
+            if tx is None:
+                tx = cls._download(tx_id, testnet)
+                if cls.store is not None:
+                    cls.store.put(tx)
+            cls.cache.put(tx_id, tx, testnet)
+            future.set_result(tx)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with cls._lock:
+                del cls._pending[key]
+        return tx
+
+    @classmethod
+    def fetch_many(cls, tx_ids, testnet=False, fresh=False):
+        """Fetches transactions max_workers at a time.
+        Returns the transactions in the same order as tx_ids.
+        """
+        tx_ids = list(tx_ids)
+        missing = set(tx_id for tx_id in tx_ids if fresh or (testnet, tx_id) not in cls.cache)
+        if len(missing) > 1:
+            with cls._lock:
+                if cls._executor is None:
+                    cls._executor = ThreadPoolExecutor(max_workers=cls.max_workers)
+                executor = cls._executor
+            futures = [executor.submit(cls.fetch, tx_id, testnet, fresh) for tx_id in missing]
+            for future in futures:
+                future.result()
+            fresh = False
+        return [cls.fetch(tx_id, testnet=testnet, fresh=fresh) for tx_id in tx_ids]
+
+    @classmethod
+    def _download(cls, tx_id, testnet):
+        url = '{}/tx/{}/hex'.format(cls.get_url(testnet).rstrip('/'), tx_id)
+        attempt = 0
+        while True:
             try:
-                raw = bytes.fromhex(response.text.strip())
-            except ValueError:
-                raise ValueError('unexpected response: {}'.format(response.text))
-            if raw[4] == 0:
-                raw = raw[:4] + raw[6:]
-                tx = Tx.parse(BytesIO(raw), testnet=testnet)
-                tx.locktime = little_endian_to_int(raw[-4:])
-            else:
-                tx = Tx.parse(BytesIO(raw), testnet=testnet)
-            if tx.id() != tx_id:
-                raise ValueError('not the same id: {} vs {}'.format(tx.id(),
-                                                                    tx_id))
-            cls.cache[tx_id] = tx
-        cls.cache[tx_id].testnet = testnet
-        return cls.cache[tx_id]
+                response = cls.session().get(url, timeout=cls.timeout)
+                if response.status_code == 429 or response.status_code >= 500:
+                    raise requests.HTTPError('{} from {}'.format(response.status_code, url), response=response)
+                break
+            except requests.RequestException as e:
+                if attempt >= cls.retries:
+                    raise
+                LOGGER.info('retrying {}: {}'.format(url, e))
+                time.sleep(cls.backoff * 2 ** attempt)
+                attempt += 1
+        try:
+            raw = bytes.fromhex(response.text.strip())
+        except ValueError:
+            raise ValueError('unexpected response: {}'.format(response.text))
+        tx = Tx.parse(BytesIO(raw), testnet=testnet)
+        if tx.id() != tx_id:
+            raise ValueError('not the same id: {} vs {}'.format(tx.id(),
+                                                                tx_id))
+        return tx
 
     @classmethod
-    def load_cache(cls, filename):
-        f = open(filename, 'r')
-        disk_cache = json.loads(f.read())
+    def load_cache(cls, filename, testnet=None):
+        """Loads a JSON cache written by dump_cache. The file does not say
+        which network the transactions are from, by default they are loaded
+        for both. Nothing is parsed until it is fetched, and both networks
+        share the same bytes.
+        """
+        with open(filename, 'r') as f:
+            disk_cache = json.loads(f.read())
+        networks = (False, True) if testnet is None else (testnet,)
         for k, raw_hex in disk_cache.items():
             raw = bytes.fromhex(raw_hex)
-            if raw[4] == 0:
-                raw = raw[:4] + raw[6:]
-                tx = Tx.parse(BytesIO(raw))
-                tx.locktime = little_endian_to_int(raw[-4:])
-            else:
-                tx = Tx.parse(BytesIO(raw))
-            cls.cache[k] = tx
-        f.close()
+            for network in networks:
+                cls.cache.put_raw(k, raw, network)
 
     @classmethod
     def dump_cache(cls, filename):
         with open(filename, 'w') as f:
-            to_dump = {k: tx.serialize().hex() for k, tx in cls.cache.items()}
+            to_dump = {tx_id: tx.serialize().hex() for (_, tx_id), tx in cls.cache.items()}
             s = json.dumps(to_dump, sort_keys=True, indent=4)
             f.write(s)
 
+
 class Tx:
+    __slots__ = (
+        'version', 'tx_ins', 'tx_outs', 'locktime', 'testnet', 'segwit',
+        '_key', '_raw', '_hash', '_witness_key', '_witness_raw', '_whash', '_sig_hasher',
+    )
 
-    def __init__(self, version, tx_ins, tx_outs, locktime, testnet=False):
+    def __init__(self, version, tx_ins, tx_outs, locktime, testnet=False, segwit=False):
         self.version = version
         self.tx_ins = tx_ins
         self.tx_outs = tx_outs
         self.locktime = locktime
         self.testnet = testnet
+        self.segwit = segwit
+        # serialization caches, a _key is what the serialization next to it
+        # was built from
+        self._key = None
+        self._raw = None
+        self._hash = None
+        self._witness_key = None
+        self._witness_raw = None
+        self._whash = None
+        self._sig_hasher = None
 
     def __repr__(self):
         tx_ins = ''
@@ -96,15 +319,46 @@ class Tx:
 
     def hash(self):
         """Binary hash of the legacy serialization"""
-        return hash256(self.serialize())[::-1]
+        raw = self.serialize_legacy()
+        if self._hash is None:
+            self._hash = hash256(raw)[::-1]
+        return self._hash
+
+    def wtxid(self):
+        """Human-readable hexadecimal of the witness transaction hash"""
+        return self.whash().hex()
+
+    def whash(self):
+        """Binary hash of the serialization including witness data.
+        Same as hash for transactions without witnesses.
+        """
+        if not self.segwit:
+            return self.hash()
+        raw = self.serialize_segwit()
+        if self._whash is None:
+            self._whash = hash256(raw)[::-1]
+        return self._whash
 
     @classmethod
     def parse(cls, s, testnet=False):
         """Takes a byte stream and parses the transaction at the start
         return a Tx object
         """
+        # the bytes read are kept as the serialization when they can be read
+        # again, otherwise it is put together the first time it is needed
+        seekable = getattr(s, 'seekable', None)
+        start = s.tell() if seekable is not None and seekable() else None
         version = little_endian_to_int(s.read(4))
-        num_inputs = read_varint(s)
+        # segwit transactions have a 0 marker where the number of inputs
+        # would be, followed by a flag
+        marker = s.read(1)[0]
+        segwit = marker == 0
+        if segwit:
+            if s.read(1) != b'\x01':
+                raise SyntaxError('not a segwit transaction')
+            num_inputs = read_varint(s)
+        else:
+            num_inputs = read_varint_rest(marker, s)
         inputs = []
         for _ in range(num_inputs):
             inputs.append(TxIn.parse(s))
@@ -112,23 +366,88 @@ class Tx:
         outputs = []
         for _ in range(num_outputs):
             outputs.append(TxOut.parse(s))
+        if segwit:
+            witness_start = s.tell() if start is not None else None
+            for tx_in in inputs:
+                num_items = read_varint(s)
+                tx_in.witness = [s.read(read_varint(s)) for _ in range(num_items)]
         locktime = little_endian_to_int(s.read(4))
-        return cls(version, inputs, outputs, locktime, testnet=testnet)
+        tx = cls(version, inputs, outputs, locktime, testnet=testnet, segwit=segwit)
+        if start is not None:
+            end = s.tell()
+            s.seek(start)
+            raw = s.read(end - start)
+            if segwit:
+                # leave out the marker, flag and witnesses
+                view = memoryview(raw)
+                raw = b''.join((view[:4], view[6:witness_start - start], view[-4:]))
+            tx._raw = raw
+            tx._key = tx._serialize_key()
+        return tx
 
     def serialize(self):
-        """Returns the byte serialization of the transaction"""
-        result = int_to_little_endian(self.version, 4)
-        result += encode_varint(len(self.tx_ins))
-        for tx_in in self.tx_ins:
-            result += tx_in.serialize()
-        result += encode_varint(len(self.tx_outs))
-        for tx_out in self.tx_outs:
-            result += tx_out.serialize()
-        result += int_to_little_endian(self.locktime, 4)
-        return result
+        """Returns the byte serialization of the transaction, with the
+        witness data if it is a segwit transaction
+        """
+        if self.segwit:
+            return self.serialize_segwit()
+        return self.serialize_legacy()
+
+    def _serialize_key(self):
+        # the inputs and outputs do not keep serializations of their own,
+        # the fields they are built from are compared instead
+        tx_ins = [tx_in._serialize_key() for tx_in in self.tx_ins]
+        tx_outs = [tx_out._serialize_key() for tx_out in self.tx_outs]
+        return self.version, tx_ins, tx_outs, self.locktime
+
+    def serialize_legacy(self):
+        """Returns the serialization without witness data, which is what the
+        txid commits to. The result is cached until a field, input or output
+        changes.
+        """
+        key = self._serialize_key()
+        if key != self._key:
+            result = [int_to_little_endian(self.version, 4), encode_varint(len(self.tx_ins))]
+            result += [tx_in.serialize() for tx_in in self.tx_ins]
+            result.append(encode_varint(len(self.tx_outs)))
+            result += [tx_out.serialize() for tx_out in self.tx_outs]
+            result.append(int_to_little_endian(self.locktime, 4))
+            self._raw = b''.join(result)
+            self._key = key
+            self._hash = None
+        return self._raw
+
+    def serialize_segwit(self):
+        """Returns the serialization with the marker, flag and witness data.
+        Cached like serialize_legacy.
+        """
+        legacy = self.serialize_legacy()
+        key = (legacy, [tuple(tx_in.witness) for tx_in in self.tx_ins])
+        if key != self._witness_key:
+            # the legacy serialization already has everything but the
+            # witnesses, which go right before the locktime
+            result = [legacy[:4], b'\x00\x01', legacy[4:-4]]
+            result += [tx_in.serialize_witness() for tx_in in self.tx_ins]
+            result.append(legacy[-4:])
+            self._witness_raw = b''.join(result)
+            self._witness_key = key
+            self._whash = None
+        return self._witness_raw
+
+    def is_coinbase(self):
+        """Returns whether this transaction is a coinbase transaction"""
+        if len(self.tx_ins) != 1:
+            return False
+        first_input = self.tx_ins[0]
+        return first_input.prev_tx == b'\x00' * 32 and first_input.prev_index == 0xffffffff
 
     def fee(self, testnet=False):
         """Returns the fee of this transaction in satoshi"""
+        # fetch the previous transactions the UTXO set does not know about
+        # all at once
+        missing = set(tx_in.prev_tx.hex() for tx_in in self.tx_ins if tx_in.utxo(testnet) is None)
+        if missing:
+            TxFetcher.fetch_many(missing, testnet=testnet)
         input_sum, output_sum = 0, 0
         for tx_in in self.tx_ins:
             input_sum += tx_in.value(testnet=testnet)
@@ -136,9 +455,267 @@ class Tx:
             output_sum += tx_out.amount
         return input_sum - output_sum
 
+    def sig_hasher(self):
+        """Returns the SigHasher for the current state of the transaction"""
+        raw = self.serialize_legacy()
+        if self._sig_hasher is None or self._sig_hasher.raw is not raw:
+            self._sig_hasher = SigHasher(self)
+        return self._sig_hasher
+
+    def sig_hash(self, input_index, redeem_script=None):
+        """Returns the integer representation of the hash that needs to get
+        signed for index input_index"""
+        if redeem_script is None:
+            script_code = self.tx_ins[input_index].script_pubkey(self.testnet)
+        else:
+            script_code = redeem_script
+        return self.sig_hasher().legacy(input_index, script_code.serialize())
+
+    def sig_hash_bip143(self, input_index, redeem_script=None, witness_script=None):
+        """Returns the integer representation of the hash that needs to get
+        signed for index input_index of a segwit input"""
+        tx_in = self.tx_ins[input_index]
+        if witness_script is not None:
+            script_code = witness_script.serialize()
+        elif redeem_script is not None:
+            script_code = p2pkh_script(redeem_script.cmds[1]).serialize()
+        else:
+            script_code = p2pkh_script(tx_in.script_pubkey(self.testnet).cmds[1]).serialize()
+        return self.sig_hasher().bip143(input_index, script_code, tx_in.value(self.testnet))
+
+    def verify_input(self, input_index, batch=None):
+        """Returns whether the input has a valid signature.
+        With a SignatureBatch the signature checks are only collected, see
+        Script.evaluate.
+        """
+        tx_in = self.tx_ins[input_index]
+        try:
+            script_pubkey = tx_in.script_pubkey(testnet=self.testnet)
+            return self._evaluate_input(input_index, tx_in, script_pubkey, batch)
+        except (ValueError, SyntaxError) as e:
+            # over a ScriptLimit, or a script that does not parse
+            LOGGER.info('input {}: {}'.format(input_index, e))
+            return False
+
+    def _evaluate_input(self, input_index, tx_in, script_pubkey, batch):
+        redeem_script = None
+        # the witness program, if the output is one
+        program = script_pubkey
+        if script_pubkey.is_p2sh_script_pubkey():
+            # the last cmd of the ScriptSig is the RedeemScript
+            script_sig = tx_in.script_sig.cmds
+            if not script_sig or type(script_sig[-1]) == int:
+                LOGGER.info('input {}: no RedeemScript'.format(input_index))
+                return False
+            # keep the bytes as they are, the signature hash commits to them
+            redeem_script = program = Script(raw=bytes(script_sig[-1]))
+        witness = tx_in.witness
+        if program.is_p2wpkh_script_pubkey() or program.is_p2wsh_script_pubkey():
+            # a native program needs an empty ScriptSig, a nested one a
+            # ScriptSig of only the RedeemScript
+            if redeem_script is None:
+                bad_script_sig = len(tx_in.script_sig.raw_serialize()) != 0
+            else:
+                bad_script_sig = len(tx_in.script_sig.cmds) != 1
+            if bad_script_sig:
+                LOGGER.info('input {}: bad ScriptSig for a witness program'.format(input_index))
+                return False
+            if program.is_p2wpkh_script_pubkey():
+                if len(witness) != 2:
+                    LOGGER.info('input {}: bad p2wpkh witness'.format(input_index))
+                    return False
+                z = self.sig_hash_bip143(input_index, redeem_script)
+            else:
+                if not witness:
+                    LOGGER.info('input {}: empty p2wsh witness'.format(input_index))
+                    return False
+                witness_script = Script(raw=bytes(witness[-1]))
+                z = self.sig_hash_bip143(input_index, witness_script=witness_script)
+        else:
+            if witness:
+                LOGGER.info('input {}: witness for an output without a program'.format(input_index))
+                return False
+            witness = None
+            z = self.sig_hash(input_index, redeem_script)
+        combined = tx_in.script_sig + script_pubkey
+        return combined.evaluate(z, witness, batch=batch)
+
+    def verify(self, batch=False, parallel=False, max_workers=None):
+        """Verify this transaction.
+        With batch the signature checks of all inputs are run together once
+        the scripts of every input have been evaluated.
+        With parallel the signature checks are spread over max_workers
+        processes, see verify_many.
+        A coinbase spends nothing, so there is nothing to verify.
+        """
+        if self.is_coinbase():
+            return True
+        if parallel:
+            return verify_many([self], max_workers=max_workers) is None
+        if self.fee(testnet=self.testnet) < 0:
+            return False
+        signatures = SignatureBatch() if batch else None
+        for i in range(len(self.tx_ins)):
+            if not self.verify_input(i, signatures):
+                return False
+        if signatures is not None:
+            return signatures.verify()
+        return True
+
+
+def _verify_signatures(checks):
+    """Verifies (sec, der, z) checks, this runs in the worker processes of
+    verify_many. Returns the position of the first invalid check or None.
+    """
+    for position, (sec, der, z) in enumerate(checks):
+        try:
+            point = S256Point.parse(sec)
+            sig = Signature.parse(der)
+        except (ValueError, SyntaxError):
+            return position
+        if not point.verify(z, sig):
+            return position
+    return None
+
+
+def _poll(running):
+    """Drops the finished chunks from running and returns whether one of
+    them found an invalid signature
+    """
+    failed = False
+    for future in [future for future in running if future.done()]:
+        running.remove(future)
+        if future.result() is not None:
+            failed = True
+    return failed
+
+
+def verify_many(txs, max_workers=None, chunk_size=64, executor=None):
+    """Verifies every input of every transaction, e.g. all of a block,
+    skipping the coinbase.
+    The scripts are evaluated here with the signature checks deferred, and
+    only the checks themselves (sec, der and z) go to a process pool in
+    chunks of chunk_size, while the following inputs are being evaluated.
+    Stops at the first failing script, or as soon as a finished chunk has
+    an invalid signature, and returns (tx index, input index) of the
+    earliest failing input, input index is None if the transaction spends
+    more than its inputs. Returns None if everything is valid.
+    A running concurrent.futures executor can be passed in to reuse it.
+    """
+    own_executor = executor is None
+    if own_executor:
+        executor = ProcessPoolExecutor(max_workers=max_workers)
+    # (tx index, input index) of every check that was sent out
+    owners = []
+    chunk = []
+    # (future, position of its first check in owners)
+    futures = []
+    # futures that had not finished when last looked at
+    running = []
+    failure = None
+    # a chunk came back with an invalid signature
+    failed = False
+    try:
+        for tx_index, tx in enumerate(txs):
+            if tx.is_coinbase():
+                continue
+            if tx.fee(testnet=tx.testnet) < 0:
+                failure = (tx_index, None)
+                break
+            for input_index in range(len(tx.tx_ins)):
+                batch = SignatureBatch()
+                if not tx.verify_input(input_index, batch):
+                    failure = (tx_index, input_index)
+                    break
+                for check in batch.checks:
+                    chunk.append(check)
+                    owners.append((tx_index, input_index))
+                if len(chunk) >= chunk_size:
+                    future = executor.submit(_verify_signatures, chunk)
+                    futures.append((future, len(owners) - len(chunk)))
+                    running.append(future)
+                    chunk = []
+                failed = _poll(running)
+                if failed:
+                    break
+            if failure is not None or failed:
+                break
+        if chunk and not failed:
+            futures.append((executor.submit(_verify_signatures, chunk), len(owners) - len(chunk)))
+        # the checks were sent out in order and all belong to inputs before
+        # any failure found above, so the first invalid one is the earliest
+        for i, (future, start) in enumerate(futures):
+            position = future.result()
+            if position is not None:
+                failure = owners[start + position]
+                for later, _ in futures[i + 1:]:
+                    later.cancel()
+                break
+    finally:
+        if own_executor:
+            executor.shutdown(wait=True)
+    return failure
+
+
+class SigHasher:
+    """Signature hashes (SIGHASH_ALL) for the inputs of one transaction.
+    Everything that is the same for every input is serialized or hashed
+    once, so hashing all the inputs does not re-serialize the transaction
+    for each of them.
+    """
+
+    def __init__(self, tx):
+        # the legacy serialization this was built from
+        self.raw = tx.serialize_legacy()
+        self.version = int_to_little_endian(tx.version, 4)
+        self.locktime = int_to_little_endian(tx.locktime, 4)
+        self.outpoints = [tx_in.prev_tx[::-1] + int_to_little_endian(tx_in.prev_index, 4) for tx_in in tx.tx_ins]
+        self.sequences = [int_to_little_endian(tx_in.sequence, 4) for tx_in in tx.tx_ins]
+        outputs = [tx_out.serialize() for tx_out in tx.tx_outs]
+        self.outputs = encode_varint(len(outputs)) + b''.join(outputs)
+        # legacy serialization with every ScriptSig emptied, the ScriptSig
+        # of input i goes at 3 + 3 * i
+        self.legacy_parts = [self.version, encode_varint(len(tx.tx_ins))]
+        for outpoint, sequence in zip(self.outpoints, self.sequences):
+            self.legacy_parts += [outpoint, b'\x00', sequence]
+        self.legacy_parts += [self.outputs, self.locktime, int_to_little_endian(SIGHASH_ALL, 4)]
+        # BIP143 hashes
+        self.hash_prevouts = hash256(b''.join(self.outpoints))
+        self.hash_sequence = hash256(b''.join(self.sequences))
+        self.hash_outputs = hash256(b''.join(outputs))
+
+    def legacy(self, input_index, script_code):
+        """Legacy signature hash of an input, script_code is the serialized
+        ScriptPubKey or RedeemScript"""
+        parts = self.legacy_parts[:]
+        parts[3 + 3 * input_index] = script_code
+        return int.from_bytes(hash256(b''.join(parts)), 'big')
+
+    def bip143(self, input_index, script_code, amount):
+        """BIP143 signature hash of an input spending amount satoshi"""
+        s = b''.join((
+            self.version,
+            self.hash_prevouts,
+            self.hash_sequence,
+            self.outpoints[input_index],
+            script_code,
+            int_to_little_endian(amount, 8),
+            self.sequences[input_index],
+            self.hash_outputs,
+            self.locktime,
+            int_to_little_endian(SIGHASH_ALL, 4),
+        ))
+        return int.from_bytes(hash256(s), 'big')
+
 
 class TxIn:
-    def __init__(self, prev_tx, prev_index, script_sig=None, sequence=0xffffffff):
+    __slots__ = (
+        'prev_tx', 'prev_index', 'script_sig', 'sequence', 'witness', 'prevout',
+    )
+    # a utxo.UtxoSet consulted before fetching previous transactions
+    utxo_set = None
+
+    def __init__(self, prev_tx, prev_index, script_sig=None, sequence=0xffffffff, witness=None):
         self.prev_tx = prev_tx
         self.prev_index = prev_index
         if script_sig is None:
@@ -146,6 +723,14 @@ class TxIn:
         else:
             self.script_sig = script_sig
         self.sequence = sequence
+        # list of witness stack items, the items are bytes-like
+        if witness is None:
+            self.witness = []
+        else:
+            self.witness = witness
+        # (amount, raw ScriptPubKey) of the spent output when it is already
+        # known, used before utxo_set and fetching
+        self.prevout = None
 
     def __repr__(self):
         return '{}:{}'.format(
@@ -164,21 +749,50 @@ class TxIn:
         sequence = little_endian_to_int(s.read(4))
         return cls(prev_tx, prev_index, script_sig, sequence)
 
+    def _serialize_key(self):
+        # what the serialization is built from, Tx caches it by this
+        return self.prev_tx, self.prev_index, self.script_sig.raw_serialize(), self.sequence
+
     def serialize(self):
         """Returns the byte serialization of the transaction input"""
-        result = self.prev_tx[::-1]
-        result += int_to_little_endian(self.prev_index, 4)
-        result += self.script_sig.serialize()
-        result += int_to_little_endian(self.sequence, 4)
-        return result
+        prev_tx, prev_index, script_sig, sequence = self._serialize_key()
+        return b''.join((
+            prev_tx[::-1],
+            int_to_little_endian(prev_index, 4),
+            encode_varint(len(script_sig)),
+            script_sig,
+            int_to_little_endian(sequence, 4),
+        ))
+
+    def serialize_witness(self):
+        """Returns the byte serialization of the witness of this input"""
+        result = [encode_varint(len(self.witness))]
+        for item in self.witness:
+            result.append(encode_varint(len(item)))
+            result.append(item)
+        return b''.join(result)
 
     def fetch_tx(self, testnet=False):
         return TxFetcher.fetch(self.prev_tx.hex(), testnet=testnet)
 
+    def utxo(self, testnet=False):
+        """Returns (amount, raw ScriptPubKey) of the spent output from
+        prevout or utxo_set, or None if neither has it
+        """
+        if self.prevout is not None:
+            return self.prevout
+        utxo_set = self.utxo_set
+        if utxo_set is None or utxo_set.testnet != testnet:
+            return None
+        return utxo_set.get(self.prev_tx, self.prev_index)
+
     def value(self, testnet=False):
         """Get the output value by looking up the tx hash.
         Returns the amount in satoshi.
         """
+        utxo = self.utxo(testnet)
+        if utxo is not None:
+            return utxo[0]
         tx = self.fetch_tx(testnet=testnet)
         return tx.tx_outs[self.prev_index].amount
 
@@ -186,11 +800,18 @@ class TxIn:
         """Get the ScriptPubKey by looking up the tx hash.
         Returns a Script object.
         """
+        utxo = self.utxo(testnet)
+        if utxo is not None:
+            # split into cmds when they are used, like Script.parse
+            return Script(raw=utxo[1])
         tx = self.fetch_tx(testnet=testnet)
         return tx.tx_outs[self.prev_index].script_pubkey
 
 
 class TxOut:
+    __slots__ = ('amount', 'script_pubkey')
+    # an interning.InternPool that parse shares ScriptPubKeys through
+    intern_pool = None
 
     def __init__(self, amount, script_pubkey):
         self.amount = amount
@@ -205,11 +826,175 @@ class TxOut:
         return a TxOut object
         """
         amount = little_endian_to_int(s.read(8))
-        script_pubkey = Script.parse(s)
+        if cls.intern_pool is None:
+            script_pubkey = Script.parse(s)
+        else:
+            script_pubkey = cls.intern_pool.script(Script.read_raw(s))
         return cls(amount, script_pubkey)
 
+    def _serialize_key(self):
+        # what the serialization is built from, Tx caches it by this
+        return self.amount, self.script_pubkey.raw_serialize()
+
     def serialize(self):
         """Returns the byte serialization of the transaction output"""
-        result = int_to_little_endian(self.amount, 8)
-        result += self.script_pubkey.serialize()
-        return result
+        amount, script_pubkey = self._serialize_key()
+        return b''.join((
+            int_to_little_endian(amount, 8),
+            encode_varint(len(script_pubkey)),
+            script_pubkey,
+        ))
+
+
+class TxView:
+    """A serialized transaction inside a larger buffer, such as a bytes
+    object, a memoryview or an mmap of a file.
+    Creating a view only walks the transaction to record where the inputs
+    and outputs start. Fields are decoded when they are asked for and
+    scripts are handed out as memoryview slices, nothing is copied.
+    """
+
+    def __init__(self, buf, offset=0, testnet=False):
+        buf = memoryview(buf)
+        self.buf = buf
+        self.offset = offset
+        self.testnet = testnet
+        # a 0 marker and 1 flag in place of the number of inputs
+        self.segwit = buf[offset + 4] == 0 and buf[offset + 5] == 1
+        if self.segwit:
+            self.inputs_offset = offset + 6
+        else:
+            self.inputs_offset = offset + 4
+        num_inputs, i = read_varint_at(buf, self.inputs_offset)
+        # each input is prev_tx (32), prev_index (4), script_sig, sequence (4)
+        self.in_offsets = []
+        for _ in range(num_inputs):
+            self.in_offsets.append(i)
+            length, i = read_varint_at(buf, i + 36)
+            i += length + 4
+        num_outputs, i = read_varint_at(buf, i)
+        # each output is amount (8), script_pubkey
+        self.out_offsets = []
+        for _ in range(num_outputs):
+            self.out_offsets.append(i)
+            length, i = read_varint_at(buf, i + 8)
+            i += length
+        # witness stacks, one per input
+        self.witness_offsets = []
+        if self.segwit:
+            for _ in range(num_inputs):
+                self.witness_offsets.append(i)
+                num_items, i = read_varint_at(buf, i)
+                for _ in range(num_items):
+                    length, i = read_varint_at(buf, i)
+                    i += length
+        self.locktime_offset = i
+        # offset right after the transaction
+        self.end = i + 4
+        if self.end > len(buf):
+            raise SyntaxError('transaction runs past the end of the buffer')
+
+    def __repr__(self):
+        return 'TxView({}, {} bytes at {})'.format(self.id(), self.end - self.offset, self.offset)
+
+    @classmethod
+    def iter_all(cls, buf, offset=0, testnet=False):
+        """Yields a view for every transaction stored back to back in buf"""
+        buf = memoryview(buf)
+        while offset < len(buf):
+            view = cls(buf, offset, testnet=testnet)
+            yield view
+            offset = view.end
+
+    def raw(self):
+        """The whole transaction, with witness data if there is any"""
+        return self.buf[self.offset:self.end]
+
+    def hash(self):
+        """Binary hash of the legacy serialization"""
+        if not self.segwit:
+            return hash256(self.raw())[::-1]
+        # hash the legacy serialization straight out of the buffer,
+        # skipping the marker, flag and witnesses
+        buf = self.buf
+        first_witness = self.witness_offsets[0] if self.witness_offsets else self.locktime_offset
+        sha = hashlib.sha256(buf[self.offset:self.offset + 4])
+        sha.update(buf[self.inputs_offset:first_witness])
+        sha.update(buf[self.locktime_offset:self.end])
+        return hashlib.sha256(sha.digest()).digest()[::-1]
+
+    def id(self):
+        return self.hash().hex()
+
+    def whash(self):
+        """Binary hash of the serialization including witness data"""
+        return hash256(self.raw())[::-1]
+
+    def wtxid(self):
+        return self.whash().hex()
+
+    @property
+    def version(self):
+        return little_endian_to_int(self.buf[self.offset:self.offset + 4])
+
+    @property
+    def locktime(self):
+        return little_endian_to_int(self.buf[self.locktime_offset:self.locktime_offset + 4])
+
+    def prev_tx(self, index):
+        i = self.in_offsets[index]
+        return self.buf[i:i + 32].tobytes()[::-1]
+
+    def prev_index(self, index):
+        i = self.in_offsets[index] + 32
+        return little_endian_to_int(self.buf[i:i + 4])
+
+    def script_sig(self, index):
+        """Raw script_sig of an input, without the length prefix"""
+        length, i = read_varint_at(self.buf, self.in_offsets[index] + 36)
+        return self.buf[i:i + length]
+
+    def sequence(self, index):
+        length, i = read_varint_at(self.buf, self.in_offsets[index] + 36)
+        i += length
+        return little_endian_to_int(self.buf[i:i + 4])
+
+    def witness(self, index):
+        """Witness stack of an input as a list of memoryview slices"""
+        if not self.segwit:
+            return []
+        buf = self.buf
+        num_items, i = read_varint_at(buf, self.witness_offsets[index])
+        items = []
+        for _ in range(num_items):
+            length, i = read_varint_at(buf, i)
+            items.append(buf[i:i + length])
+            i += length
+        return items
+
+    def amount(self, index):
+        i = self.out_offsets[index]
+        return little_endian_to_int(self.buf[i:i + 8])
+
+    def amounts(self):
+        buf = self.buf
+        return [little_endian_to_int(buf[i:i + 8]) for i in self.out_offsets]
+
+    def script_pubkey(self, index):
+        """Raw script_pubkey of an output, without the length prefix"""
+        length, i = read_varint_at(self.buf, self.out_offsets[index] + 8)
+        return self.buf[i:i + length]
+
+    def tx_in(self, index):
+        script_sig = self.script_sig(index).tobytes()
+        witness = [item.tobytes() for item in self.witness(index)]
+        return TxIn(self.prev_tx(index), self.prev_index(index),
+                    Script(raw=script_sig), self.sequence(index), witness)
+
+    def tx_out(self, index):
+        script_pubkey = self.script_pubkey(index).tobytes()
+        return TxOut(self.amount(index), Script(raw=script_pubkey))
+
+    def tx(self):
+        """Parses the whole transaction into a Tx"""
+        return Tx.parse(BytesIO(self.raw()), testnet=self.testnet)
@@ -0,0 +1,185 @@
+"""Persistent transaction store.
+
+Transactions are appended back to back, as serialized, to a data file.
+Next to it an index file holds one fixed size record per transaction:
+
+    tx hash (32, internal byte order) | offset (8) | length (4)
+
+Opening a store only reads the index, the data file is read through an mmap
+and a transaction is parsed when it is asked for.
+"""
+import json
+import mmap
+import os
+import struct
+import threading
+from io import BytesIO
+
+from tx import Tx, TxView
+
+INDEX_RECORD = struct.Struct('<32sQI')
+
+
+class TxStore:
+    """Append-only transaction store keyed by tx id, opened lazily.
+    Safe to share between threads.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.index_filename = filename + '.idx'
+        self._lock = threading.Lock()
+        # tx hash -> (offset, length), None until the store is opened
+        self._index = None
+        self._data = None
+        self._idx = None
+        self._map = None
+        self._size = 0
+
+    def __repr__(self):
+        return 'TxStore({})'.format(self.filename)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        self._open()
+        return len(self._index)
+
+    def __contains__(self, tx_id):
+        self._open()
+        return bytes.fromhex(tx_id)[::-1] in self._index
+
+    def _open(self):
+        if self._index is not None:
+            return
+        with self._lock:
+            if self._index is not None:
+                return
+            index = {}
+            self._data = open(self.filename, 'ab+')
+            self._idx = open(self.index_filename, 'ab+')
+            self._idx.seek(0)
+            raw_index = self._idx.read()
+            # drop a record that was only partly written
+            usable = len(raw_index) - len(raw_index) % INDEX_RECORD.size
+            if usable != len(raw_index):
+                self._idx.truncate(usable)
+            end = 0
+            for tx_hash, offset, length in INDEX_RECORD.iter_unpack(raw_index[:usable]):
+                index[tx_hash] = (offset, length)
+                end = max(end, offset + length)
+            self._size = os.fstat(self._data.fileno()).st_size
+            if end < self._size:
+                self._recover(index, end)
+            self._index = index
+
+    def _recover(self, index, end):
+        """Indexes transactions appended after the last index record and
+        cuts off a transaction that was only partly written
+        """
+        self._data.seek(end)
+        tail = self._data.read()
+        offset = 0
+        records = []
+        while offset < len(tail):
+            try:
+                view = TxView(tail, offset)
+            except (IndexError, SyntaxError):
+                break
+            tx_hash = view.hash()[::-1]
+            index[tx_hash] = (end + offset, view.end - offset)
+            records.append(INDEX_RECORD.pack(tx_hash, end + offset, view.end - offset))
+            offset = view.end
+        if offset < len(tail):
+            self._data.truncate(end + offset)
+        self._idx.write(b''.join(records))
+        self._idx.flush()
+        self._size = end + offset
+
+    def _buffer(self, end):
+        """The mmap of the data file, remapped if it does not reach end yet"""
+        if self._map is None or len(self._map) < end:
+            if self._map is not None:
+                self._map.close()
+            self._map = mmap.mmap(self._data.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._map
+
+    def raw(self, tx_id):
+        """Returns the serialized transaction or None"""
+        self._open()
+        location = self._index.get(bytes.fromhex(tx_id)[::-1])
+        if location is None:
+            return None
+        offset, length = location
+        with self._lock:
+            return self._buffer(offset + length)[offset:offset + length]
+
+    def get(self, tx_id, testnet=False):
+        """Returns the Tx or None"""
+        raw = self.raw(tx_id)
+        if raw is None:
+            return None
+        return Tx.parse(BytesIO(raw), testnet=testnet)
+
+    def view(self, tx_id, testnet=False):
+        """Returns a TxView or None"""
+        raw = self.raw(tx_id)
+        if raw is None:
+            return None
+        return TxView(raw, testnet=testnet)
+
+    def put(self, tx):
+        """Appends tx unless it is already stored, returns its id"""
+        return self.put_raw(tx.serialize(), tx.hash())
+
+    def put_raw(self, raw, tx_hash=None):
+        """Appends a serialized transaction unless it is already stored,
+        returns its id
+        """
+        self._open()
+        if tx_hash is None:
+            tx_hash = TxView(raw).hash()
+        key = tx_hash[::-1]
+        with self._lock:
+            if key not in self._index:
+                offset = self._size
+                self._data.write(raw)
+                self._data.flush()
+                self._size += len(raw)
+                # the data goes first so the index never points past it
+                self._idx.write(INDEX_RECORD.pack(key, offset, len(raw)))
+                self._idx.flush()
+                self._index[key] = (offset, len(raw))
+        return tx_hash.hex()
+
+    def import_json(self, filename):
+        """Adds every transaction of a JSON cache written by
+        TxFetcher.dump_cache, returns how many were new
+        """
+        with open(filename, 'r') as f:
+            disk_cache = json.load(f)
+        before = len(self)
+        for tx_id, raw_hex in disk_cache.items():
+            if tx_id in self:
+                continue
+            raw = bytes.fromhex(raw_hex)
+            if self.put_raw(raw) != tx_id:
+                raise ValueError('{} is not the id of its transaction'.format(tx_id))
+        return len(self) - before
+
+    def ids(self):
+        self._open()
+        return [tx_hash[::-1].hex() for tx_hash in self._index]
+
+    def close(self):
+        with self._lock:
+            if self._map is not None:
+                self._map.close()
+            for f in (self._data, self._idx):
+                if f is not None:
+                    f.close()
+            self._index = self._data = self._idx = self._map = None
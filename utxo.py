@@ -0,0 +1,119 @@
+"""Unspent transaction outputs, kept locally so inputs can be valued
+without fetching the transactions they spend.
+"""
+from helper import int_to_little_endian, little_endian_to_int
+from script import Script
+from tx import TxView
+
+COINBASE_PREV_TX = b'\x00' * 32
+COINBASE_PREV_INDEX = 0xffffffff
+
+
+def outpoint(prev_tx, prev_index):
+    """The key of an output: prev_tx as in TxIn followed by the index"""
+    return bytes(prev_tx) + int_to_little_endian(prev_index, 4)
+
+
+class UtxoSet:
+    """Outputs that have not been spent yet, built up by adding
+    transactions in the order they were confirmed.
+    Every output is stored as one bytes object, the amount (8 bytes little
+    endian) followed by the raw ScriptPubKey.
+    Install one as TxIn.utxo_set to have TxIn.value, TxIn.script_pubkey and
+    Tx.fee look there before fetching anything.
+    """
+
+    def __init__(self, testnet=False):
+        self.testnet = testnet
+        self.outputs = {}
+        # spends of outputs that were never added
+        self.missing = 0
+
+    def __repr__(self):
+        return 'UtxoSet({} outputs)'.format(len(self.outputs))
+
+    def __len__(self):
+        return len(self.outputs)
+
+    def __contains__(self, key):
+        return outpoint(*key) in self.outputs
+
+    def get(self, prev_tx, prev_index):
+        """Returns (amount, raw ScriptPubKey) or None"""
+        entry = self.outputs.get(outpoint(prev_tx, prev_index))
+        if entry is None:
+            return None
+        return little_endian_to_int(entry[:8]), entry[8:]
+
+    def amount(self, prev_tx, prev_index):
+        entry = self.outputs.get(outpoint(prev_tx, prev_index))
+        if entry is None:
+            return None
+        return little_endian_to_int(entry[:8])
+
+    def script_pubkey(self, prev_tx, prev_index):
+        """Returns the ScriptPubKey as a Script or None"""
+        entry = self.outputs.get(outpoint(prev_tx, prev_index))
+        if entry is None:
+            return None
+        return Script(raw=entry[8:])
+
+    def _spend(self, prev_tx, prev_index, undo):
+        if prev_tx == COINBASE_PREV_TX and prev_index == COINBASE_PREV_INDEX:
+            return
+        key = outpoint(prev_tx, prev_index)
+        entry = self.outputs.pop(key, None)
+        if entry is None:
+            self.missing += 1
+        elif undo is not None:
+            undo.append((key, entry))
+
+    def _create(self, tx_hash, index, amount, script_pubkey, undo):
+        # OP_RETURN outputs can never be spent
+        if script_pubkey[:1] == b'\x6a':
+            return
+        key = tx_hash + int_to_little_endian(index, 4)
+        if undo is not None:
+            undo.append((key, self.outputs.get(key)))
+        self.outputs[key] = int_to_little_endian(amount, 8) + bytes(script_pubkey)
+
+    def add(self, tx, undo=None):
+        """Spends the inputs and adds the outputs of a Tx or TxView.
+        With an undo list, what is needed to take the transaction back out
+        with rollback is appended to it.
+        """
+        if isinstance(tx, TxView):
+            for i in range(len(tx.in_offsets)):
+                self._spend(tx.prev_tx(i), tx.prev_index(i), undo)
+            tx_hash = tx.hash()
+            for i in range(len(tx.out_offsets)):
+                self._create(tx_hash, i, tx.amount(i), tx.script_pubkey(i), undo)
+        else:
+            for tx_in in tx.tx_ins:
+                self._spend(tx_in.prev_tx, tx_in.prev_index, undo)
+            tx_hash = tx.hash()
+            for i, tx_out in enumerate(tx.tx_outs):
+                self._create(tx_hash, i, tx_out.amount, tx_out.script_pubkey.raw_serialize(), undo)
+
+    def rollback(self, undo):
+        """Takes back the transactions added with the undo list, the count
+        of missing spends stays as it is
+        """
+        outputs = self.outputs
+        for key, entry in reversed(undo):
+            if entry is None:
+                del outputs[key]
+            else:
+                outputs[key] = entry
+        del undo[:]
+
+    def update(self, txs):
+        """Adds every transaction of an iterable, such as the transactions of
+        a block or TxView.iter_all over a file
+        """
+        for tx in txs:
+            self.add(tx)
+
+    def size(self):
+        """Bytes of keys and values stored, not counting object overhead"""
+        return sum(len(key) + len(value) for key, value in self.outputs.items())